@@ -5,9 +5,14 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+PROJECT_ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '../..'))
+ENGINE_EXECUTION_MODES = ("sequential", "parallel")
+ENGINE_GRAPH_OPTIMIZATION_LEVELS = ("disable", "basic", "extended", "all")
+REGISTRY_BUDGET_MODES = ("rss", "model_size")
+
 def load_config() -> dict[str, any]:
     # Load configuration file
-    with open(os.path.join(os.path.dirname(__file__), '../..', 'config.toml'), 'rb') as f:
+    with open(os.path.join(PROJECT_ROOT, 'config.toml'), 'rb') as f:
         config = tomllib.load(f)
         
     if not config['worker'].get('control_port') or type(config['worker']['control_port']) is not int or config['worker']['control_port'] < 1 or config['worker']['control_port'] > 65535:
@@ -42,6 +47,12 @@ def load_config() -> dict[str, any]:
         logger.warning("Worker WiFi interface is not defined in configuration, defaulting to wlan0")
         config['worker']['wifi_interface'] = "wlan0"
     
+    for key, default in (('data_threads', 1), ('data_max_inflight', 4)):
+        if type(config['worker'].get(key, default)) is not int or config['worker'].get(key, default) < 1:
+            logger.warning(f"Worker {key} is invalid in configuration, defaulting to {default}")
+            config['worker'][key] = default
+        config['worker'].setdefault(key, default)
+
     if not config['controller'].get('ethernet_interface') or type(config['controller']['ethernet_interface']) is not str:
         logger.warning("Controller Ethernet interface is not defined in configuration, defaulting to eth0")
         config['controller']['ethernet_interface'] = "eth0"
@@ -50,6 +61,19 @@ def load_config() -> dict[str, any]:
         logger.warning("Controller WiFi interface is not defined in configuration, defaulting to wlan0")
         config['controller']['wifi_interface'] = "wlan0"
     
+    batch_sizes = config['controller'].get('capability_batch_sizes', [1, 2, 4])
+    if type(batch_sizes) is not list or not batch_sizes or any(type(b) is not int or b < 1 for b in batch_sizes):
+        logger.warning("Controller capability_batch_sizes is invalid in configuration, defaulting to [1, 2, 4]")
+        config['controller']['capability_batch_sizes'] = [1, 2, 4]
+    config['controller'].setdefault('capability_batch_sizes', [1, 2, 4])
+
+    for key, default, minimum in (('capability_iterations', 3, 1), ('capability_refresh_interval', 3600, 0),
+                                  ('capability_probe_bytes', 1048576, 1)):
+        if type(config['controller'].get(key, default)) is not int or config['controller'].get(key, default) < minimum:
+            logger.warning(f"Controller {key} is invalid in configuration, defaulting to {default}")
+            config['controller'][key] = default
+        config['controller'].setdefault(key, default)
+
     # [Network]
     # wifi_ssid = "FYP_Cluster_AP"
     # wifi_password = "fyp_cluster_pass"
@@ -61,5 +85,66 @@ def load_config() -> dict[str, any]:
     if not config['network'].get('wifi_password') or type(config['network']['wifi_password']) is not str or len(config['network']['wifi_password']) < 8:
         logger.warning("WiFi Password is not defined or invalid in configuration, defaulting to fyp_cluster_pass")
         config['network']['wifi_password'] = "fyp_cluster_pass"
-    
+
+    # [engine] onnxruntime session options, every key is optional
+    engine = config.setdefault('engine', {})
+
+    for key in ('intra_op_num_threads', 'inter_op_num_threads'):
+        if type(engine.get(key, 0)) is not int or engine.get(key, 0) < 0:
+            logger.warning(f"Engine {key} is invalid in configuration, defaulting to 0 (onnxruntime default)")
+            engine[key] = 0
+        engine.setdefault(key, 0)
+
+    if engine.get('execution_mode', "sequential") not in ENGINE_EXECUTION_MODES:
+        logger.warning(f"Engine execution_mode is invalid in configuration (expected one of {ENGINE_EXECUTION_MODES}), defaulting to sequential")
+        engine['execution_mode'] = "sequential"
+    engine.setdefault('execution_mode', "sequential")
+
+    if engine.get('graph_optimization_level', "all") not in ENGINE_GRAPH_OPTIMIZATION_LEVELS:
+        logger.warning(f"Engine graph_optimization_level is invalid in configuration (expected one of {ENGINE_GRAPH_OPTIMIZATION_LEVELS}), defaulting to all")
+        engine['graph_optimization_level'] = "all"
+    engine.setdefault('graph_optimization_level', "all")
+
+    for key in ('enable_mem_pattern', 'enable_cpu_mem_arena', 'optimized_model_cache'):
+        if type(engine.get(key, True)) is not bool:
+            logger.warning(f"Engine {key} is invalid in configuration, defaulting to true")
+            engine[key] = True
+        engine.setdefault(key, True)
+
+    if type(engine.get('io_binding', False)) is not bool:
+        logger.warning("Engine io_binding is invalid in configuration, defaulting to false")
+        engine['io_binding'] = False
+    engine.setdefault('io_binding', False)
+
+    if not engine.get('cache_dir') or type(engine['cache_dir']) is not str:
+        logger.warning("Engine cache_dir is not defined or invalid in configuration, defaulting to .cache/onnx")
+        engine['cache_dir'] = ".cache/onnx"
+    # Relative cache paths are resolved against the project root, like config.toml itself
+    if not os.path.isabs(engine['cache_dir']):
+        engine['cache_dir'] = os.path.normpath(os.path.join(PROJECT_ROOT, engine['cache_dir']))
+
+    # [registry] worker model registry
+    registry = config.setdefault('registry', {})
+    if type(registry.get('memory_budget_mb', 0)) not in (int, float) or registry.get('memory_budget_mb', 0) < 0:
+        logger.warning("Registry memory_budget_mb is invalid in configuration, defaulting to 0 (unlimited)")
+        registry['memory_budget_mb'] = 0
+    registry.setdefault('memory_budget_mb', 0)
+
+    if registry.get('budget_mode', "rss") not in REGISTRY_BUDGET_MODES:
+        logger.warning(f"Registry budget_mode is invalid in configuration (expected one of {REGISTRY_BUDGET_MODES}), defaulting to rss")
+        registry['budget_mode'] = "rss"
+    registry.setdefault('budget_mode', "rss")
+
+    # [models.<name>] model_path + adapter_path, invalid entries are dropped
+    models = config.setdefault('models', {})
+    for name in list(models.keys()):
+        entry = models[name]
+        if type(entry) is not dict or type(entry.get('model_path')) is not str or type(entry.get('adapter_path')) is not str:
+            logger.warning(f"Model '{name}' needs string model_path and adapter_path in configuration, ignoring it")
+            del models[name]
+            continue
+        for key in ('model_path', 'adapter_path'):
+            if not os.path.isabs(entry[key]):
+                entry[key] = os.path.normpath(os.path.join(PROJECT_ROOT, entry[key]))
+
     return config
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Compact detection results shared by workers and the controller
+All detections of a batch live in one contiguous record array (x1, y1, x2, y2, score, cls, img) sorted by
+image, with per-image offsets for zero-copy views. Batches from many workers merge with one concatenate
+and travel as a small binary blob (header + counts + raw records).
+"""
+import struct
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+DETECTION_DTYPE = np.dtype([
+    ("x1", "<f4"), ("y1", "<f4"), ("x2", "<f4"), ("y2", "<f4"),
+    ("score", "<f4"), ("cls", "<i4"), ("img", "<i4"),
+])
+
+# magic, version, reserved, num_images, num_detections (16 bytes, keeps the counts & records 4-byte aligned)
+_HEADER = struct.Struct("<4sHHII")
+_MAGIC = b"DETS"
+_VERSION = 1
+
+
+@dataclass
+class DetectionBatch:
+    records: np.ndarray  # (N,) DETECTION_DTYPE sorted by img
+    offsets: np.ndarray  # (num_images + 1,) int64, image i is records[offsets[i]:offsets[i + 1]]
+
+    @classmethod
+    def from_per_image(cls, per_image: Sequence[np.ndarray]) -> "DetectionBatch":
+        """Build from per-image (M, 6) [x1, y1, x2, y2, score, cls] arrays with a single allocation."""
+        counts = np.array([len(b) for b in per_image], dtype=np.int64)
+        offsets = np.zeros(len(per_image) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        records = np.empty(int(offsets[-1]), dtype=DETECTION_DTYPE)
+        for i, boxes in enumerate(per_image):
+            if len(boxes) == 0:
+                continue
+            rows = records[offsets[i]:offsets[i + 1]]
+            boxes = np.asarray(boxes)
+            for j, name in enumerate(("x1", "y1", "x2", "y2", "score")):
+                rows[name] = boxes[:, j]
+            rows["cls"] = boxes[:, 5]
+            rows["img"] = i
+        return cls(records=records, offsets=offsets)
+
+    @classmethod
+    def empty(cls, num_images: int = 0) -> "DetectionBatch":
+        return cls(records=np.empty(0, dtype=DETECTION_DTYPE), offsets=np.zeros(num_images + 1, dtype=np.int64))
+
+    @property
+    def num_images(self) -> int:
+        return len(self.offsets) - 1
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def image(self, i: int) -> np.ndarray:
+        """Zero-copy view of image i's records."""
+        return self.records[self.offsets[i]:self.offsets[i + 1]]
+
+    def counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def boxes(self, i: Optional[int] = None) -> np.ndarray:
+        """(M, 6) float32 [x1, y1, x2, y2, score, cls] copy of image i (or every image), the classic format."""
+        rows = self.records if i is None else self.image(i)
+        out = np.empty((len(rows), 6), dtype=np.float32)
+        for j, name in enumerate(("x1", "y1", "x2", "y2", "score", "cls")):
+            out[:, j] = rows[name]
+        return out
+
+    # --- Merging
+    @classmethod
+    def merge(cls, batches: Sequence["DetectionBatch"]) -> "DetectionBatch":
+        """Concatenate batches image-wise, img indices are renumbered to follow on from the previous batch."""
+        if not batches:
+            return cls.empty()
+        records = np.concatenate([b.records for b in batches])
+        offsets = [np.zeros(1, dtype=np.int64)]
+        image_base = record_base = 0
+        pos = 0
+        for b in batches:
+            n = len(b.records)
+            records["img"][pos:pos + n] += image_base
+            offsets.append(b.offsets[1:] + record_base)
+            pos += n
+            image_base += b.num_images
+            record_base += n
+        return cls(records=records, offsets=np.concatenate(offsets))
+
+    # --- Binary serialization
+    def to_bytes(self) -> bytes:
+        header = _HEADER.pack(_MAGIC, _VERSION, 0, self.num_images, len(self.records))
+        counts = self.counts().astype("<u4")
+        return b"".join([header, counts.tobytes(), np.ascontiguousarray(self.records).tobytes()])
+
+    @classmethod
+    def from_bytes(cls, data) -> "DetectionBatch":
+        """Inverse of to_bytes, the records are a read-only view on `data` (no copy)."""
+        buf = memoryview(data)
+        if len(buf) < _HEADER.size:
+            raise ValueError("Detection payload too short")
+        magic, version, _, num_images, num_dets = _HEADER.unpack_from(buf)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Not a detection payload (magic={magic!r}, version={version})")
+        expected = _HEADER.size + num_images * 4 + num_dets * DETECTION_DTYPE.itemsize
+        if len(buf) != expected:
+            raise ValueError(f"Detection payload size mismatch: expected {expected} bytes, got {len(buf)}")
+        counts = np.frombuffer(buf, dtype="<u4", count=num_images, offset=_HEADER.size)
+        offsets = np.zeros(num_images + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        if offsets[-1] != num_dets:
+            raise ValueError("Detection payload counts do not add up to the number of detections")
+        records = np.frombuffer(buf, dtype=DETECTION_DTYPE, count=num_dets, offset=_HEADER.size + num_images * 4)
+        return cls(records=records, offsets=offsets)
@@ -69,6 +69,29 @@ class WorkerControlInfo():
 class WorkerNetworkModeRequest(BaseModel):
     mode: str # "ethernet" or "wifi"
 
+class ModelCapability(BaseModel):
+    images_per_s: dict[int, float] = {} # Batch size -> images/s (dummy mode, no postprocess)
+    latency_ms: dict[int, float] = {} # Batch size -> mean request latency
+    best_batch_size: Optional[int] = None
+    load_time_s: Optional[float] = None # Engine load time of the last (re)load
+    error: Optional[str] = None # Set if the model could not be benchmarked
+
+class WorkerCapability(BaseModel):
+    fingerprint: str # Hardware + model files + engine config, the worker re-reports it in heartbeats
+    models: dict[str, ModelCapability]
+    hardware: dict[str, Any] # Machine, CPU model / count, accelerators, onnxruntime providers...
+    data_plane: ConnectionType # Data plane the probe ran over
+    rtt_ms: Optional[float] = None
+    upload_mbps: Optional[float] = None # Controller -> worker, Mbit/s
+    download_mbps: Optional[float] = None # Worker -> controller, Mbit/s
+    timestamp: int # Controller time of the benchmark
+
+    def peak_images_per_s(self, model: Optional[str] = None) -> Optional[float]:
+        """Best images/s of `model` over the benchmarked batch sizes (mean over models if None)."""
+        peaks = [max(m.images_per_s.values()) for name, m in self.models.items()
+                 if m.images_per_s and (model is None or name == model)]
+        return sum(peaks) / len(peaks) if peaks else None
+
 class WorkerHeartbeat(BaseModel):
     worker_id: int # -1: Unassigned, 0-99: Assigned Worker ID
     serial: str # Hardware serial number
@@ -78,6 +101,7 @@ class WorkerHeartbeat(BaseModel):
     data_plane: ConnectionType # Data interface used by the worker
     data_ip_address: str # Current IP address of the worker data interface
     timestamp: int # Timestamp of the heartbeat
+    capability_fingerprint: Optional[str] = None # Changes with hardware / models, see worker/capability.py
 
 class WorkerRegistration(BaseModel):
     serial: str
@@ -87,6 +111,7 @@ class WorkerRegistration(BaseModel):
     data_plane: ConnectionType
     timestamp: int
     status: WorkerStatus
+    capability: Optional[WorkerCapability] = None # Set by the onboarding benchmark, see controller/capability_manager.py
 
 class ConnectivityTestResponse(BaseModel):
     from_identifier: str
@@ -105,7 +130,9 @@ Dummy mode: Worker generates random data for inference
 class TensorPayload:
     dtype: str          # e.g. "float32" "int64"...
     shape: list[int]    # e.g. [1, 416, 416, 3]
-    data: bytes         # np.ndarray raw bytes
+    data: bytes         # np.ndarray raw bytes (a memoryview / ndarray on the binary wire path, see common/wire.py)
+    encoding: Optional[str] = None           # transport encoding, e.g. "float16+zlib" (see common/tensor_codec.py)
+    params: Optional[dict[str, Any]] = None  # encoding parameters (wire dtype, scale, zero_point)
 
 def ndarray_to_payload(arr: np.ndarray) -> TensorPayload:
     if not arr.flags["C_CONTIGUOUS"]:
@@ -114,6 +141,9 @@ def ndarray_to_payload(arr: np.ndarray) -> TensorPayload:
 
 
 def payload_to_ndarray(p: TensorPayload) -> np.ndarray:
+    if p.encoding is not None:
+        from common.tensor_codec import decode_payload
+        return decode_payload(p)
     arr = np.frombuffer(p.data, dtype=np.dtype(p.dtype))
     return arr.reshape(p.shape)
 
@@ -0,0 +1,225 @@
+"""
+Shared-memory tensor transport for processes on the same host (controller, local engines, benchmark drivers).
+A producer owns a ShmRing: one multiprocessing.shared_memory segment split into fixed-size slots. A request's
+tensors are written once into a free slot and travel as ordinary TensorPayloads with encoding "shm" and
+params {segment, offset, slot, generation, dtype}, so InferenceRequest / common/wire.py / engine.handle_request
+stay the same and only the descriptors cross the process boundary. payload_to_ndarray maps them without copying.
+
+Slot lifecycle, tracked in a small [state, generation, acked] table at the start of the segment:
+    put       producer takes a free slot, bumps its generation, writes the tensors (BUSY)
+    map       consumer maps the descriptors as read-only ndarrays (stale or acked generations are rejected)
+    ack       consumer (release_payloads / release_request) stores the slot's generation in `acked`
+    reclaim   producer frees the slot, on ShmRing.release or when put finds it acked
+Only the producer writes state and generation and only the consumer writes acked, each an aligned 8-byte store,
+so no read-modify-write crosses the process boundary: a late ack carries an old generation and cannot free a
+slot that was reused meanwhile. Arrays mapped from a slot must not be used after it was released, copy them to
+keep. When every slot is busy, put waits up to `timeout` (backpressure on the producer).
+
+Consumers map the segment without registering it with the resource tracker (which would unlink it when the
+consumer exits): SharedMemory(track=False) on Python >= 3.13, before that CPython's _posixshmem (the module
+SharedMemory itself is built on), plain SharedMemory where neither is available.
+"""
+import logging
+import mmap
+import os
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from common.model import InferenceRequest, TensorPayload
+
+_TRACK_PARAM = sys.version_info >= (3, 13)
+try:
+    import _posixshmem
+except ImportError:  # Windows / other implementations
+    _posixshmem = None
+
+logger = logging.getLogger(__name__)
+
+SHM_ENCODING = "shm"
+ALIGNMENT = 64
+
+_FREE = 0
+_BUSY = 1
+_FIELDS = 3  # state, generation (producer-written), acked generation (consumer-written)
+
+
+def _align(n: int) -> int:
+    return n + (-n % ALIGNMENT)
+
+
+def _state_table(buf: memoryview, num_slots: int) -> np.ndarray:
+    # (num_slots, 3) int64 [state, generation, acked]
+    return np.ndarray((num_slots, _FIELDS), dtype=np.int64, buffer=buf)
+
+
+class ShmRing:
+    """Producer side, owns (creates and unlinks) the segment. Thread-safe."""
+
+    def __init__(self, slot_size: int, num_slots: int = 4, name: Optional[str] = None):
+        if slot_size < 1 or num_slots < 1:
+            raise ValueError("slot_size and num_slots must be >= 1")
+        self.slot_size = _align(slot_size)
+        self.num_slots = num_slots
+        self.header_size = _align(num_slots * _FIELDS * 8)
+        self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                               size=self.header_size + self.slot_size * num_slots)
+        self.name = self._shm.name
+        self._state = _state_table(self._shm.buf, num_slots)
+        self._state[:] = 0
+        self._lock = threading.Lock()
+        self._next = 0
+        self._closed = False
+
+    def _acquire(self, timeout: Optional[float]) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("ShmRing is closed")
+                for k in range(self.num_slots):
+                    slot = (self._next + k) % self.num_slots
+                    if not self._in_use_locked(slot):
+                        self._state[slot, 1] += 1
+                        self._state[slot, 0] = _BUSY
+                        self._next = (slot + 1) % self.num_slots
+                        return slot
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"No free slot in shared memory ring {self.name} ({self.num_slots} busy)")
+            time.sleep(0.0005)
+
+    def _in_use_locked(self, slot: int) -> bool:
+        return self._state[slot, 0] == _BUSY and self._state[slot, 2] != self._state[slot, 1]
+
+    def put(self, feed: dict[str, np.ndarray], timeout: Optional[float] = None) -> dict[str, TensorPayload]:
+        """Copy `feed` into one slot, returns the descriptor payloads (encoding "shm")."""
+        arrays = {name: np.ascontiguousarray(arr) for name, arr in feed.items()}
+        needed = sum(_align(arr.nbytes) for arr in arrays.values())
+        if needed > self.slot_size:
+            raise ValueError(f"Feed of {needed} bytes does not fit a {self.slot_size} byte slot of {self.name}")
+        slot = self._acquire(timeout)
+        generation = int(self._state[slot, 1])
+        offset = self.header_size + slot * self.slot_size
+        payloads = {}
+        for name, arr in arrays.items():
+            dst = np.ndarray(arr.shape, dtype=arr.dtype, buffer=self._shm.buf, offset=offset)
+            np.copyto(dst, arr)
+            payloads[name] = TensorPayload(dtype=str(arr.dtype), shape=list(arr.shape), data=b"", encoding=SHM_ENCODING,
+                                           params={"segment": self.name, "offset": offset, "slot": slot,
+                                                   "generation": generation, "dtype": arr.dtype.str})
+            offset += _align(arr.nbytes)
+        return payloads
+
+    def request(self, model: str, feed: dict[str, np.ndarray], timeout: Optional[float] = None, **kwargs) -> InferenceRequest:
+        """Tensor mode request whose inputs live in this ring, drop-in for wire.feed_to_request on the same host."""
+        return InferenceRequest(model=model, mode="tensor", inputs=self.put(feed, timeout), **kwargs)
+
+    def release(self, payloads: Iterable[TensorPayload]):
+        """Producer-side release, e.g. once the response for the request arrived (whether or not it was acked)."""
+        with self._lock:
+            for p in payloads:
+                params = p.params or {}
+                if p.encoding != SHM_ENCODING or params.get("segment") != self.name or self._closed:
+                    continue
+                if self._state[params["slot"], 1] == params["generation"]:
+                    self._state[params["slot"], 0] = _FREE
+
+    def busy_slots(self) -> int:
+        with self._lock:
+            return sum(self._in_use_locked(slot) for slot in range(self.num_slots))
+
+    def close(self):
+        """Unlink the segment, consumers that still have it mapped keep their mapping until they detach."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            del self._state
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- Consumer side
+_attached: dict[str, Any] = {}
+_attached_lock = threading.Lock()
+
+
+def _open_segment(segment: str):
+    # SharedMemory registers the segment with the resource tracker shared by the process tree, which would
+    # have it unlinked when this (consumer) process exits
+    if _TRACK_PARAM:
+        return shared_memory.SharedMemory(name=segment, track=False)
+    if _posixshmem is None:
+        return shared_memory.SharedMemory(name=segment)
+    fd = _posixshmem.shm_open("/" + segment, os.O_RDWR, mode=0o600)
+    try:
+        return mmap.mmap(fd, os.fstat(fd).st_size)
+    finally:
+        os.close(fd)
+
+
+def _attach(segment: str) -> memoryview:
+    with _attached_lock:
+        handle = _attached.get(segment)
+        if handle is None:
+            handle = _attached[segment] = _open_segment(segment)
+    return handle.buf if isinstance(handle, shared_memory.SharedMemory) else memoryview(handle)
+
+
+def _slot_state(buf: memoryview, slot: int) -> np.ndarray:
+    return np.ndarray((_FIELDS,), dtype=np.int64, buffer=buf, offset=slot * _FIELDS * 8)
+
+
+def map_payload(p: TensorPayload) -> np.ndarray:
+    """Read-only ndarray view of a "shm" payload (no copy), valid until the slot is released."""
+    params: dict[str, Any] = p.params or {}
+    buf = _attach(params["segment"])
+    state = _slot_state(buf, params["slot"])
+    if state[0] != _BUSY or state[1] != params["generation"] or state[2] == params["generation"]:
+        raise ValueError(f"Stale shared memory descriptor for slot {params['slot']} of {params['segment']}")
+    arr = np.ndarray(p.shape, dtype=np.dtype(params["dtype"]), buffer=buf, offset=params["offset"])
+    arr.flags.writeable = False
+    return arr
+
+
+def release_payloads(payloads: Iterable[TensorPayload]):
+    """Ack the slots behind "shm" payloads so the producer can reuse them, other encodings are ignored."""
+    released = set()
+    for p in payloads:
+        if p.encoding != SHM_ENCODING:
+            continue
+        params = p.params or {}
+        key = (params["segment"], params["slot"], params["generation"])
+        if key in released:
+            continue
+        released.add(key)
+        # Only ever written here, an ack of a generation the producer has moved past is simply ignored
+        _slot_state(_attach(params["segment"]), params["slot"])[2] = params["generation"]
+
+
+def release_request(req: InferenceRequest):
+    """Consumer-side release of a request's inputs once the engine is done with them."""
+    if req.inputs:
+        release_payloads(req.inputs.values())
+
+
+def detach_all():
+    """Drop this process's mappings (arrays mapped from them must be gone)."""
+    with _attached_lock:
+        for segment, handle in list(_attached.items()):
+            try:
+                handle.close()
+            except BufferError:
+                logger.warning(f"Shared memory segment {segment} still has mapped arrays, keeping it attached")
+                continue
+            del _attached[segment]
@@ -0,0 +1,267 @@
+"""
+Optional transport encodings for TensorPayload, for links where bytes cost more than CPU (e.g. the WiFi data plane).
+An encoding is "<precision>", "<compression>" or "<precision>+<compression>":
+    float16   lossy, |x - x'| <= max(|x| * 2**-11, 2**-25) for |x| <= 65504 (half the bytes)
+    uint8     lossy, affine quantization q = round(x / scale) + zero_point, |x - x'| <= scale / 2 (quarter)
+    zlib      lossless, level 1 (stdlib)
+    lz4       lossless, much faster than zlib at a lower ratio, needs the `lz4` package
+The payload keeps the logical dtype / shape, `encoding` and `params` (wire dtype, scale, zero_point) tell the
+receiver how to get the array back, payload_to_ndarray decodes transparently.
+Same-host "shm" descriptors (common/shm_transport.py) are mapped here as well.
+LinkPolicy picks the encoding per link from the measured link throughput and codec CPU cost.
+"""
+import logging
+import time
+import zlib
+from typing import Any, Optional, Union
+
+import numpy as np
+
+from common.model import ConnectionType, TensorPayload
+from common.shm_transport import SHM_ENCODING, map_payload
+
+logger = logging.getLogger(__name__)
+
+try:
+    import lz4.frame as _lz4
+except ImportError:
+    _lz4 = None
+
+PRECISIONS = ("float16", "uint8")
+COMPRESSORS = ("zlib", "lz4")
+
+_FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+
+def available_encodings(lossy: bool = True) -> list[Optional[str]]:
+    """Every encoding usable in this environment, None is the plain raw transport."""
+    compressors = [c for c in COMPRESSORS if c != "lz4" or _lz4 is not None]
+    encodings: list[Optional[str]] = [None, *compressors]
+    if lossy:
+        for precision in PRECISIONS:
+            encodings.append(precision)
+            encodings.extend(f"{precision}+{c}" for c in compressors)
+    return encodings
+
+
+def parse_encoding(encoding: Optional[str]) -> tuple[Optional[str], Optional[str]]:
+    """"float16+zlib" -> ("float16", "zlib"), "zlib" -> (None, "zlib"), None / "raw" -> (None, None)"""
+    if encoding is None or encoding == "raw":
+        return None, None
+    precision = compressor = None
+    for part in encoding.split("+"):
+        if part in PRECISIONS and precision is None:
+            precision = part
+        elif part in COMPRESSORS and compressor is None:
+            compressor = part
+        else:
+            raise ValueError(f"Unsupported tensor encoding: {encoding}")
+    if compressor == "lz4" and _lz4 is None:
+        raise ImportError("The lz4 tensor encoding needs the `lz4` package (pip install lz4)")
+    return precision, compressor
+
+
+def is_lossy(encoding: Optional[str]) -> bool:
+    return parse_encoding(encoding)[0] is not None
+
+
+# --- Precision
+def _quantize_uint8(arr: np.ndarray) -> tuple[np.ndarray, dict[str, Any]]:
+    lo = min(float(arr.min()), 0.0) if arr.size else 0.0
+    hi = max(float(arr.max()), 0.0) if arr.size else 0.0
+    if not (np.isfinite(lo) and np.isfinite(hi)):
+        raise ValueError("uint8 quantization needs finite values")
+    if hi == lo:
+        return np.zeros(arr.shape, dtype=np.uint8), {"scale": 1.0, "zero_point": 0}
+    # The range includes 0 so zero_point is a valid uint8 and 0 stays exact (padding, ReLU outputs)
+    scale = (hi - lo) / 255.0
+    zero_point = int(np.clip(round(-lo / scale), 0, 255))
+    # Rounding zero_point can push an end of the range out by up to scale / 2, widen scale to cover it again
+    if zero_point < 255:
+        scale = max(scale, hi / (255 - zero_point))
+    if zero_point > 0:
+        scale = max(scale, -lo / zero_point)
+    q = np.empty(arr.shape, dtype=np.float32)
+    np.divide(arr, scale, out=q, casting="unsafe")
+    q += zero_point
+    np.rint(q, out=q)
+    np.clip(q, 0, 255, out=q)
+    return q.astype(np.uint8), {"scale": scale, "zero_point": zero_point}
+
+
+def _dequantize_uint8(q: np.ndarray, dtype: np.dtype, scale: float, zero_point: int) -> np.ndarray:
+    out = q.astype(dtype)
+    out -= zero_point
+    out *= dtype.type(scale)
+    return out
+
+
+def _reduce_precision(arr: np.ndarray, precision: Optional[str]) -> tuple[np.ndarray, dict[str, Any]]:
+    if precision is None:
+        return arr, {}
+    if arr.dtype.kind != "f":
+        raise ValueError(f"{precision} transport is only supported for float tensors, got {arr.dtype}")
+    if precision == "float16":
+        if arr.size and float(np.abs(arr).max()) > _FLOAT16_MAX:
+            raise ValueError("Tensor exceeds the float16 range")
+        return arr.astype(np.float16), {}
+    return _quantize_uint8(arr)
+
+
+# --- Compression
+def _compress(view: memoryview, compressor: Optional[str], level: int) -> Union[bytes, memoryview]:
+    if compressor is None:
+        return view
+    if compressor == "zlib":
+        return zlib.compress(view, level)
+    return _lz4.compress(view)
+
+
+def _decompress(data, compressor: Optional[str]) -> Union[bytes, memoryview]:
+    if compressor is None:
+        return data
+    if compressor == "zlib":
+        return zlib.decompress(data)
+    return _lz4.decompress(data)
+
+
+# --- Payloads
+def encode_array(arr: np.ndarray, encoding: Optional[str], level: int = 1) -> TensorPayload:
+    """Payload of `arr` in `encoding` (None: plain payload holding the array itself, no copy)."""
+    arr = np.ascontiguousarray(arr)
+    precision, compressor = parse_encoding(encoding)
+    if precision is None and compressor is None:
+        return TensorPayload(dtype=str(arr.dtype), shape=list(arr.shape), data=arr)
+    wire, params = _reduce_precision(arr, precision)
+    data = _compress(memoryview(wire.reshape(-1).view(np.uint8)), compressor, level)
+    if isinstance(data, memoryview):
+        data = wire
+    return TensorPayload(dtype=str(arr.dtype), shape=list(arr.shape), data=data, encoding=encoding,
+                         params={"dtype": wire.dtype.str, **params})
+
+
+def decode_payload(p: TensorPayload) -> np.ndarray:
+    """Array of an encoded payload in its logical dtype / shape."""
+    if p.encoding == SHM_ENCODING:
+        return map_payload(p)
+    precision, compressor = parse_encoding(p.encoding)
+    params = p.params or {}
+    dtype = np.dtype(p.dtype)
+    data = p.data
+    if compressor is not None:
+        data = _decompress(data.reshape(-1).view(np.uint8) if isinstance(data, np.ndarray) else data, compressor)
+    if isinstance(data, np.ndarray):
+        wire = data
+    else:
+        wire = np.frombuffer(data, dtype=np.dtype(params.get("dtype", dtype)))
+    wire = wire.reshape(p.shape)
+    if precision is None:
+        return wire
+    if precision == "uint8":
+        return _dequantize_uint8(wire, dtype, params["scale"], params["zero_point"])
+    return wire.astype(dtype)
+
+
+def payload_nbytes(p: TensorPayload) -> int:
+    """Bytes the payload takes on the wire."""
+    data = p.data
+    return data.nbytes if isinstance(data, (np.ndarray, memoryview)) else len(data)
+
+
+# --- Link policy
+# Rough bytes/s until transfers are measured
+DEFAULT_THROUGHPUT = {
+    ConnectionType.ETHERNET: 100e6,
+    ConnectionType.WIFI: 5e6,
+}
+
+# (wire bytes / raw bytes, encode seconds per raw byte), rough priors until the codecs are measured
+_CODEC_PRIORS: dict[Optional[str], tuple[float, float]] = {
+    None: (1.0, 0.0),
+    "zlib": (0.9, 1 / 40e6),
+    "lz4": (0.95, 1 / 400e6),
+    "float16": (0.5, 1 / 500e6),
+    "float16+zlib": (0.45, 1 / 60e6),
+    "float16+lz4": (0.48, 1 / 300e6),
+    "uint8": (0.25, 1 / 300e6),
+    "uint8+zlib": (0.15, 1 / 80e6),
+    "uint8+lz4": (0.2, 1 / 250e6),
+}
+
+
+class LinkPolicy:
+    """
+    Per-link choice of tensor encoding: minimizes codec CPU time + wire bytes / link throughput.
+    Throughput and codec cost / ratio are exponential moving averages of what was measured, lossy
+    encodings are only candidates when the link (or the call) allows them.
+    """
+
+    def __init__(self, connection: ConnectionType = ConnectionType.ETHERNET, *, throughput: Optional[float] = None,
+                 lossy: bool = False, encodings: Optional[list[Optional[str]]] = None, smoothing: float = 0.2):
+        self.connection = connection
+        self.throughput = throughput or DEFAULT_THROUGHPUT.get(connection, DEFAULT_THROUGHPUT[ConnectionType.ETHERNET])
+        self.lossy = lossy
+        self.encodings = encodings if encodings is not None else available_encodings(lossy=True)
+        self.smoothing = smoothing
+        # encoding -> [wire ratio, seconds per raw byte]
+        self._codec: dict[Optional[str], list[float]] = {e: list(_CODEC_PRIORS.get(e, (1.0, 0.0)))
+                                                         for e in self.encodings}
+
+    def _ewma(self, old: float, new: float) -> float:
+        return old + self.smoothing * (new - old)
+
+    def record_transfer(self, nbytes: int, seconds: float):
+        """A transfer of `nbytes` took `seconds` on this link."""
+        if nbytes <= 0 or seconds <= 0:
+            return
+        self.throughput = self._ewma(self.throughput, nbytes / seconds)
+
+    def record_codec(self, encoding: Optional[str], raw_nbytes: int, wire_nbytes: int, seconds: float):
+        """Encoding `raw_nbytes` into `wire_nbytes` took `seconds`."""
+        if raw_nbytes <= 0:
+            return
+        ratio, cost = self._codec.setdefault(encoding, list(_CODEC_PRIORS.get(encoding, (1.0, 0.0))))
+        self._codec[encoding] = [self._ewma(ratio, wire_nbytes / raw_nbytes), self._ewma(cost, seconds / raw_nbytes)]
+
+    def calibrate(self, sample: np.ndarray, repeat: int = 3):
+        """Measure every candidate encoding on a representative tensor (replaces the priors)."""
+        for encoding in self.encodings:
+            try:
+                best = float("inf")
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    payload = encode_array(sample, encoding)
+                    best = min(best, time.perf_counter() - t0)
+            except ValueError:
+                continue
+            self._codec[encoding] = [payload_nbytes(payload) / max(sample.nbytes, 1), best / max(sample.nbytes, 1)]
+
+    def estimate(self, encoding: Optional[str], nbytes: int) -> float:
+        """Estimated seconds to move `nbytes` raw bytes over the link in `encoding`."""
+        ratio, cost = self._codec.get(encoding, _CODEC_PRIORS.get(encoding, (1.0, 0.0)))
+        return nbytes * cost + nbytes * ratio / self.throughput
+
+    def choose(self, arr: np.ndarray, lossy: Optional[bool] = None) -> Optional[str]:
+        lossy = self.lossy if lossy is None else lossy
+        candidates = [e for e in self.encodings if lossy or not is_lossy(e)]
+        if arr.dtype.kind != "f":
+            candidates = [e for e in candidates if not is_lossy(e)]
+        return min(candidates, key=lambda e: self.estimate(e, arr.nbytes), default=None)
+
+    def encode(self, arr: np.ndarray, lossy: Optional[bool] = None) -> TensorPayload:
+        """Encode with the chosen encoding, the measured encode time feeds back into the estimates."""
+        encoding = self.choose(arr, lossy)
+        t0 = time.perf_counter()
+        try:
+            payload = encode_array(arr, encoding)
+        except ValueError as e:
+            # Out of range for a lossy encoding (inf / NaN, beyond float16), fall back to lossless
+            logger.debug(f"Tensor encoding {encoding} not applicable ({e}), sending lossless")
+            return self.encode(arr, lossy=False) if is_lossy(encoding) else encode_array(arr, None)
+        if encoding is not None:
+            self.record_codec(encoding, arr.nbytes, payload_nbytes(payload), time.perf_counter() - t0)
+        return payload
+
+    def stats(self) -> dict[str, Any]:
+        return {"connection": self.connection.value, "throughput": self.throughput, "lossy": self.lossy,
+                "codecs": {str(e): {"ratio": r, "seconds_per_byte": c} for e, (r, c) in self._codec.items()}}
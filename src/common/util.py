@@ -1,5 +1,8 @@
 import logging
 import hashlib
+import importlib.util
+import os
+import resource
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +17,18 @@ def get_cpu_serial() -> str:
         logger.warning("Use Ethernet MAC address instead as fallback")
         raise e
 
+def get_rss_bytes() -> int:
+    # Current resident set size of this process, from /proc on Linux (falls back to the peak RSS elsewhere)
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return get_peak_rss_bytes()
+
+def get_peak_rss_bytes() -> int:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
 def generate_identifier(serial: str) -> str:
     # Generate user-friendly identifier from the hardware serial
     hash_obj = hashlib.md5(serial.encode())
@@ -0,0 +1,294 @@
+"""
+Binary framed wire format for inference requests / responses, used as WebSocket binary messages and
+HTTP bodies (Content-Type: WIRE_CONTENT_TYPE) alike, on the workers' data plane (worker/data_server.py).
+
+Frame layout (little endian):
+    prefix  magic b"FYPW", version u16, reserved u16, header_len u32         12 bytes
+    header  UTF-8 JSON, padded with spaces to the next ALIGNMENT boundary
+    buffers raw tensor / blob bytes, each starting on an ALIGNMENT boundary
+
+The JSON header carries the request id, model, mode, meta and for every buffer its name, dtype, shape,
+offset (from the start of the buffer section) and byte length. Encoding hands out memoryviews of the
+arrays (no tobytes), decoding wraps the received frame with np.frombuffer (no copy, read-only arrays).
+Tensors may travel in a transport encoding (common/tensor_codec.py), the header's "encodings" maps the
+tensor name to its logical dtype / shape, encoding and params. Those are decoded into fresh arrays.
+"""
+import json
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import Any, Optional, Union
+
+import numpy as np
+
+from common.detections import DetectionBatch
+from common.model import InferenceRequest, RawItem, TensorPayload
+from common.tensor_codec import LinkPolicy, decode_payload, encode_array
+
+WIRE_CONTENT_TYPE = "application/x-fyp-frame"
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct("<4sHHI")
+_MAGIC = b"FYPW"
+_VERSION = 1
+
+Buffer = Union[np.ndarray, bytes, bytearray, memoryview]
+# A fixed encoding for every tensor, or a link policy choosing per tensor
+Encoding = Union[None, str, LinkPolicy]
+
+
+@dataclass
+class Frame:
+    header: dict[str, Any]
+    # name -> zero-copy view into the received frame
+    buffers: dict[str, memoryview] = field(default_factory=dict)
+
+    def array(self, name: str) -> np.ndarray:
+        """Buffer `name` as an ndarray with the dtype/shape recorded in the header (no copy)."""
+        desc = self.header["buffers"][name]
+        return np.frombuffer(self.buffers[name], dtype=np.dtype(desc["dtype"])).reshape(desc["shape"])
+
+
+def _padding(n: int) -> int:
+    return -n % ALIGNMENT
+
+
+def _encoding_desc(payload: TensorPayload) -> dict[str, Any]:
+    return {"dtype": payload.dtype, "shape": list(payload.shape), "encoding": payload.encoding, "params": payload.params}
+
+
+def _encoded_payload(frame: Frame, buffer_name: str, desc: dict[str, Any]) -> TensorPayload:
+    return TensorPayload(dtype=desc["dtype"], shape=desc["shape"], data=frame.buffers[buffer_name],
+                         encoding=desc["encoding"], params=desc.get("params"))
+
+
+def _encode(arr: np.ndarray, encoding: Encoding) -> TensorPayload:
+    return encoding.encode(arr) if isinstance(encoding, LinkPolicy) else encode_array(arr, encoding)
+
+
+def encode_frame_parts(header: dict[str, Any], buffers: Optional[dict[str, Buffer]] = None) -> list[Union[bytes, memoryview]]:
+    """
+    Frame as a list of byte chunks, the buffers are memoryviews of the caller's arrays (not copied).
+    Suitable for writev-style senders (e.g. websockets fragmented send, a streaming HTTP body),
+    the arrays must stay unchanged until the parts are sent.
+    """
+    descs: dict[str, dict[str, Any]] = {}
+    views: list[memoryview] = []
+    offset = 0
+    for name, buf in (buffers or {}).items():
+        if isinstance(buf, np.ndarray):
+            arr = np.ascontiguousarray(buf)
+            # Byte view works for every dtype (including record arrays) without copying
+            view = memoryview(arr.reshape(-1).view(np.uint8))
+            descs[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset, "nbytes": arr.nbytes}
+        else:
+            view = memoryview(buf).cast("B")
+            descs[name] = {"dtype": "|u1", "shape": [view.nbytes], "offset": offset, "nbytes": view.nbytes}
+        views.append(view)
+        offset += view.nbytes + _padding(view.nbytes)
+
+    header_bytes = json.dumps({**header, "buffers": descs}, separators=(",", ":")).encode()
+    header_bytes += b" " * _padding(_PREFIX.size + len(header_bytes))
+    parts: list[Union[bytes, memoryview]] = [_PREFIX.pack(_MAGIC, _VERSION, 0, len(header_bytes)), header_bytes]
+    for view in views:
+        parts.append(view)
+        pad = _padding(view.nbytes)
+        if pad:
+            parts.append(b"\0" * pad)
+    return parts
+
+
+def encode_frame(header: dict[str, Any], buffers: Optional[dict[str, Buffer]] = None) -> bytes:
+    """Single contiguous frame, e.g. for Starlette's send_bytes or an HTTP body (one copy of each buffer)."""
+    return b"".join(encode_frame_parts(header, buffers))
+
+
+def decode_frame(data: Union[bytes, bytearray, memoryview]) -> Frame:
+    frame = memoryview(data).cast("B") if not isinstance(data, memoryview) or data.format != "B" else data
+    if frame.nbytes < _PREFIX.size:
+        raise ValueError("Frame too short")
+    magic, version, _, header_len = _PREFIX.unpack_from(frame)
+    if magic != _MAGIC:
+        raise ValueError(f"Not a wire frame (magic={bytes(magic)!r})")
+    if version != _VERSION:
+        raise ValueError(f"Unsupported wire frame version {version}")
+    body_start = _PREFIX.size + header_len
+    if frame.nbytes < body_start:
+        raise ValueError("Frame header truncated")
+    header = json.loads(bytes(frame[_PREFIX.size:body_start]))
+
+    buffers: dict[str, memoryview] = {}
+    for name, desc in header.get("buffers", {}).items():
+        start = body_start + int(desc["offset"])
+        end = start + int(desc["nbytes"])
+        if end > frame.nbytes:
+            raise ValueError(f"Frame buffer '{name}' out of bounds")
+        buffers[name] = frame[start:end]
+    return Frame(header=header, buffers=buffers)
+
+
+def with_header(data: Union[bytes, bytearray, memoryview], **updates) -> bytes:
+    """Copy of a frame with header fields replaced (e.g. request_id when relaying), buffers are not re-encoded."""
+    frame = memoryview(data).cast("B") if not isinstance(data, memoryview) or data.format != "B" else data
+    _, _, _, header_len = _PREFIX.unpack_from(frame)
+    body_start = _PREFIX.size + header_len
+    header = {**decode_frame(frame).header, **updates}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    header_bytes += b" " * _padding(_PREFIX.size + len(header_bytes))
+    return b"".join([_PREFIX.pack(_MAGIC, _VERSION, 0, len(header_bytes)), header_bytes, frame[body_start:]])
+
+
+# --- InferenceRequest
+def _request_frame(req: InferenceRequest, request_id: str) -> tuple[dict[str, Any], dict[str, Buffer]]:
+    header: dict[str, Any] = {
+        "kind": "request",
+        "request_id": request_id,
+        "model": req.model,
+        "mode": req.mode,
+        "run_postprocess": req.run_postprocess,
+        "dummy_batch_size": req.dummy_batch_size,
+        "dummy_seed": req.dummy_seed,
+        "meta": req.meta,
+    }
+    buffers: dict[str, Buffer] = {}
+    if req.inputs:
+        header["inputs"] = list(req.inputs.keys())
+        encodings = {}
+        for name, payload in req.inputs.items():
+            if payload.encoding is not None:
+                encodings[name] = _encoding_desc(payload)
+                buffers[f"input:{name}"] = payload.data
+                continue
+            data = payload.data if isinstance(payload.data, np.ndarray) else \
+                np.frombuffer(payload.data, dtype=np.dtype(payload.dtype)).reshape(payload.shape)
+            buffers[f"input:{name}"] = data
+        if encodings:
+            header["encodings"] = encodings
+    if req.items:
+        items = []
+        for i, item in enumerate(req.items):
+            if isinstance(item.data, (bytes, bytearray, memoryview)):
+                buffers[f"item:{i}"] = item.data
+                items.append({"type": item.type, "mime": item.mime})
+            else:
+                items.append({"type": item.type, "mime": item.mime, "data": item.data})
+        header["items"] = items
+    return header, buffers
+
+
+def encode_request_parts(req: InferenceRequest, request_id: str) -> list[Union[bytes, memoryview]]:
+    return encode_frame_parts(*_request_frame(req, request_id))
+
+
+def encode_request(req: InferenceRequest, request_id: str) -> bytes:
+    return encode_frame(*_request_frame(req, request_id))
+
+
+def feed_to_request(model: str, feed: dict[str, np.ndarray], encoding: Encoding = None, **kwargs) -> InferenceRequest:
+    """
+    Tensor mode request straight from arrays, the payloads keep the arrays (no tobytes before encoding).
+    encoding: optional transport encoding of the inputs (a fixed one or a LinkPolicy).
+    """
+    inputs = {name: _encode(arr, encoding) for name, arr in feed.items()}
+    return InferenceRequest(model=model, mode="tensor", inputs=inputs, **kwargs)
+
+
+def decode_request(data: Union[bytes, bytearray, memoryview]) -> tuple[str, InferenceRequest]:
+    """Returns (request_id, request), tensor payload data are memoryviews into `data`."""
+    frame = decode_frame(data)
+    h = frame.header
+    if h.get("kind") != "request":
+        raise ValueError(f"Expected a request frame, got {h.get('kind')}")
+    inputs = None
+    if h.get("inputs") is not None:
+        inputs = {}
+        encodings = h.get("encodings", {})
+        for name in h["inputs"]:
+            if name in encodings:
+                inputs[name] = _encoded_payload(frame, f"input:{name}", encodings[name])
+                continue
+            desc = h["buffers"][f"input:{name}"]
+            inputs[name] = TensorPayload(dtype=np.dtype(desc["dtype"]).name, shape=desc["shape"],
+                                         data=frame.buffers[f"input:{name}"])
+    items = None
+    if h.get("items") is not None:
+        items = []
+        for i, it in enumerate(h["items"]):
+            data_i = frame.buffers[f"item:{i}"] if f"item:{i}" in frame.buffers else it.get("data")
+            items.append(RawItem(type=it["type"], data=data_i, mime=it.get("mime")))
+    req = InferenceRequest(model=h["model"], mode=h["mode"], inputs=inputs, items=items,
+                           dummy_batch_size=h.get("dummy_batch_size"), dummy_seed=h.get("dummy_seed"),
+                           run_postprocess=h.get("run_postprocess", True), meta=h.get("meta"))
+    return h["request_id"], req
+
+
+# --- Responses
+def encode_response(request_id: str, *, outputs: Optional[dict[str, np.ndarray]] = None,
+                    detections: Optional[DetectionBatch] = None, result: Any = None,
+                    error: Optional[str] = None, output_encoding: Encoding = None) -> bytes:
+    """
+    outputs: raw model outputs, detections: postprocessed detections, result: any other JSON-able result.
+    output_encoding: optional transport encoding of the outputs (a fixed one or a LinkPolicy).
+    """
+    header: dict[str, Any] = {"kind": "response", "request_id": request_id, "result": result, "error": error}
+    buffers: dict[str, Buffer] = {}
+    if outputs is not None:
+        header["outputs"] = list(outputs.keys())
+        encodings = {}
+        for name, arr in outputs.items():
+            payload = _encode(arr, output_encoding) if output_encoding is not None else None
+            if payload is not None and payload.encoding is not None:
+                encodings[name] = _encoding_desc(payload)
+                buffers[f"output:{name}"] = payload.data
+            else:
+                buffers[f"output:{name}"] = arr
+        if encodings:
+            header["encodings"] = encodings
+    if detections is not None:
+        buffers["detections"] = detections.to_bytes()
+    return encode_frame(header, buffers)
+
+
+def decode_response(data: Union[bytes, bytearray, memoryview]) -> dict[str, Any]:
+    """
+    {"request_id", "outputs" (name -> ndarray, read-only unless transport encoded) | None, "detections" | None,
+     "result", "error"}
+    """
+    frame = decode_frame(data)
+    h = frame.header
+    if h.get("kind") != "response":
+        raise ValueError(f"Expected a response frame, got {h.get('kind')}")
+    outputs = None
+    if h.get("outputs") is not None:
+        encodings = h.get("encodings", {})
+        outputs = {name: decode_payload(_encoded_payload(frame, f"output:{name}", encodings[name])) if name in encodings
+                   else frame.array(f"output:{name}") for name in h["outputs"]}
+    detections = DetectionBatch.from_bytes(frame.buffers["detections"]) if "detections" in frame.buffers else None
+    return {"request_id": h["request_id"], "outputs": outputs, "detections": detections,
+            "result": h.get("result"), "error": h.get("error")}
+
+
+# --- Data plane bandwidth probe
+# Random (incompressible) payloads, so WebSocket compression does not inflate the measured bandwidth
+# One random block is generated once and sliced, so producing the payload does not count as transfer time
+_probe_block = b""
+
+
+def _probe_payload(nbytes: int) -> memoryview:
+    global _probe_block
+    if len(_probe_block) < nbytes:
+        _probe_block = os.urandom(nbytes)
+    return memoryview(_probe_block)[:nbytes]
+
+
+def encode_probe(request_id: str, upload_bytes: int = 0, reply_bytes: int = 0) -> bytes:
+    """Probe frame carrying `upload_bytes`, the worker answers with a probe_reply carrying `reply_bytes`."""
+    buffers = {"payload": _probe_payload(upload_bytes)} if upload_bytes else None
+    return encode_frame({"kind": "probe", "request_id": request_id, "reply_bytes": int(reply_bytes)}, buffers)
+
+
+def encode_probe_reply(frame: Frame) -> bytes:
+    reply_bytes = int(frame.header.get("reply_bytes", 0))
+    buffers = {"payload": _probe_payload(reply_bytes)} if reply_bytes else None
+    return encode_frame({"kind": "probe_reply", "request_id": frame.header.get("request_id", ""),
+                         "received": sum(b.nbytes for b in frame.buffers.values())}, buffers)
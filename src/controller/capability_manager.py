@@ -0,0 +1,185 @@
+"""
+controller/capability_manager.py
+Onboarding benchmark of workers: once a worker turns ACTIVE, it is asked (RPC "benchmark" over its control
+WebSocket, see worker/capability.py) to run a short dummy-mode benchmark of its models over a few batch sizes,
+and its data plane is probed for round trip time and bandwidth in both directions. The result is stored as
+WorkerRegistration.capability and its images/s per model seed the dispatcher's routing of that model's jobs
+until real jobs are measured.
+Capabilities are refreshed after [controller] capability_refresh_interval, when the fingerprint in the worker's
+heartbeats changes (hardware, model files, engine config) and, probe only, when its data plane switches.
+A failed onboarding is retried with exponential backoff (retry_backoff up to max_retry_backoff seconds).
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+from common.model import ConnectionType, WorkerCapability, WorkerControlInfo, WorkerHeartbeat, WorkerRegistration, \
+    WorkerStatus
+from common.wire import encode_probe
+from controller.inference_dispatcher import InferenceDispatcher
+from controller.worker_data_client import WorkerDataClient
+from controller.workers_websocket_manager import WorkersWebSocketManager
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCapabilityManager:
+    def __init__(self, config: dict[str, Any], ws_manager: WorkersWebSocketManager, dispatcher: InferenceDispatcher,
+                 registrations: dict[int, WorkerRegistration], control_info: Callable[[int], WorkerControlInfo], *,
+                 benchmark_timeout: float = 300.0, probe_timeout: float = 30.0, probe_rounds: int = 3,
+                 retry_backoff: float = 30.0, max_retry_backoff: float = 600.0):
+        self.ws_manager = ws_manager
+        self.dispatcher = dispatcher
+        self.registrations = registrations
+        self.control_info = control_info
+        self.data_port = config['worker']['data_port']
+        self.batch_sizes = config['controller']['capability_batch_sizes']
+        self.iterations = config['controller']['capability_iterations']
+        self.refresh_interval = config['controller']['capability_refresh_interval']
+        self.probe_bytes = config['controller']['capability_probe_bytes']
+        self.benchmark_timeout = benchmark_timeout
+        self.probe_timeout = probe_timeout
+        self.probe_rounds = probe_rounds
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self._tasks: dict[int, asyncio.Task] = {}
+        # worker_id -> (failed onboarding attempts, monotonic time of the next retry)
+        self._onboarding_retries: dict[int, tuple[int, float]] = {}
+
+    # --- Triggers (main event loop)
+    def schedule(self, worker_id: int, reason: str, *, benchmark: bool = True, data_ip: Optional[str] = None,
+                 data_plane: Optional[ConnectionType] = None) -> bool:
+        """Refresh a worker's capability in the background, False if a refresh is already running."""
+        if worker_id in self._tasks:
+            return False
+        logger.info(f"Refreshing capability of Worker {worker_id} ({reason})")
+        task = asyncio.create_task(self._refresh(worker_id, benchmark, data_ip, data_plane))
+        self._tasks[worker_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(worker_id, None))
+        return True
+
+    async def on_worker_status_change(self, worker_id: int, status: WorkerStatus):
+        registration = self.registrations.get(worker_id)
+        if registration is None:
+            return
+        if status == WorkerStatus.ACTIVE:
+            self._onboarding_retries.pop(worker_id, None)
+            if registration.capability is None:
+                self.schedule(worker_id, "onboarding")
+            elif self._expired(registration.capability):
+                self.schedule(worker_id, "capability expired while disconnected")
+        elif worker_id in self._tasks:
+            self._tasks[worker_id].cancel()
+
+    def check_heartbeat(self, worker_id: int, heartbeat: WorkerHeartbeat):
+        registration = self.registrations.get(worker_id)
+        if registration is None or registration.status != WorkerStatus.ACTIVE or registration.capability is None:
+            return
+        capability = registration.capability
+        if heartbeat.capability_fingerprint and heartbeat.capability_fingerprint != capability.fingerprint:
+            self.schedule(worker_id, "hardware / models changed")
+        elif heartbeat.data_plane != capability.data_plane and heartbeat.data_plane != ConnectionType.INVALID:
+            self.schedule(worker_id, f"data plane switched to {heartbeat.data_plane.value}", benchmark=False,
+                          data_ip=heartbeat.data_ip_address, data_plane=heartbeat.data_plane)
+
+    def _expired(self, capability: WorkerCapability) -> bool:
+        return self.refresh_interval > 0 and time.time() - capability.timestamp >= self.refresh_interval
+
+    async def refresh_loop(self):
+        """
+        Periodic refresh of ACTIVE workers' capabilities (none with capability_refresh_interval = 0) and retries of
+        failed onboardings.
+        """
+        tick = min(60.0, self.retry_backoff, self.refresh_interval if self.refresh_interval > 0 else 60.0)
+        while True:
+            await asyncio.sleep(tick)
+            now = time.monotonic()
+            for worker_id, registration in list(self.registrations.items()):
+                if registration.status != WorkerStatus.ACTIVE or worker_id in self._tasks:
+                    continue
+                if registration.capability is None:
+                    attempts, retry_at = self._onboarding_retries.get(worker_id, (0, 0.0))
+                    if now >= retry_at:
+                        self.schedule(worker_id, f"onboarding retry {attempts}")
+                elif self._expired(registration.capability):
+                    self.schedule(worker_id, "periodic refresh")
+
+    def _onboarding_failed(self, worker_id: int):
+        attempts = self._onboarding_retries.get(worker_id, (0, 0.0))[0] + 1
+        delay = min(self.retry_backoff * 2 ** (attempts - 1), self.max_retry_backoff)
+        self._onboarding_retries[worker_id] = (attempts, time.monotonic() + delay)
+        logger.info(f"Retrying onboarding of Worker {worker_id} in {delay:.0f}s")
+
+    # --- Measurement
+    async def _refresh(self, worker_id: int, benchmark: bool, data_ip: Optional[str],
+                       data_plane: Optional[ConnectionType]):
+        registration = self.registrations[worker_id]
+        data_ip = data_ip or registration.data_ip
+        data_plane = data_plane or registration.data_plane
+        previous = registration.capability
+        try:
+            if benchmark or previous is None:
+                result = await self.ws_manager.call(self.control_info(worker_id), 'benchmark',
+                                                    {'batch_sizes': self.batch_sizes, 'iterations': self.iterations},
+                                                    timeout=self.benchmark_timeout)
+            else:
+                result = {"fingerprint": previous.fingerprint, "hardware": previous.hardware,
+                          "models": {name: m.model_dump() for name, m in previous.models.items()}}
+            probe = await self.probe_data_plane(worker_id, data_ip)
+        except asyncio.CancelledError:
+            logger.info(f"Capability refresh of Worker {worker_id} cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Capability refresh of Worker {worker_id} failed: {str(e) or type(e).__name__}")
+            if registration.capability is None:
+                self._onboarding_failed(worker_id)
+            return
+
+        capability = WorkerCapability(**result, **probe, data_plane=data_plane, timestamp=int(time.time()))
+        registration.capability = capability
+        self._onboarding_retries.pop(worker_id, None)
+        self.dispatcher.set_benchmark_throughput(worker_id, {name: capability.peak_images_per_s(name)
+                                                             for name in capability.models})
+        summary = ", ".join(f"{name} {max(m.images_per_s.values()):.2f} images/s @ batch {m.best_batch_size}"
+                            if m.images_per_s else f"{name} failed ({m.error})" for name, m in capability.models.items())
+        logger.info(f"Worker {worker_id} capability: {summary}; {data_plane.value} data plane "
+                    f"rtt {capability.rtt_ms:.2f}ms, up {capability.upload_mbps:.1f} / down "
+                    f"{capability.download_mbps:.1f} Mbit/s")
+
+    async def probe_data_plane(self, worker_id: int, host: str) -> dict[str, float]:
+        """Round trip time (ms) and bandwidth (Mbit/s) each way, best of `probe_rounds` transfers of probe_bytes."""
+        client = WorkerDataClient(worker_id, host, self.data_port)
+
+        async def round_trip(upload_bytes: int, reply_bytes: int) -> float:
+            request_id = uuid.uuid4().hex
+            frame = encode_probe(request_id, upload_bytes, reply_bytes)
+            t0 = time.perf_counter()
+            await client.request(frame, request_id, self.probe_timeout)
+            return time.perf_counter() - t0
+
+        try:
+            # The first round trip also opens the connection
+            await round_trip(0, 0)
+            rtt = min([await round_trip(0, 0) for _ in range(self.probe_rounds)])
+            upload = min([await round_trip(self.probe_bytes, 0) for _ in range(self.probe_rounds)])
+            download = min([await round_trip(0, self.probe_bytes) for _ in range(self.probe_rounds)])
+        finally:
+            await client.close()
+
+        def mbps(elapsed: float) -> float:
+            return self.probe_bytes * 8 / max(elapsed - rtt, 1e-6) / 1e6
+
+        return {"rtt_ms": rtt * 1000.0, "upload_mbps": mbps(upload), "download_mbps": mbps(download)}
+
+    # --- Exposure
+    def capabilities(self) -> dict[int, Optional[WorkerCapability]]:
+        return {worker_id: r.capability for worker_id, r in self.registrations.items()}
+
+    def refreshing(self) -> list[int]:
+        return list(self._tasks)
+
+    async def close(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from common.model import WorkerHeartbeat, ConnectionType, WorkerRegistration, WorkerStatus, ConnectivityTestResponse, \
     WorkerControlInfo
 from common.util import generate_identifier, get_cpu_serial
@@ -7,9 +7,14 @@ import logging
 import time
 from controller.network_manager import ControllerNetworkManager
 from controller.workers_websocket_manager import WorkersWebSocketManager
+from controller.inference_dispatcher import InferenceDispatcher
+from controller.shard_scheduler import ShardedJobRunner
+from controller.capability_manager import WorkerCapabilityManager
+from common.wire import WIRE_CONTENT_TYPE, decode_frame, decode_request, encode_response
 import uvicorn
 import threading
 import asyncio
+import json
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(filename='controller.log', level=logging.DEBUG,
@@ -30,6 +35,10 @@ pending_workers: dict[str, WorkerHeartbeat] = {}
 registered_workers: dict[int, WorkerRegistration] = {}
 worker_id_counter = 0
 workers_ws_manager: WorkersWebSocketManager
+dispatcher: InferenceDispatcher | None = None
+shard_runner: ShardedJobRunner | None = None
+capability_manager: WorkerCapabilityManager | None = None
+main_loop: asyncio.AbstractEventLoop | None = None
 
 @control_app.post('/api/heartbeat')
 async def receive_heartbeat(heartbeat: WorkerHeartbeat):
@@ -52,8 +61,22 @@ async def receive_heartbeat(heartbeat: WorkerHeartbeat):
             logger.info(f"Worker (Serial: {heartbeat.serial}) added to pending registration list")
     else:
         # Registered worker, update timestamp
-        registered_workers[heartbeat.worker_id].timestamp = int(time.time())
-        logger.info(f'Worker ID {heartbeat.worker_id} "{registered_workers[heartbeat.worker_id].hardware_identifier}" heartbeat timestamp updated (active)')
+        registration = registered_workers[heartbeat.worker_id]
+        registration.timestamp = int(time.time())
+        logger.info(f'Worker ID {heartbeat.worker_id} "{registration.hardware_identifier}" heartbeat timestamp updated (active)')
+        # Follow ethernet / wifi switches, data plane requests go to the interface the worker reports now
+        if heartbeat.data_plane != ConnectionType.INVALID and heartbeat.data_ip_address \
+                and (heartbeat.data_ip_address, heartbeat.data_plane) != (registration.data_ip, registration.data_plane):
+            logger.info(f"Worker ID {heartbeat.worker_id} data plane moved to {heartbeat.data_plane.value} "
+                        f"({registration.data_ip} -> {heartbeat.data_ip_address})")
+            registration.data_ip = heartbeat.data_ip_address
+            registration.data_plane = heartbeat.data_plane
+            if dispatcher is not None and main_loop is not None and registration.status == WorkerStatus.ACTIVE:
+                asyncio.run_coroutine_threadsafe(dispatcher.add_worker(heartbeat.worker_id, registration.data_ip),
+                                                 main_loop)
+        # Re-benchmark on hardware / model / data plane changes, on the main loop with the worker connections
+        if capability_manager is not None and main_loop is not None:
+            main_loop.call_soon_threadsafe(capability_manager.check_heartbeat, heartbeat.worker_id, heartbeat)
 
 # plane depends on the incoming request interface
 @control_app.get('/api/connectivity_test')
@@ -124,9 +147,77 @@ async def on_worker_status_change(worker_id: int, status: WorkerStatus):
     if worker_id in registered_workers:
         registered_workers[worker_id].status = status
         logger.info(f'Worker {worker_id} "{registered_workers[worker_id].hardware_identifier}" status updated to {status.value}')
+        if dispatcher is not None:
+            await dispatcher.on_worker_status_change(worker_id, status, registered_workers[worker_id])
+        if capability_manager is not None:
+            await capability_manager.on_worker_status_change(worker_id, status)
     else:
         logger.warning(f'Received status update for unknown Worker ID {worker_id}')
 
+# Inference over the cluster: one InferenceRequest wire frame in, the response frame of the worker that ran it out
+# The dispatcher lives on the main event loop (with the worker connections), the API server runs its own loop
+@data_app.post('/api/infer')
+async def infer(request: Request):
+    if dispatcher is None or main_loop is None:
+        return Response(status_code=503, content="Dispatcher not running")
+    body = await request.body()
+    try:
+        reply = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(dispatcher.dispatch(body), main_loop))
+    except Exception as e:
+        logger.error(f"Cluster inference failed: {e}")
+        try:
+            request_id = decode_frame(body).header.get("request_id", "")
+        except ValueError:
+            request_id = ""
+        return Response(status_code=503, content=encode_response(request_id, error=str(e)), media_type=WIRE_CONTENT_TYPE)
+    return Response(content=reply, media_type=WIRE_CONTENT_TYPE)
+
+# One large raw-item request split over every ACTIVE worker, results in the original item order
+# meta "shard_strategy" ("proportional" | "equal") and "shard_steal" pick the split, the report comes back
+# as JSON in the X-Shard-Report header
+@data_app.post('/api/infer/sharded')
+async def infer_sharded(request: Request):
+    if shard_runner is None or main_loop is None:
+        return Response(status_code=503, content="Dispatcher not running")
+    body = await request.body()
+    request_id = ""
+    try:
+        request_id, req = decode_request(body)
+        meta = req.meta or {}
+        job = shard_runner.run(req, strategy=meta.get("shard_strategy", "proportional"),
+                               steal=bool(meta.get("shard_steal", True)))
+        merged, report = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(job, main_loop))
+    except Exception as e:
+        logger.error(f"Sharded cluster inference failed: {e}")
+        return Response(status_code=503, content=encode_response(request_id, error=str(e)), media_type=WIRE_CONTENT_TYPE)
+    # Failed chunks (report's chunk_errors) leave no merged result, only the error
+    reply = encode_response(request_id, outputs=merged["outputs"], detections=merged["detections"],
+                            result=merged["result"], error=merged["error"])
+    return Response(status_code=502 if merged["error"] else 200, content=reply, media_type=WIRE_CONTENT_TYPE,
+                    headers={"X-Shard-Report": json.dumps(report)})
+
+@data_app.get('/api/dispatcher')
+async def get_dispatcher_stats():
+    return dispatcher.stats() if dispatcher is not None else {}
+
+# Onboarding benchmark results per worker (None until benchmarked), for scheduling decisions
+@control_app.get('/api/workers/capabilities')
+async def get_worker_capabilities():
+    if capability_manager is None:
+        return {}
+    return {worker_id: capability.model_dump() if capability is not None else None
+            for worker_id, capability in capability_manager.capabilities().items()}
+
+# Re-run a worker's capability benchmark now
+@control_app.post('/api/workers/{worker_id}/benchmark')
+async def benchmark_worker(worker_id: int):
+    if capability_manager is None or main_loop is None:
+        return Response(status_code=503, content="Capability manager not running")
+    if worker_id not in registered_workers or registered_workers[worker_id].status != WorkerStatus.ACTIVE:
+        return Response(status_code=404, content=f"No ACTIVE worker {worker_id}")
+    main_loop.call_soon_threadsafe(capability_manager.schedule, worker_id, "requested via API")
+    return {"worker_id": worker_id, "status": "scheduled"}
+
 def start_api_server(app, port):
     def run():
         uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
@@ -159,10 +250,16 @@ async def monitor_worker_timestamp():
 
 
 async def async_main():
-    global workers_ws_manager
+    global workers_ws_manager, dispatcher, shard_runner, capability_manager, main_loop
+    main_loop = asyncio.get_running_loop()
+    dispatcher = InferenceDispatcher(config['worker']['data_port'], max_inflight=config['worker']['data_max_inflight'])
+    shard_runner = ShardedJobRunner(dispatcher)
     workers_ws_manager = WorkersWebSocketManager(config)
     workers_ws_manager.register_status_change_callback(on_worker_status_change)
+    capability_manager = WorkerCapabilityManager(config, workers_ws_manager, dispatcher, registered_workers,
+                                                 get_worker_control_info)
     asyncio.create_task(monitor_worker_timestamp())
+    asyncio.create_task(capability_manager.refresh_loop())
     try:
         while True:
             await asyncio.sleep(30)
@@ -179,6 +276,8 @@ async def async_main():
         logger.info("Controller shutting down...")
     finally:
         await workers_ws_manager.disconnect_all()
+        await capability_manager.close()
+        await dispatcher.close()
 
 if __name__ == "__main__":
     network_manager = ControllerNetworkManager(config)
@@ -0,0 +1,271 @@
+"""
+controller/inference_dispatcher.py
+Runs inference jobs across the cluster: each job (an InferenceRequest wire frame) goes to the ACTIVE worker
+with the least outstanding work relative to its measured throughput, i.e. the earliest expected completion
+(outstanding + job work) / throughput, over that worker's data plane (controller/worker_data_client.py).
+Work is counted in items (images / batch rows), throughput in items/s measured from completed jobs.
+Up to `max_inflight` jobs are pipelined per worker, beyond that jobs wait for a free slot. Jobs whose
+worker drops or times out mid-flight are retried on another worker, error replies count as failed and do not
+feed the throughput. Routing follows on_worker_status_change.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from common.model import InferenceRequest, WorkerRegistration, WorkerStatus
+from common.wire import decode_frame, decode_response, encode_request, with_header
+from controller.worker_data_client import WorkerDataClient
+
+logger = logging.getLogger(__name__)
+
+
+def frame_work(header: dict[str, Any]) -> int:
+    """Items in a request frame: raw items, tensor batch rows or the dummy batch size."""
+    if header.get("items"):
+        return len(header["items"])
+    if header.get("inputs"):
+        name = header["inputs"][0]
+        desc = header.get("encodings", {}).get(name) or header["buffers"][f"input:{name}"]
+        return int(desc["shape"][0]) if desc["shape"] else 1
+    return int(header.get("dummy_batch_size") or 1)
+
+
+@dataclass
+class WorkerLoad:
+    worker_id: int
+    client: WorkerDataClient
+    available: bool = True
+    inflight: int = 0
+    outstanding_work: int = 0
+    completed: int = 0
+    failed: int = 0
+    work_done: int = 0
+    # Items/s, exponential moving average over completed jobs (None until the first completion)
+    throughput: Optional[float] = None
+    last_done: float = 0.0
+    busy_s: float = field(default=0.0)
+    # After a connection failure the worker is skipped until then (or until it turns ACTIVE again)
+    down_until: float = 0.0
+
+
+class InferenceDispatcher:
+    def __init__(self, data_port: int, *, max_inflight: int = 4, max_retries: int = 2, smoothing: float = 0.3,
+                 failure_backoff: float = 5.0):
+        self.data_port = data_port
+        self.failure_backoff = failure_backoff
+        self.max_inflight = max_inflight
+        self.max_retries = max_retries
+        self.smoothing = smoothing
+        self.workers: dict[int, WorkerLoad] = {}
+        # worker_id -> model -> items/s from the workers' onboarding benchmarks (controller/capability_manager.py),
+        # used for jobs of that model until the worker's throughput is measured
+        self.benchmark_throughput: dict[int, dict[str, float]] = {}
+        self._changed: Optional[asyncio.Condition] = None
+        self._started = time.monotonic()
+
+    @property
+    def _condition(self) -> asyncio.Condition:
+        # Created lazily so the dispatcher can be built outside the event loop it serves
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    async def _notify(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+    # --- Membership
+    async def add_worker(self, worker_id: int, host: str, port: Optional[int] = None):
+        port = port or self.data_port
+        load = self.workers.get(worker_id)
+        if load is not None and (load.client.host, load.client.port) == (host, port):
+            load.available = True
+            load.down_until = 0.0
+        else:
+            if load is not None:
+                await load.client.close()
+            self.workers[worker_id] = WorkerLoad(worker_id=worker_id, client=WorkerDataClient(worker_id, host, port))
+            logger.info(f"Dispatcher routing to {self.workers[worker_id].client}")
+        await self._notify()
+
+    async def remove_worker(self, worker_id: int):
+        load = self.workers.get(worker_id)
+        if load is None:
+            return
+        load.available = False
+        # In-flight jobs fail over to other workers once the connection drops
+        await load.client.close()
+        logger.info(f"Dispatcher stopped routing to worker {worker_id}")
+        await self._notify()
+
+    async def on_worker_status_change(self, worker_id: int, status: WorkerStatus,
+                                      registration: Optional[WorkerRegistration] = None):
+        if status == WorkerStatus.ACTIVE and registration is not None:
+            await self.add_worker(worker_id, registration.data_ip)
+        elif status != WorkerStatus.ACTIVE:
+            await self.remove_worker(worker_id)
+
+    # --- Routing
+    def set_benchmark_throughput(self, worker_id: int, items_per_s: dict[str, Optional[float]]):
+        """model -> benchmarked items/s of a worker (models that failed to benchmark may be None)."""
+        rates = {model: rate for model, rate in items_per_s.items() if rate}
+        if rates:
+            self.benchmark_throughput[worker_id] = rates
+        else:
+            self.benchmark_throughput.pop(worker_id, None)
+
+    def _known_throughput(self, load: WorkerLoad, model: Optional[str]) -> Optional[float]:
+        if load.throughput is not None:
+            return load.throughput
+        return self.benchmark_throughput.get(load.worker_id, {}).get(model) if model is not None else None
+
+    def _expected_throughput(self, load: WorkerLoad, model: Optional[str]) -> float:
+        known_rate = self._known_throughput(load, model)
+        if known_rate is not None:
+            return known_rate
+        # Workers neither measured nor benchmarked are assumed as fast as the average known one, so they get tried
+        known = [r for r in (self._known_throughput(w, model) for w in self.workers.values()) if r is not None]
+        return sum(known) / len(known) if known else 1.0
+
+    def _eligible(self, exclude: set[int], only: Optional[int]) -> list[WorkerLoad]:
+        return [w for w in self.workers.values()
+                if w.available and w.worker_id not in exclude and (only is None or w.worker_id == only)]
+
+    def _pick(self, work: int, model: Optional[str], exclude: set[int],
+              only: Optional[int] = None) -> Optional[WorkerLoad]:
+        now = time.monotonic()
+        candidates = [w for w in self._eligible(exclude, only) if w.inflight < self.max_inflight and w.down_until <= now]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda w: ((w.outstanding_work + work) / self._expected_throughput(w, model),
+                                              w.inflight, w.worker_id))
+
+    async def _acquire(self, work: int, model: Optional[str], exclude: set[int], timeout: Optional[float],
+                       only: Optional[int] = None) -> WorkerLoad:
+        async def wait_for_slot():
+            async with self._condition:
+                while True:
+                    load = self._pick(work, model, exclude, only)
+                    if load is not None:
+                        return load
+                    reachable = self._eligible(exclude, only)
+                    if not reachable and only is not None:
+                        raise ConnectionError(f"Worker {only} is not available")
+                    if not reachable:
+                        raise RuntimeError("No ACTIVE worker available for inference")
+                    # Wake up for a freed slot, a membership change or the end of a failure backoff
+                    backoff = min(w.down_until for w in reachable) - time.monotonic()
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), backoff if backoff > 0 else None)
+                    except asyncio.TimeoutError:
+                        pass
+        load = await asyncio.wait_for(wait_for_slot(), timeout)
+        load.inflight += 1
+        load.outstanding_work += work
+        return load
+
+    def _record_done(self, load: WorkerLoad, work: int, sent_at: float, failed: bool = False):
+        now = time.perf_counter()
+        # While the worker is busy back to back, the time since its previous completion is this job's service time
+        interval = max(now - max(sent_at, load.last_done), 1e-4)
+        load.last_done = now
+        load.busy_s += interval
+        if failed:
+            # An error reply (bad input, model failing to load...) may come back at any speed, it is no throughput
+            load.failed += 1
+            return
+        rate = work / interval
+        load.throughput = rate if load.throughput is None else load.throughput + self.smoothing * (rate - load.throughput)
+        load.completed += 1
+        load.work_done += work
+
+    async def _release(self, load: WorkerLoad, work: int):
+        load.inflight -= 1
+        load.outstanding_work -= work
+        await self._notify()
+
+    async def _send(self, load: WorkerLoad, frame: bytes, work: int, timeout: Optional[float]) -> bytes:
+        """Run an acquired job on `load`'s worker, returns its response frame (still with our request_id)."""
+        # Own correlation id, request ids of different callers may collide
+        request_id = uuid.uuid4().hex
+        sent_at = time.perf_counter()
+        try:
+            reply = await load.client.request(with_header(frame, request_id=request_id), request_id, timeout)
+        except (ConnectionError, asyncio.TimeoutError):
+            # Dropped or stuck, skip the worker for a while
+            load.failed += 1
+            load.down_until = time.monotonic() + self.failure_backoff
+            raise
+        finally:
+            await self._release(load, work)
+        self._record_done(load, work, sent_at, failed=bool(decode_frame(reply).header.get("error")))
+        return reply
+
+    # --- Entrance
+    async def dispatch(self, frame: bytes, timeout: Optional[float] = None) -> bytes:
+        """Run one request frame on the cluster, returns the worker's response frame (with the caller's request_id)."""
+        header = decode_frame(frame).header
+        client_request_id = header.get("request_id", "")
+        work = frame_work(header)
+        tried: set[int] = set()
+        last_error: Optional[Exception] = None
+        for _ in range(self.max_retries + 1):
+            load = await self._acquire(work, header.get("model"), tried, timeout)
+            try:
+                reply = await self._send(load, frame, work, timeout)
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                logger.warning(f"Job {client_request_id} failed on worker {load.worker_id}, retrying elsewhere: "
+                               f"{str(e) or type(e).__name__}")
+                tried.add(load.worker_id)
+                last_error = e
+                continue
+            return with_header(reply, request_id=client_request_id)
+        reason = str(last_error) or type(last_error).__name__
+        raise RuntimeError(f"Job {client_request_id} failed on {len(tried)} workers: {reason}")
+
+    async def dispatch_to(self, worker_id: int, frame: bytes, timeout: Optional[float] = None) -> bytes:
+        """
+        Run one request frame on a given worker (no failover), ConnectionError if it drops or is not available,
+        TimeoutError if it does not answer in time.
+        """
+        header = decode_frame(frame).header
+        work = frame_work(header)
+        load = await self._acquire(work, header.get("model"), set(), timeout, only=worker_id)
+        reply = await self._send(load, frame, work, timeout)
+        return with_header(reply, request_id=header.get("request_id", ""))
+
+    def available_workers(self, model: Optional[str] = None) -> dict[int, Optional[float]]:
+        """
+        worker_id -> throughput (items/s) of every routable worker, measured or else benchmarked at onboarding
+        for `model` (None if neither yet).
+        """
+        return {w.worker_id: self._known_throughput(w, model) for w in self.workers.values() if w.available}
+
+    async def submit(self, req: InferenceRequest, timeout: Optional[float] = None) -> dict[str, Any]:
+        """InferenceRequest in, decoded response out (see common.wire.decode_response)."""
+        reply = await self.dispatch(encode_request(req, uuid.uuid4().hex), timeout)
+        return decode_response(reply)
+
+    def stats(self) -> dict[str, Any]:
+        elapsed = time.monotonic() - self._started
+        workers = {}
+        for worker_id, w in self.workers.items():
+            workers[worker_id] = {
+                **w.client.info(), "available": w.available, "inflight": w.inflight,
+                "outstanding_work": w.outstanding_work, "completed": w.completed, "failed": w.failed,
+                "work_done": w.work_done, "throughput": w.throughput,
+                "benchmark_throughput": self.benchmark_throughput.get(worker_id),
+                "utilization": w.busy_s / elapsed if elapsed > 0 else 0.0,
+            }
+        return {
+            "workers": workers,
+            "cluster_throughput": sum(w.throughput or 0.0 for w in self.workers.values() if w.available),
+            "inflight": sum(w.inflight for w in self.workers.values()),
+        }
+
+    async def close(self):
+        for load in self.workers.values():
+            await load.client.close()
@@ -0,0 +1,279 @@
+"""
+controller/shard_scheduler.py
+Runs one large raw-item InferenceRequest (e.g. every image under inputs/) across the cluster.
+The items are cut into chunks (one data plane request each), every worker gets a contiguous run of chunks
+proportional to its recently measured images/s (InferenceDispatcher throughput), and a worker that runs out
+steals chunks from the tail of the worker with the most expected time left. Chunks of a worker that drops or
+times out are handed to the others, a chunk answered with an error is retried once on another worker and, if it
+fails again, reported in the report's chunk_errors while the rest of the job runs on. Responses are merged back
+in the original item order (no merged result if a chunk failed).
+The report's equal / proportional split figures are estimates from the planning rates, the measured makespan
+of a naive equal split is that of a run with strategy="equal", steal=False (tests/controller/shard_benchmark.py).
+"""
+import asyncio
+import logging
+import math
+import mimetypes
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import numpy as np
+
+from common.detections import DetectionBatch
+from common.model import InferenceRequest, RawItem
+from common.wire import decode_response, encode_request
+from controller.inference_dispatcher import InferenceDispatcher
+
+logger = logging.getLogger(__name__)
+
+SHARD_STRATEGIES = ("proportional", "equal")
+
+
+@dataclass
+class _Chunk:
+    index: int
+    start: int
+    items: list[RawItem]
+    # Workers that answered this chunk with an error
+    failed_on: set[int] = field(default_factory=set)
+
+
+@dataclass
+class _WorkerRun:
+    rate: float
+    queue: deque = field(default_factory=deque)
+    planned_items: int = 0
+    items: int = 0
+    chunks: int = 0
+    stolen: int = 0
+    busy_s: float = 0.0
+    finished_s: float = 0.0
+    alive: bool = True
+
+
+def split_shares(total: int, rates: dict[int, float]) -> dict[int, int]:
+    """`total` units split proportionally to `rates` (largest remainder, shares add up to `total`)."""
+    rate_sum = sum(rates.values())
+    exact = {wid: total * rate / rate_sum for wid, rate in rates.items()}
+    shares = {wid: int(math.floor(x)) for wid, x in exact.items()}
+    for wid in sorted(exact, key=lambda w: exact[w] - shares[w], reverse=True)[:total - sum(shares.values())]:
+        shares[wid] += 1
+    return shares
+
+
+def _merge_results(results: list[Any]) -> Any:
+    if all(r is None for r in results):
+        return None
+    if all(isinstance(r, list) for r in results):
+        return [x for r in results for x in r]
+    if all(isinstance(r, dict) for r in results):
+        return {key: _merge_results([r.get(key) for r in results]) for key in results[0]}
+    return results
+
+
+def merge_responses(responses: list[dict[str, Any]]) -> dict[str, Any]:
+    """Decoded responses of consecutive chunks -> one response as if the whole request ran at once."""
+    merged: dict[str, Any] = {"outputs": None, "detections": None, "error": None,
+                              "result": _merge_results([r["result"] for r in responses])}
+    if responses and all(r["detections"] is not None for r in responses):
+        merged["detections"] = DetectionBatch.merge([r["detections"] for r in responses])
+    if responses and all(r["outputs"] is not None for r in responses):
+        merged["outputs"] = {name: np.concatenate([r["outputs"][name] for r in responses])
+                             for name in responses[0]["outputs"]}
+    return merged
+
+
+def _inline_item(item: RawItem) -> RawItem:
+    # Workers do not share the controller's file system
+    if item.type != "image_path":
+        return item
+    with open(item.data, "rb") as f:
+        data = f.read()
+    return RawItem(type="image_bytes", data=data, mime=item.mime or mimetypes.guess_type(item.data)[0])
+
+
+class ShardedJobRunner:
+    def __init__(self, dispatcher: InferenceDispatcher, *, chunks_per_worker: int = 8, max_chunk_size: int = 16,
+                 depth: int = 2, timeout: Optional[float] = None):
+        self.dispatcher = dispatcher
+        # More chunks per worker balance better, bigger chunks batch better on the worker
+        self.chunks_per_worker = chunks_per_worker
+        self.max_chunk_size = max_chunk_size
+        # Chunks in flight per worker, so the next one is already on the wire when one finishes
+        self.depth = depth
+        self.timeout = timeout
+
+    def _rates(self, rates: Optional[dict[int, float]], model: str) -> dict[int, float]:
+        measured = rates if rates is not None else self.dispatcher.available_workers(model)
+        if not measured:
+            raise RuntimeError("No ACTIVE worker available for inference")
+        known = [r for r in measured.values() if r]
+        default = sum(known) / len(known) if known else 1.0
+        return {wid: (r or default) for wid, r in measured.items()}
+
+    async def run(self, req: InferenceRequest, *, strategy: str = "proportional", steal: bool = True,
+                  rates: Optional[dict[int, float]] = None) -> tuple[dict[str, Any], dict[str, Any]]:
+        """
+        Returns (merged response, report). rates: worker_id -> images/s to plan with (default: measured by the
+        dispatcher), strategy "equal" with steal=False is the naive split.
+        """
+        if strategy not in SHARD_STRATEGIES:
+            raise ValueError(f"Unsupported shard strategy: {strategy}, expected one of {SHARD_STRATEGIES}")
+        if req.mode != "raw" or not req.items:
+            raise ValueError("Sharding needs a raw mode request with items")
+        items = await asyncio.to_thread(lambda: [_inline_item(item) for item in req.items])
+        rates = self._rates(rates, req.model)
+        chunk_size = max(1, min(self.max_chunk_size, math.ceil(len(items) / (len(rates) * self.chunks_per_worker))))
+        chunks = [_Chunk(index=i, start=start, items=items[start:start + chunk_size])
+                  for i, start in enumerate(range(0, len(items), chunk_size))]
+
+        shares = split_shares(len(chunks), rates if strategy == "proportional" else {wid: 1.0 for wid in rates})
+        runs: dict[int, _WorkerRun] = {}
+        position = 0
+        for wid, share in shares.items():
+            run = runs[wid] = _WorkerRun(rate=rates[wid])
+            run.queue.extend(chunks[position:position + share])
+            run.planned_items = sum(len(c.items) for c in run.queue)
+            position += share
+
+        job_id = uuid.uuid4().hex[:8]
+        responses: list[Optional[dict[str, Any]]] = [None] * len(chunks)
+        chunk_errors: dict[int, dict[str, Any]] = {}
+        t0 = time.perf_counter()
+
+        def speed(wid: int) -> float:
+            # Measured during the job where possible, the planning rates may be stale or wrong
+            load = self.dispatcher.workers.get(wid)
+            return load.throughput if load is not None and load.throughput else runs[wid].rate
+
+        def time_left(wid: int) -> float:
+            load = self.dispatcher.workers.get(wid)
+            in_flight = load.outstanding_work if load is not None else 0
+            return (in_flight + sum(len(c.items) for c in runs[wid].queue)) / speed(wid)
+
+        def take(wid: int) -> Optional[_Chunk]:
+            run = runs[wid]
+            if run.queue:
+                return run.queue.popleft()
+            if not steal:
+                return None
+            # Steal from the worker expected to finish last, from the tail so its next chunks stay local
+            in_flight = self.dispatcher.workers[wid].outstanding_work if wid in self.dispatcher.workers else 0
+            for victim in sorted((w for w, r in runs.items() if r.queue and w != wid), key=time_left, reverse=True):
+                queue = runs[victim].queue
+                # Never a chunk this worker already answered with an error
+                pos = next((p for p in range(len(queue) - 1, -1, -1) if wid not in queue[p].failed_on), None)
+                if pos is None:
+                    continue
+                chunk = queue[pos]
+                # Only if this worker is done with it before the victim would be, else a slow thief turns straggler
+                if (in_flight + len(chunk.items)) / speed(wid) >= time_left(victim):
+                    continue
+                del queue[pos]
+                run.stolen += 1
+                return chunk
+            return None
+
+        def requeue(chunk: _Chunk) -> bool:
+            # Earliest expected finish first, never back to a worker that answered it with an error
+            alive = [w for w, r in runs.items() if r.alive and w not in chunk.failed_on]
+            if not alive:
+                return False
+            runs[min(alive, key=time_left)].queue.append(chunk)
+            return True
+
+        def fail_chunk(wid: int, chunk: _Chunk, error: str):
+            chunk_errors[chunk.index] = {"items": [chunk.start, chunk.start + len(chunk.items)], "worker": wid,
+                                         "error": error}
+            logger.error(f"Sharded job {job_id}: chunk {chunk.index} failed on worker {wid}: {error}")
+
+        def hand_over(wid: int, chunk: _Chunk):
+            run = runs[wid]
+            run.alive = False
+            orphans = [chunk, *run.queue]
+            run.queue.clear()
+            if not any(r.alive for r in runs.values()):
+                raise RuntimeError(f"Sharded job {job_id}: every worker failed")
+            for orphan in orphans:
+                if not requeue(orphan):
+                    fail_chunk(wid, orphan, f"worker {wid} failed, no other worker left to retry on")
+
+        async def worker_loop(wid: int):
+            run = runs[wid]
+            while run.alive:
+                chunk = take(wid)
+                if chunk is None:
+                    return
+                # Item indexes (e.g. {i} in saved image paths) continue across chunks as in one request
+                meta = {**(req.meta or {}), "index_offset": int((req.meta or {}).get("index_offset", 0)) + chunk.start}
+                sub = InferenceRequest(model=req.model, mode="raw", items=chunk.items,
+                                       run_postprocess=req.run_postprocess, meta=meta)
+                started = time.perf_counter()
+                try:
+                    reply = await self.dispatcher.dispatch_to(wid, encode_request(sub, f"{job_id}-{chunk.index}"),
+                                                              self.timeout)
+                except (ConnectionError, asyncio.TimeoutError) as e:
+                    logger.warning(f"Sharded job {job_id}: worker {wid} failed ({str(e) or type(e).__name__}), "
+                                   f"handing its chunks over")
+                    hand_over(wid, chunk)
+                    return
+                response = decode_response(reply)
+                if response["error"]:
+                    # Bad items fail anywhere, a worker-side problem (e.g. a model failing to load) only there
+                    chunk.failed_on.add(wid)
+                    if len(chunk.failed_on) > 1 or not requeue(chunk):
+                        fail_chunk(wid, chunk, response["error"])
+                    else:
+                        logger.warning(f"Sharded job {job_id}: chunk {chunk.index} failed on worker {wid} "
+                                       f"({response['error']}), retrying on another worker")
+                    continue
+                responses[chunk.index] = response
+                run.items += len(chunk.items)
+                run.chunks += 1
+                run.busy_s += time.perf_counter() - started
+                run.finished_s = time.perf_counter() - t0
+
+        async def run_loops(wids: list[int]):
+            try:
+                async with asyncio.TaskGroup() as group:
+                    for wid in wids:
+                        for _ in range(self.depth):
+                            group.create_task(worker_loop(wid))
+            except ExceptionGroup as eg:
+                raise eg.exceptions[0]
+
+        await run_loops(list(runs))
+        # Chunks handed over after the receiving worker's loops had already finished
+        while any(r.queue for r in runs.values()):
+            await run_loops([wid for wid, run in runs.items() if run.alive and run.queue])
+        makespan = time.perf_counter() - t0
+
+        report = {
+            "job_id": job_id,
+            "items": len(items),
+            "chunks": len(chunks),
+            "chunk_size": chunk_size,
+            "strategy": strategy,
+            "steal": steal,
+            "makespan_s": makespan,
+            "images_per_s": len(items) / makespan if makespan > 0 else 0.0,
+            # Estimates only: what the planning rates predict for a naive equal split vs a perfectly proportional one
+            "equal_split_estimate_s": max(math.ceil(len(items) / len(rates)) / r for r in rates.values()),
+            "proportional_estimate_s": len(items) / sum(rates.values()),
+            "workers": {wid: {"rate": r.rate, "planned_items": r.planned_items, "items": r.items, "chunks": r.chunks,
+                              "stolen": r.stolen, "busy_s": r.busy_s, "finished_s": r.finished_s, "alive": r.alive}
+                        for wid, r in runs.items()},
+            "chunk_errors": chunk_errors,
+        }
+        logger.info(f"Sharded job {job_id}: {len(items)} items on {len(runs)} workers in {makespan:.2f}s "
+                    f"(equal split estimate {report['equal_split_estimate_s']:.2f}s), "
+                    f"{len(chunk_errors)} failed chunks")
+        if chunk_errors:
+            failed = ", ".join(f"items {e['items'][0]}-{e['items'][1] - 1}: {e['error']}"
+                               for _, e in sorted(chunk_errors.items()))
+            return {"outputs": None, "detections": None, "result": None,
+                    "error": f"{len(chunk_errors)} of {len(chunks)} chunks failed ({failed})"}, report
+        return merge_responses(responses), report
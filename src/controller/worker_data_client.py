@@ -0,0 +1,107 @@
+"""
+controller/worker_data_client.py
+Client side of a worker's data plane (worker/data_server.py): one persistent /data_ws connection per worker,
+request frames go out as binary messages and responses are matched back by request_id, so many requests can
+be in flight on one connection.
+"""
+import asyncio
+import logging
+from typing import Any, Optional
+
+from websockets.asyncio.client import connect, ClientConnection
+from websockets.exceptions import ConnectionClosed, WebSocketException
+
+from common.wire import decode_frame
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerDataClient:
+    def __init__(self, worker_id: int, host: str, port: int, connection_timeout: float = 5.0):
+        self.worker_id = worker_id
+        self.host = host
+        self.port = port
+        self.connection_timeout = connection_timeout
+        self.uri = f"ws://{host}:{port}/data_ws"
+        self._ws: Optional[ClientConnection] = None
+        self._receive_task: Optional[asyncio.Task] = None
+        self._pending: dict[str, asyncio.Future] = {}
+        self._connect_lock = asyncio.Lock()
+
+    def __str__(self):
+        return f"Worker{self.worker_id} data plane ({self.uri})"
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self._ws is not None:
+                return
+            logger.info(f"Connecting to {self}...")
+            try:
+                self._ws = await asyncio.wait_for(connect(self.uri, max_size=None), timeout=self.connection_timeout)
+            except (asyncio.TimeoutError, OSError, WebSocketException) as e:
+                raise ConnectionError(f"Failed to connect to {self}: {e}") from e
+            self._receive_task = asyncio.create_task(self._receive_loop(self._ws))
+
+    async def _receive_loop(self, ws: ClientConnection):
+        try:
+            async for message in ws:
+                if not isinstance(message, bytes):
+                    logger.warning(f"Ignoring text message from {self}")
+                    continue
+                try:
+                    request_id = decode_frame(message).header.get("request_id")
+                except ValueError as e:
+                    logger.error(f"Undecodable frame from {self}: {e}")
+                    continue
+                future = self._pending.pop(request_id, None)
+                if future is None:
+                    logger.warning(f"Response for unknown request {request_id} from {self}")
+                elif not future.done():
+                    future.set_result(message)
+        except ConnectionClosed:
+            logger.warning(f"Connection to {self} lost!")
+        finally:
+            self._fail_pending(ConnectionError(f"Connection to {self} closed"))
+            if self._ws is ws:
+                self._ws = None
+
+    def _fail_pending(self, error: Exception):
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def request(self, frame: bytes, request_id: str, timeout: Optional[float] = None) -> bytes:
+        """Send one request frame, returns the raw response frame. ConnectionError if the worker goes away."""
+        if self._ws is None:
+            await self.connect()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await self._ws.send(frame)
+        except (ConnectionClosed, AttributeError) as e:
+            self._pending.pop(request_id, None)
+            raise ConnectionError(f"Failed to send to {self}: {e}") from e
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def close(self):
+        ws, self._ws = self._ws, None
+        if ws is not None:
+            await ws.close()
+        if self._receive_task is not None:
+            self._receive_task.cancel()
+            self._receive_task = None
+        self._fail_pending(ConnectionError(f"{self} closed"))
+
+    def info(self) -> dict[str, Any]:
+        return {"uri": self.uri, "connected": self.connected, "pending": self.pending()}
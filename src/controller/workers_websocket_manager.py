@@ -1,6 +1,7 @@
 import asyncio
+import itertools
 import logging
-from typing import Callable, Any, Coroutine
+from typing import Callable, Any, Coroutine, Optional
 
 import websockets
 from websockets.asyncio.client import connect, ClientConnection
@@ -10,12 +11,21 @@ import json
 
 logger = logging.getLogger(__name__)
 
+
+class RpcError(Exception):
+    """The worker ran the command and reported an error."""
+
+
 class WorkersWebSocketManager:
     def __init__(self, config: dict[str, Any]):
         self.config = config
         self.connections: dict[int, ClientConnection] = {}
         self.connection_tasks: dict[int, asyncio.Task] = {}
         self.worker_status_change_callbacks: list[Callable[[int, WorkerStatus], Coroutine[Any, Any, Any]]] = []
+        # RPC: worker_id -> {call id -> future resolved by the worker's reply}
+        self.pending_calls: dict[int, dict[int, asyncio.Future]] = {}
+        self._call_ids = itertools.count(1)
+        self.call_timeout = 10.0
 
         self.ws_port = self.config['worker']['control_port']
 
@@ -47,11 +57,36 @@ class WorkersWebSocketManager:
             while True:
                 message = await ws.recv()
                 logger.debug(f"Received WebSocket message from {worker}: {message}")
+                self._resolve_reply(worker, message)
         except ConnectionClosed:
             logger.warning(f"WebSocket connection to {worker} lost!")
         finally:
+            self._fail_pending_calls(worker.worker_id, ConnectionError(f"WebSocket connection to {worker} closed"))
             await self._handle_disconnection(worker)
 
+    def _resolve_reply(self, worker: WorkerControlInfo, message: str):
+        # Replies are {"id": ..., "result": ...} or {"id": ..., "error": "..."}
+        try:
+            reply = json.loads(message)
+        except json.JSONDecodeError:
+            logger.error(f"Failed to decode WebSocket message from {worker} as JSON")
+            return
+        if not isinstance(reply, dict) or "id" not in reply:
+            return
+        future = self.pending_calls.get(worker.worker_id, {}).pop(reply["id"], None)
+        if future is None or future.done():
+            logger.warning(f"Reply to unknown or expired call {reply['id']} from {worker}")
+            return
+        if reply.get("error") is not None:
+            future.set_exception(RpcError(reply["error"]))
+        else:
+            future.set_result(reply.get("result"))
+
+    def _fail_pending_calls(self, worker_id: int, error: Exception):
+        for future in self.pending_calls.pop(worker_id, {}).values():
+            if not future.done():
+                future.set_exception(error)
+
     async def _handle_disconnection(self, worker: WorkerControlInfo | int, reconnect: bool = True):
         await self._notify_status_change(worker, WorkerStatus.INACTIVE)
         worker_id = worker.worker_id if isinstance(worker, WorkerControlInfo) else worker
@@ -121,6 +156,36 @@ class WorkersWebSocketManager:
             logger.error(f"Failed to send command to {worker}: {e}")
             return False
     
+    async def call(self, worker: WorkerControlInfo, command: str, data: dict[str, Any] = None,
+                   timeout: Optional[float] = None) -> Any:
+        """
+        Run a command on the worker and wait for its result. Many calls may be in flight on one connection.
+        Raises RpcError if the worker's handler failed, ConnectionError if the worker is not connected or
+        disconnects, asyncio.TimeoutError after `timeout` seconds (default `call_timeout`).
+        """
+        if worker.worker_id not in self.connections:
+            raise ConnectionError(f"No active WebSocket connection to {worker}")
+        call_id = next(self._call_ids)
+        future = asyncio.get_running_loop().create_future()
+        pending = self.pending_calls.setdefault(worker.worker_id, {})
+        pending[call_id] = future
+        try:
+            payload = json.dumps({"command": command, "data": data or {}, "id": call_id})
+            try:
+                await self.connections[worker.worker_id].send(payload)
+            except ConnectionClosed as e:
+                raise ConnectionError(f"WebSocket connection to {worker} is closed") from e
+            logger.debug(f"Sent call {call_id} to {worker}: {payload}")
+            return await asyncio.wait_for(future, timeout if timeout is not None else self.call_timeout)
+        finally:
+            pending.pop(call_id, None)
+
+    async def call_many(self, workers: list[WorkerControlInfo], command: str, data: dict[str, Any] = None,
+                        timeout: Optional[float] = None) -> dict[int, Any]:
+        """The same call on several workers concurrently, worker_id -> result or the exception it raised."""
+        results = await asyncio.gather(*(self.call(w, command, data, timeout) for w in workers), return_exceptions=True)
+        return {w.worker_id: r for w, r in zip(workers, results)}
+
     def is_connected(self, worker: WorkerControlInfo | int) -> bool:
         worker_id = worker.worker_id if isinstance(worker, WorkerControlInfo) else worker
         return worker_id in self.connections and self.connections[worker_id].state != websockets.protocol.State.CLOSING and self.connections[worker_id].state != websockets.protocol.State.CLOSED
@@ -0,0 +1,127 @@
+"""
+worker/capability.py
+What a worker can do, reported to the controller when it onboards the worker (controller/capability_manager.py):
+a short dummy-mode benchmark of every registered model over a few batch sizes, the hardware it ran on and a
+fingerprint of hardware + model files + engine config. The fingerprint goes out with every heartbeat, so the
+controller re-benchmarks the worker when it changes (new accelerator, replaced model file, other thread count...).
+The benchmark runs one model at a time inside `serialize` (the data server's exclusive(), so live requests neither
+skew it nor are slowed down by it) and skips models that could only be loaded by evicting one the worker serves.
+"""
+import functools
+import glob
+import hashlib
+import json
+import logging
+import os
+import platform
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Optional
+
+import onnxruntime as ort
+
+from common.model import InferenceRequest
+from worker.inference.model_registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+# Device nodes of supported accelerators, their presence changes the fingerprint
+ACCELERATOR_DEVICES = ("/dev/hailo*",)
+
+
+def _cpu_model() -> Optional[str]:
+    # Raspberry Pis name the board in the device tree, other machines the CPU in /proc/cpuinfo
+    try:
+        with open('/proc/device-tree/model', 'r') as f:
+            return f.read().strip("\0\n ")
+    except OSError:
+        pass
+    fields: dict[str, str] = {}
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                fields.setdefault(key.strip(), value.strip())
+    except OSError:
+        pass
+    # "model" alone is a numeric CPU model id on x86, "Model" the board name on ARM
+    return fields.get('model name') or fields.get('Model') or platform.processor() or None
+
+
+@functools.lru_cache(maxsize=1)
+def hardware_info() -> dict[str, Any]:
+    return {
+        "machine": platform.machine(),
+        "cpu_model": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "accelerators": sorted(path for pattern in ACCELERATOR_DEVICES for path in glob.glob(pattern)),
+        "onnxruntime": ort.__version__,
+        "providers": ort.get_available_providers(),
+    }
+
+
+def _file_signature(path: Optional[str]) -> Optional[list]:
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, st.st_size, int(st.st_mtime)]
+
+
+def capability_fingerprint(registry: ModelRegistry) -> str:
+    """Changes whenever the benchmark results may: hardware, model / adapter files or engine config."""
+    state = {
+        "hardware": hardware_info(),
+        "models": {name: [_file_signature(spec.model_path), _file_signature(spec.adapter_path)]
+                   for name, spec in sorted(registry.models.items())},
+        "engine_config": registry.engine_config,
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def benchmark_model(registry: ModelRegistry, model: str, batch_sizes: list[int], *, warmup: int = 1,
+                    iterations: int = 3) -> dict[str, Any]:
+    """images/s and mean latency per batch size of dummy requests through the model's engine (no postprocess)."""
+    images_per_s: dict[int, float] = {}
+    latency_ms: dict[int, float] = {}
+    for batch_size in batch_sizes:
+        req = InferenceRequest(model=model, mode="dummy", dummy_batch_size=batch_size, run_postprocess=False)
+        for _ in range(warmup):
+            registry.handle_request(req)
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            registry.handle_request(req)
+        elapsed = time.perf_counter() - t0
+        images_per_s[batch_size] = iterations * batch_size / elapsed
+        latency_ms[batch_size] = elapsed / iterations * 1000.0
+        logger.info(f"Capability benchmark {model} batch_size={batch_size}: {images_per_s[batch_size]:.2f} images/s")
+    return {
+        "images_per_s": images_per_s,
+        "latency_ms": latency_ms,
+        "best_batch_size": max(images_per_s, key=images_per_s.get),
+        "load_time_s": registry.stats()["models"][model]["last_load_s"],
+    }
+
+
+def run_capability_benchmark(registry: ModelRegistry, batch_sizes: list[int], *, models: Optional[list[str]] = None,
+                             warmup: int = 1, iterations: int = 3,
+                             serialize: Callable[[], ContextManager] = nullcontext) -> dict[str, Any]:
+    """
+    Benchmark every (or the given) registered model, a model that fails or is skipped is reported with its error.
+    serialize: context manager factory each model's benchmark runs in, e.g. WorkerDataServer.exclusive.
+    """
+    results: dict[str, dict[str, Any]] = {}
+    for model in models or list(registry.models):
+        try:
+            with serialize():
+                if not registry.fits_without_eviction(model):
+                    logger.info(f"Capability benchmark skips model '{model}', loading it would evict a resident model")
+                    results[model] = {"error": "Not benchmarked, loading it would evict a resident model"}
+                    continue
+                results[model] = benchmark_model(registry, model, batch_sizes, warmup=warmup, iterations=iterations)
+        except Exception as e:
+            logger.error(f"Capability benchmark of model '{model}' failed: {e}")
+            results[model] = {"error": str(e) or type(e).__name__}
+    return {"fingerprint": capability_fingerprint(registry), "hardware": hardware_info(), "models": results}
@@ -0,0 +1,233 @@
+"""
+worker/data_server.py
+Data plane inference server of a worker, served on [worker] data_port next to the control API.
+Requests are InferenceRequests in the binary wire format (common/wire.py), tensor / raw / dummy modes:
+    POST /infer        one request frame as the body (Content-Type WIRE_CONTENT_TYPE), one response frame back
+    WS   /data_ws      request frames as binary messages, response frames are sent as soon as each finishes
+                       (out of order, matched by request_id), up to `max_inflight` requests per connection
+Requests run through the model registry on a thread pool so the event loop keeps receiving, decoding the
+request and encoding the response happen on the same thread as the inference.
+Raw outputs may be sent in a transport encoding with meta["output_encoding"] ("float16", "uint8+zlib"...,
+or "auto" for the LinkPolicy of the current data plane, see common/tensor_codec.py).
+Probe frames (common.wire.encode_probe) are echoed with a payload of the requested size for bandwidth tests.
+`exclusive()` holds requests back while e.g. the capability benchmark (worker/capability.py) runs.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+import numpy as np
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
+
+from common.detections import DetectionBatch
+from common.model import ConnectionType, InferenceRequest
+from common.shm_transport import release_request
+from common.tensor_codec import LinkPolicy
+from common.wire import WIRE_CONTENT_TYPE, decode_frame, decode_request, encode_probe_reply, encode_response
+from worker.inference.model_registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+class WorkerDataServer:
+    def __init__(self, model_registry: ModelRegistry, *, num_threads: int = 1, max_inflight: int = 4,
+                 connection: Optional[Callable[[], ConnectionType]] = None):
+        self.model_registry = model_registry
+        self.max_inflight = max_inflight
+        # Current data plane, picks the LinkPolicy for "auto" output encoding
+        self.connection = connection or (lambda: ConnectionType.ETHERNET)
+        self.link_policies = {c: LinkPolicy(c) for c in (ConnectionType.ETHERNET, ConnectionType.WIFI)}
+        self.num_threads = num_threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._closed = False
+        # Requests running vs. an exclusive section (exclusive()) waiting for them / holding new ones back
+        self._gate = threading.Condition()
+        self._running = 0
+        self._exclusive = False
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "errors": 0, "inflight": 0, "bytes_in": 0, "bytes_out": 0, "busy_s": 0.0}
+        self._started = time.monotonic()
+
+        self.app = FastAPI()
+        self.app.add_event_handler("shutdown", self.close)
+        self._setup_routes()
+
+    # --- Request handling (executor threads)
+    def _output_encoding(self, req: InferenceRequest):
+        encoding = (req.meta or {}).get("output_encoding")
+        if encoding == "auto":
+            return self.link_policies.get(self.connection(), self.link_policies[ConnectionType.ETHERNET])
+        return encoding
+
+    def _to_response(self, request_id: str, req: InferenceRequest, result: Any) -> bytes:
+        if isinstance(result, dict) and result and all(isinstance(v, np.ndarray) for v in result.values()):
+            return encode_response(request_id, outputs=result, output_encoding=self._output_encoding(req))
+        if isinstance(result, dict) and isinstance(result.get("detections"), DetectionBatch):
+            rest = {k: v for k, v in result.items() if k != "detections"}
+            return encode_response(request_id, detections=result["detections"], result=_jsonable(rest))
+        return encode_response(request_id, result=_jsonable(result))
+
+    def process(self, data: bytes) -> bytes:
+        """One request frame -> one response frame, errors are reported in the response frame."""
+        with self._gate:
+            self._gate.wait_for(lambda: not self._exclusive)
+            self._running += 1
+        try:
+            return self._process(data)
+        finally:
+            with self._gate:
+                self._running -= 1
+                self._gate.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """Run the with block with no request running, requests arriving meanwhile wait for it to end."""
+        with self._gate:
+            self._gate.wait_for(lambda: not self._exclusive)
+            self._exclusive = True
+            self._gate.wait_for(lambda: self._running == 0)
+        try:
+            yield
+        finally:
+            with self._gate:
+                self._exclusive = False
+                self._gate.notify_all()
+
+    def _process(self, data: bytes) -> bytes:
+        t0 = time.perf_counter()
+        request_id = ""
+        with self._lock:
+            self._stats["inflight"] += 1
+        try:
+            request_id, req = decode_request(data)
+            try:
+                result = self.model_registry.handle_request(req)
+                reply = self._to_response(request_id, req, result)
+            finally:
+                release_request(req)
+        except Exception as e:
+            logger.error(f"Data plane request {request_id or '<undecodable>'} failed: {e}")
+            self._count(errors=1)
+            reply = encode_response(request_id, error=str(e))
+        finally:
+            with self._lock:
+                self._stats["inflight"] -= 1
+        self._count(requests=1, bytes_in=len(data), bytes_out=len(reply), busy_s=time.perf_counter() - t0)
+        return reply
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Data plane server is shutting down")
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="data-plane")
+            return self._executor
+
+    async def _process_async(self, data: bytes) -> bytes:
+        try:
+            frame = decode_frame(data)
+        except ValueError:
+            frame = None
+        if frame is not None and frame.header.get("kind") == "probe":
+            # Bandwidth probes (controller/capability_manager.py) are answered right away, not queued behind inference
+            self._count(bytes_in=len(data))
+            reply = encode_probe_reply(frame)
+            self._count(bytes_out=len(reply))
+            return reply
+        try:
+            executor = self._get_executor()
+        except RuntimeError as e:
+            return encode_response(frame.header.get("request_id", "") if frame is not None else "", error=str(e))
+        return await asyncio.get_running_loop().run_in_executor(executor, self.process, data)
+
+    # --- Routes
+    def _setup_routes(self):
+        @self.app.post("/infer")
+        async def infer(request: Request):
+            reply = await self._process_async(await request.body())
+            return Response(content=reply, media_type=WIRE_CONTENT_TYPE)
+
+        @self.app.websocket("/data_ws")
+        async def data_ws(websocket: WebSocket):
+            await self.handle_connection(websocket)
+
+        @self.app.get("/api/data/stats")
+        async def stats():
+            return self.stats()
+
+    async def handle_connection(self, websocket: WebSocket):
+        await websocket.accept()
+        logger.info("Data plane WebSocket connection established")
+        send_lock = asyncio.Lock()
+        inflight = asyncio.Semaphore(self.max_inflight)
+        tasks: set[asyncio.Task] = set()
+
+        async def run(data: bytes):
+            try:
+                reply = await self._process_async(data)
+                async with send_lock:
+                    await websocket.send_bytes(reply)
+            except Exception as e:
+                logger.error(f"Failed to send data plane response: {e}")
+            finally:
+                inflight.release()
+
+        try:
+            while True:
+                received = await websocket.receive()
+                if received["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(received.get("code", 1000))
+                if received.get("bytes") is None:
+                    logger.warning("Ignoring text message on the data plane WebSocket, expected binary request frames")
+                    continue
+                # Stop reading once max_inflight requests are running (backpressure on the sender)
+                await inflight.acquire()
+                task = asyncio.create_task(run(received["bytes"]))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except WebSocketDisconnect:
+            logger.info("Data plane WebSocket connection disconnected")
+        except Exception as e:
+            logger.error(f"Data plane WebSocket connection error: {e}")
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        elapsed = time.monotonic() - self._started
+        stats["requests_per_s"] = stats["requests"] / elapsed if elapsed > 0 else 0.0
+        stats["mb_in_per_s"] = stats["bytes_in"] / elapsed / 1e6 if elapsed > 0 else 0.0
+        stats["mb_out_per_s"] = stats["bytes_out"] / elapsed / 1e6 if elapsed > 0 else 0.0
+        stats["data_plane"] = self.connection().value
+        return stats
+
+    def close(self):
+        """Waits for running requests, later ones are rejected. Worker.close unloads the engines after this."""
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,231 @@
+"""
+worker/inference/benchmark.py
+Non-interactive inference benchmark for any model + ModelAdapter.
+Sweeps batch sizes x intra-op thread counts x modes and reports latency percentiles, throughput,
+per-stage time (preprocess / infer / postprocess) and peak RSS as JSON, so runs can be compared
+across workers and commits.
+
+Example:
+    python -m worker.inference.benchmark --model src/worker/inference/models/yolov4/yolov4.onnx \
+        --adapter src/worker/inference/models/yolov4/yolov4_adapter.py \
+        --modes dummy,raw --batch-sizes 1,4,8 --threads 1,2,4 --inputs src/worker/inference/models/yolov4/inputs \
+        --output bench.json
+
+Modes:
+    dummy   adapter.generate_dummy_inputs, preprocess time is the dummy generation
+    tensor  pre-encoded TensorPayloads, preprocess time is payload decoding
+    raw     image files from --inputs cycled up to the batch size, preprocess is the adapter's
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Optional
+
+import numpy as np
+import onnxruntime as ort
+
+from common.config import load_config, PROJECT_ROOT
+from common.model import InferenceRequest, RawItem, tensorfeed_to_payloads
+from common.util import get_rss_bytes, get_peak_rss_bytes
+from worker.inference.engines.onnx_engine import OnnxEngine
+
+logger = logging.getLogger(__name__)
+
+MODES = ("dummy", "tensor", "raw")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def _percentiles_ms(samples_s: list[float]) -> dict[str, float]:
+    arr = np.asarray(samples_s, dtype=np.float64) * 1000.0
+    return {
+        "mean": float(arr.mean()),
+        "p50": float(np.percentile(arr, 50)),
+        "p90": float(np.percentile(arr, 90)),
+        "p99": float(np.percentile(arr, 99)),
+        "max": float(arr.max()),
+    }
+
+
+def collect_raw_items(inputs_dir: str) -> list[RawItem]:
+    items = []
+    for root, _, files in os.walk(inputs_dir):
+        for file in sorted(files):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                items.append(RawItem(type="image_path", data=os.path.join(root, file)))
+    return items
+
+
+def build_request(engine: OnnxEngine, mode: str, batch_size: int, *, raw_items: Optional[list[RawItem]] = None,
+                  run_postprocess: bool = False, seed: int = 42, meta: Optional[dict[str, Any]] = None) -> InferenceRequest:
+    if mode == "dummy":
+        return InferenceRequest(model="benchmark", mode="dummy", dummy_batch_size=batch_size, dummy_seed=seed,
+                                run_postprocess=run_postprocess, meta=meta)
+    if mode == "tensor":
+        if engine.adapter is None:
+            raise ValueError("Tensor mode benchmark needs an adapter to generate the input tensors")
+        feed = engine.adapter.generate_dummy_inputs(batch_size=batch_size, seed=seed)
+        return InferenceRequest(model="benchmark", mode="tensor", inputs=tensorfeed_to_payloads(feed),
+                                run_postprocess=run_postprocess, meta=meta)
+    if mode == "raw":
+        if not raw_items:
+            raise ValueError("Raw mode benchmark needs image inputs (--inputs)")
+        items = [raw_items[i % len(raw_items)] for i in range(batch_size)]
+        return InferenceRequest(model="benchmark", mode="raw", items=items, run_postprocess=run_postprocess, meta=meta)
+    raise ValueError(f"Unsupported benchmark mode: {mode}")
+
+
+def run_case(engine: OnnxEngine, req: InferenceRequest, batch_size: int, warmup: int, iterations: int) -> dict[str, Any]:
+    """Time `iterations` requests stage by stage after `warmup` untimed ones."""
+    for _ in range(warmup):
+        engine.handle_request(req)
+
+    stages: dict[str, list[float]] = {"preprocess": [], "infer": [], "postprocess": []}
+    totals: list[float] = []
+    # Disable garbage collection to prevent jitter
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        t_start = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            feed, meta = engine.prepare_feed(req)
+            t1 = time.perf_counter()
+            outputs = engine.infer_tensors(feed)
+            t2 = time.perf_counter()
+            engine.finalize_outputs(req, outputs, meta)
+            t3 = time.perf_counter()
+            stages["preprocess"].append(t1 - t0)
+            stages["infer"].append(t2 - t1)
+            stages["postprocess"].append(t3 - t2)
+            totals.append(t3 - t0)
+        elapsed = time.perf_counter() - t_start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return {
+        "iterations": iterations,
+        "warmup": warmup,
+        "total_time_s": elapsed,
+        "throughput_fps": iterations * batch_size / elapsed,
+        "latency_ms": _percentiles_ms(totals),
+        "stage_ms": {name: _percentiles_ms(samples) for name, samples in stages.items()},
+        "rss_bytes": get_rss_bytes(),
+        "peak_rss_bytes": get_peak_rss_bytes(),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True, check=True,
+                              timeout=5).stdout.decode().strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment_info() -> dict[str, Any]:
+    return {
+        "hostname": socket.gethostname(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "onnxruntime": ort.__version__,
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "git_commit": _git_commit(),
+        "timestamp": int(time.time()),
+    }
+
+
+def run_benchmark(model_path: str, adapter_path: Optional[str], *, modes: list[str], batch_sizes: list[int],
+                  threads: list[int], warmup: int = 5, iterations: int = 20, inputs_dir: Optional[str] = None,
+                  run_postprocess: bool = False, seed: int = 42, meta: Optional[dict[str, Any]] = None,
+                  engine_config: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+    """Run every mode x batch size x thread count case, thread count 0 means the onnxruntime default."""
+    raw_items = collect_raw_items(inputs_dir) if inputs_dir else None
+    results = []
+    for num_threads in threads:
+        cfg = {**(engine_config or {}), "intra_op_num_threads": num_threads}
+        engine = OnnxEngine(model_path, adapter_path, cfg)
+        for mode in modes:
+            for batch_size in batch_sizes:
+                req = build_request(engine, mode, batch_size, raw_items=raw_items, run_postprocess=run_postprocess,
+                                    seed=seed, meta=meta)
+                logger.info(f"Benchmarking mode={mode} batch_size={batch_size} threads={num_threads}...")
+                case = run_case(engine, req, batch_size, warmup, iterations)
+                results.append({"mode": mode, "batch_size": batch_size, "intra_op_num_threads": num_threads,
+                                "run_postprocess": run_postprocess, **case})
+                print(f"mode={mode:<6} batch={batch_size:<3} threads={num_threads:<2} "
+                      f"p50={case['latency_ms']['p50']:.2f}ms p99={case['latency_ms']['p99']:.2f}ms "
+                      f"fps={case['throughput_fps']:.2f}", file=sys.stderr)
+        del engine
+        gc.collect()
+
+    return {
+        "model_path": model_path,
+        "adapter_path": adapter_path,
+        "engine_config": engine_config,
+        "environment": environment_info(),
+        "results": results,
+    }
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark an ONNX model + ModelAdapter and emit JSON results")
+    parser.add_argument("--model", required=True, help="Path to the .onnx model")
+    parser.add_argument("--adapter", default=None, help="Path to the ModelAdapter file")
+    parser.add_argument("--modes", default="dummy", help=f"Comma separated subset of {','.join(MODES)} (default: dummy)")
+    parser.add_argument("--batch-sizes", default="1", type=_int_list, help="Comma separated batch sizes (default: 1)")
+    parser.add_argument("--threads", default="0", type=_int_list,
+                        help="Comma separated intra-op thread counts, 0 = onnxruntime default (default: 0)")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed iterations per case (default: 5)")
+    parser.add_argument("--iters", type=int, default=20, help="Timed iterations per case (default: 20)")
+    parser.add_argument("--inputs", default=None, help="Image directory for raw mode")
+    parser.add_argument("--postprocess", action="store_true", help="Run adapter postprocess in every mode (YOLOv4 only supports it in raw mode)")
+    parser.add_argument("--save-images", action="store_true", help="Pass save_images=True to postprocess")
+    parser.add_argument("--output-dir", default=None, help="Postprocess output_dir when saving images")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-config", action="store_true", help="Ignore the [engine] section of config.toml")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+    return parser
+
+
+def main(argv: Optional[list[str]] = None):
+    args = build_arg_parser().parse_args(argv)
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    for m in modes:
+        if m not in MODES:
+            raise SystemExit(f"Unknown mode '{m}', expected one of {MODES}")
+    meta: dict[str, Any] = {}
+    if args.save_images:
+        meta["save_images"] = True
+    if args.output_dir:
+        meta["output_dir"] = args.output_dir
+
+    report = run_benchmark(args.model, args.adapter, modes=modes, batch_sizes=args.batch_sizes, threads=args.threads,
+                           warmup=args.warmup, iterations=args.iters, inputs_dir=args.inputs,
+                           run_postprocess=args.postprocess, seed=args.seed, meta=meta or None,
+                           engine_config=None if args.no_config else load_config()['engine'])
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out)
+        print(f"Benchmark report written to {args.output}", file=sys.stderr)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Dynamic micro-batching in front of OnnxEngine
+Requests for the same model whose feeds agree on dtype and per-sample shape are gathered
+until either `max_batch_size` rows are queued or the oldest request has waited `max_wait_ms`,
+then run as a single `session.run` and split back per caller along the batch axis.
+Preprocess & postprocess stay on the caller's thread, only the fused inference is serialized.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Optional, Any
+
+import numpy as np
+
+from common.model import InferenceRequest
+from worker.inference.inference_engine import InferenceModelEngine
+from worker.inference.engines.onnx_engine import OnnxEngine
+
+logger = logging.getLogger(__name__)
+
+# Feed compatibility key: model + (name, dtype, per-sample shape) of every input
+BatchKey = tuple[str, tuple[tuple[str, str, tuple[int, ...]], ...]]
+
+
+@dataclass
+class _PendingFeed:
+    key: BatchKey
+    feed: dict[str, np.ndarray]
+    rows: int
+    enqueued_at: float
+    future: Future = field(default_factory=Future)
+
+
+class BatchStats:
+    """Rolling per-batch fill ratio & per-request queueing delay, for tuning under load."""
+
+    def __init__(self, max_batch_size: int, window: int = 1024):
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._fill_ratios: deque[float] = deque(maxlen=window)
+        self._batch_rows: deque[int] = deque(maxlen=window)
+        self._batch_requests: deque[int] = deque(maxlen=window)
+        self._queue_delays_ms: deque[float] = deque(maxlen=window)
+        self.total_batches = 0
+        self.total_requests = 0
+
+    def record(self, rows: int, queue_delays_ms: list[float]):
+        with self._lock:
+            self._fill_ratios.append(min(rows / self.max_batch_size, 1.0))
+            self._batch_rows.append(rows)
+            self._batch_requests.append(len(queue_delays_ms))
+            self._queue_delays_ms.extend(queue_delays_ms)
+            self.total_batches += 1
+            self.total_requests += len(queue_delays_ms)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            fill = np.array(self._fill_ratios, dtype=np.float64)
+            delays = np.array(self._queue_delays_ms, dtype=np.float64)
+            rows = np.array(self._batch_rows, dtype=np.float64)
+            reqs = np.array(self._batch_requests, dtype=np.float64)
+            total_batches, total_requests = self.total_batches, self.total_requests
+        if fill.size == 0:
+            return {"batches": 0, "requests": 0}
+        return {
+            "batches": total_batches,
+            "requests": total_requests,
+            "max_batch_size": self.max_batch_size,
+            "mean_fill_ratio": float(fill.mean()),
+            "mean_batch_rows": float(rows.mean()),
+            "mean_requests_per_batch": float(reqs.mean()),
+            "queue_delay_ms_p50": float(np.percentile(delays, 50)),
+            "queue_delay_ms_p90": float(np.percentile(delays, 90)),
+            "queue_delay_ms_p99": float(np.percentile(delays, 99)),
+            "queue_delay_ms_max": float(delays.max()),
+        }
+
+
+class BatchingEngine(InferenceModelEngine):
+    """Thread-safe micro-batching wrapper, `handle_request` may be called concurrently from many threads."""
+
+    def __init__(self, model_path, adapter_path: Optional[str] = None, *,
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0, engine: Optional[OnnxEngine] = None,
+                 engine_config: Optional[dict[str, Any]] = None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms must be >= 0")
+        self.engine = engine if engine is not None else OnnxEngine(model_path, adapter_path, engine_config)
+        self._owns_engine = engine is None
+        self.adapter = self.engine.adapter
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats = BatchStats(max_batch_size)
+
+        self._queue: queue.Queue[Optional[_PendingFeed]] = queue.Queue()
+        self._carry_over: deque[_PendingFeed] = deque()
+        self._closed = False
+        # Held from the closed check to the enqueue, so nothing lands behind the stop sentinel
+        self._submit_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._batch_loop, name="batching-engine", daemon=True)
+        self._thread.start()
+        logger.info(f"Batching engine started (max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms})")
+
+    # Unbatched passthrough
+    def infer_tensors(self, input_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        return self.engine.infer_tensors(input_data)
+
+    def handle_request(self, req: InferenceRequest):
+        timer = self.engine.metrics.stage_timer(req.model, req.mode)
+        with timer("total"):
+            with timer("preprocess"):
+                feed, meta = self.engine.prepare_feed(req)
+            # Includes the time spent waiting for the batch to fill
+            with timer("infer"):
+                outputs = self.submit_feed(req.model, feed).result()
+            with timer("postprocess"):
+                return self.engine.finalize_outputs(req, outputs, meta)
+
+    def submit_feed(self, model: str, feed: dict[str, np.ndarray]) -> Future:
+        """Queue a prepared feed, the returned future resolves to this feed's slice of the batched outputs."""
+        rows = self._batch_rows(feed)
+        pending = _PendingFeed(key=self._batch_key(model, feed), feed=feed, rows=rows, enqueued_at=time.perf_counter())
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("BatchingEngine is closed")
+            self._queue.put(pending)
+        return pending.future
+
+    def close(self, timeout: Optional[float] = None):
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+        if self._owns_engine:
+            self.engine.close()
+
+    @staticmethod
+    def _batch_rows(feed: dict[str, np.ndarray]) -> int:
+        rows = {int(arr.shape[0]) for arr in feed.values() if arr.ndim > 0}
+        if len(rows) != 1:
+            raise ValueError(f"Inputs must share a single leading batch dimension, got {rows}")
+        return rows.pop()
+
+    @staticmethod
+    def _batch_key(model: str, feed: dict[str, np.ndarray]) -> BatchKey:
+        return model, tuple(sorted((name, str(arr.dtype), tuple(arr.shape[1:])) for name, arr in feed.items()))
+
+    # --- Batch collection
+    def _next_pending(self, timeout: Optional[float]) -> Optional[_PendingFeed]:
+        if self._carry_over:
+            return self._carry_over.popleft()
+        return self._queue.get(timeout=timeout) if timeout is None or timeout > 0 else self._queue.get_nowait()
+
+    def _collect_batch(self, first: _PendingFeed) -> tuple[list[_PendingFeed], bool]:
+        batch = [first]
+        rows = first.rows
+        deadline = first.enqueued_at + self.max_wait
+        skipped: list[_PendingFeed] = []
+        stop = False
+        while rows < self.max_batch_size:
+            try:
+                nxt = self._next_pending(deadline - time.perf_counter())
+            except queue.Empty:
+                break
+            if nxt is None:
+                stop = True
+                break
+            if nxt.key != first.key or rows + nxt.rows > self.max_batch_size:
+                # Incompatible or would overflow, run it in a later batch
+                skipped.append(nxt)
+                if len(skipped) >= self.max_batch_size:
+                    break
+                continue
+            batch.append(nxt)
+            rows += nxt.rows
+        # Keep arrival order for the skipped requests ahead of anything newer
+        self._carry_over.extendleft(reversed(skipped))
+        return batch, stop
+
+    def _batch_loop(self):
+        stop = False
+        while not stop or self._carry_over:
+            try:
+                first = self._next_pending(None)
+            except queue.Empty:
+                break
+            if first is None:
+                stop = True
+                continue
+            batch, stopped = self._collect_batch(first)
+            stop = stop or stopped
+            self._run_batch(batch)
+        logger.info("Batching engine stopped")
+
+    def _run_batch(self, batch: list[_PendingFeed]):
+        dispatched_at = time.perf_counter()
+        rows = sum(p.rows for p in batch)
+        self.stats.record(rows, [(dispatched_at - p.enqueued_at) * 1000.0 for p in batch])
+        try:
+            if len(batch) == 1:
+                feed = batch[0].feed
+            else:
+                feed = {name: np.concatenate([p.feed[name] for p in batch], axis=0) for name in batch[0].feed}
+            # Slices go back to callers that postprocess concurrently, never hand out reused IOBinding buffers
+            outputs = self.engine.infer_tensors(feed, bind_outputs=False)
+        except Exception as e:
+            logger.error(f"Batched inference of {len(batch)} requests ({rows} rows) failed: {e}")
+            for p in batch:
+                p.future.set_exception(e)
+            return
+
+        offset = 0
+        for p in batch:
+            p.future.set_result({name: out[offset:offset + p.rows] for name, out in outputs.items()})
+            offset += p.rows
@@ -0,0 +1,191 @@
+"""
+Pool of OnnxEngine instances for concurrent inference on one worker
+On multi-core boards several small sessions (e.g. 2 sessions x 2 threads) often beat one session
+using every core for small batches. Each engine gets a slice of the thread budget, requests go to
+the engine with the fewest in-flight requests.
+Note every engine holds its own copy of the model weights, size N against the worker's memory.
+
+Benchmark mode sweeps (engines x threads per engine) combinations:
+    python -m worker.inference.engines.engine_pool --model <model.onnx> --adapter <adapter.py>
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Any, Iterator
+
+import numpy as np
+
+from common.model import InferenceRequest
+from worker.inference.inference_engine import InferenceModelEngine
+from worker.inference.engines.onnx_engine import OnnxEngine
+
+logger = logging.getLogger(__name__)
+
+
+def partition_threads(total_threads: int, num_engines: int) -> list[int]:
+    """Split `total_threads` intra-op threads over `num_engines`, every engine gets at least one."""
+    base, extra = divmod(max(total_threads, num_engines), num_engines)
+    return [base + (1 if i < extra else 0) for i in range(num_engines)]
+
+
+class EnginePool(InferenceModelEngine):
+    """Thread-safe pool, `handle_request` may be called from many threads, `handle_request_async` from asyncio."""
+
+    def __init__(self, model_path, adapter_path: Optional[str] = None, *, num_engines: int = 2,
+                 threads_per_engine: Optional[int] = None, engine_config: Optional[dict[str, Any]] = None):
+        if num_engines < 1:
+            raise ValueError("num_engines must be >= 1")
+        if threads_per_engine is None:
+            budgets = partition_threads(os.cpu_count() or 1, num_engines)
+        else:
+            budgets = [threads_per_engine] * num_engines
+
+        self.engines: list[OnnxEngine] = []
+        for threads in budgets:
+            # Sessions run side by side, keep each one to its own slice of cores
+            cfg = {**(engine_config or {}), "intra_op_num_threads": threads, "inter_op_num_threads": 1}
+            self.engines.append(OnnxEngine(model_path, adapter_path, cfg))
+        self.adapter = self.engines[0].adapter
+        self.thread_budgets = budgets
+
+        self._lock = threading.Lock()
+        self._in_flight = [0] * num_engines
+        self._engine_locks = [threading.Lock() for _ in range(num_engines)]
+        self._completed = [0] * num_engines
+        # Twice the engines so preprocess/postprocess of some requests overlaps inference of others
+        self._executor = ThreadPoolExecutor(max_workers=num_engines * 2, thread_name_prefix="engine-pool")
+        logger.info(f"Engine pool started with {num_engines} engines, intra-op threads {budgets}")
+
+    @contextmanager
+    def _lease(self) -> Iterator[OnnxEngine]:
+        with self._lock:
+            # Least busy first, ties go to the engine that served the fewest requests
+            idx = min(range(len(self.engines)), key=lambda i: (self._in_flight[i], self._completed[i]))
+            self._in_flight[idx] += 1
+        try:
+            with self._engine_locks[idx]:
+                yield self.engines[idx]
+        finally:
+            with self._lock:
+                self._in_flight[idx] -= 1
+                self._completed[idx] += 1
+
+    def infer_tensors(self, input_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        with self._lease() as engine:
+            # Outputs outlive the lease, so they can't be reused IOBinding buffers
+            return engine.infer_tensors(input_data, bind_outputs=False)
+
+    def handle_request(self, req: InferenceRequest):
+        # Pre/postprocess run outside the lease, only inference occupies an engine
+        engine = self.engines[0]
+        timer = engine.metrics.stage_timer(req.model, req.mode)
+        with timer("total"):
+            with timer("preprocess"):
+                feed, meta = engine.prepare_feed(req)
+            # Includes waiting for a free engine
+            with timer("infer"):
+                outputs = self.infer_tensors(feed)
+            with timer("postprocess"):
+                return engine.finalize_outputs(req, outputs, meta)
+
+    async def handle_request_async(self, req: InferenceRequest):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.handle_request, req)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "engines": len(self.engines),
+                "thread_budgets": list(self.thread_budgets),
+                "in_flight": list(self._in_flight),
+                "completed": list(self._completed),
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        # Engines share one adapter file but each loaded its own adapter instance
+        for engine in self.engines:
+            engine.close()
+
+
+# --- Benchmark mode
+def benchmark_pool(pool: EnginePool, batch_size: int = 1, requests: int = 50, concurrency: Optional[int] = None,
+                   warmup: int = 5, seed: int = 42) -> dict[str, Any]:
+    concurrency = concurrency or len(pool.engines) * 2
+    req = InferenceRequest(model="benchmark", mode="dummy", dummy_batch_size=batch_size, dummy_seed=seed, run_postprocess=False)
+    for _ in range(warmup * len(pool.engines)):
+        pool.handle_request(req)
+
+    def timed(_):
+        t0 = time.perf_counter()
+        pool.handle_request(req)
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        latencies = np.array(list(ex.map(timed, range(requests)))) * 1000.0
+    elapsed = time.perf_counter() - t0
+    return {
+        "engines": len(pool.engines),
+        "threads_per_engine": pool.thread_budgets[0],
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "requests": requests,
+        "throughput_fps": requests * batch_size / elapsed,
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p90": float(np.percentile(latencies, 90)),
+        "latency_ms_p99": float(np.percentile(latencies, 99)),
+    }
+
+
+def sweep_pool_configs(model_path: str, adapter_path: str, *, total_threads: Optional[int] = None, batch_size: int = 1,
+                       requests: int = 50, warmup: int = 5, latency_slack: float = 1.5,
+                       engine_config: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+    """
+    Try every engines x threads combination fitting in `total_threads`.
+    `best` is the highest throughput config whose p90 latency is within `latency_slack` of the lowest p90.
+    """
+    total_threads = total_threads or os.cpu_count() or 1
+    results = []
+    for num_engines in range(1, total_threads + 1):
+        for threads in range(1, total_threads // num_engines + 1):
+            pool = EnginePool(model_path, adapter_path, num_engines=num_engines, threads_per_engine=threads,
+                              engine_config=engine_config)
+            try:
+                res = benchmark_pool(pool, batch_size=batch_size, requests=requests, warmup=warmup)
+            finally:
+                pool.close()
+            logger.info(f"Pool sweep {num_engines}x{threads}: {res}")
+            results.append(res)
+
+    best_p90 = min(r["latency_ms_p90"] for r in results)
+    acceptable = [r for r in results if r["latency_ms_p90"] <= best_p90 * latency_slack]
+    return {
+        "total_threads": total_threads,
+        "batch_size": batch_size,
+        "results": results,
+        "best_throughput": max(results, key=lambda r: r["throughput_fps"]),
+        "best_latency": min(results, key=lambda r: r["latency_ms_p90"]),
+        "best": max(acceptable, key=lambda r: r["throughput_fps"]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep EnginePool engines x threads combinations with dummy inputs")
+    parser.add_argument("--model", required=True, help="Path to the .onnx model")
+    parser.add_argument("--adapter", required=True, help="Path to the ModelAdapter file (needs generate_dummy_inputs)")
+    parser.add_argument("--total-threads", type=int, default=None, help="Thread budget to partition (default: cpu count)")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    args = parser.parse_args()
+
+    report = sweep_pool_configs(args.model, args.adapter, total_threads=args.total_threads, batch_size=args.batch_size,
+                                requests=args.requests, warmup=args.warmup)
+    print(json.dumps(report, indent=2))
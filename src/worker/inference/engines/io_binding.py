@@ -0,0 +1,87 @@
+"""
+IOBinding execution path for OnnxEngine
+Inputs are bound straight from the caller's (C-contiguous) arrays, outputs are written into
+preallocated buffers that are reused for every call with the same input shapes.
+
+Ownership / lifetime contract:
+- Input arrays are borrowed for the duration of the call only, callers must not mutate them concurrently.
+- Output arrays (and the returned dict) belong to the engine. They stay valid until the next bound
+  inference on the same engine with the same input shapes, which overwrites them in place.
+  Adapter postprocess may read and modify them freely, anything kept beyond the request must be copied.
+- Only one caller at a time may hold on to the outputs. OnnxEngine.handle_request takes the engine's bound lock
+  for the whole request (concurrent requests run unbound) and copies raw outputs it returns.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import onnxruntime as ort
+
+logger = logging.getLogger(__name__)
+
+ShapeKey = tuple[tuple[str, tuple[int, ...]], ...]
+
+
+class BoundSessionRunner:
+    """Runs a session through a reusable IOBinding, keeping output buffers for the last `max_shapes` input shapes."""
+
+    def __init__(self, session: ort.InferenceSession, input_names: list[str], output_names: list[str], max_shapes: int = 4):
+        self.session = session
+        self.input_names = input_names
+        self.output_names = output_names
+        self.max_shapes = max_shapes
+        self._binding = session.io_binding()
+        self._buffers: OrderedDict[ShapeKey, dict[str, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _shape_key(self, input_data: dict[str, np.ndarray]) -> ShapeKey:
+        return tuple((name, tuple(input_data[name].shape)) for name in self.input_names)
+
+    def _allocate(self, key: ShapeKey, input_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        # Output shapes may be symbolic, learn them from one regular run and adopt its outputs as the buffers
+        outputs = self.session.run(self.output_names, input_data)
+        buffers = {}
+        for name, out in zip(self.output_names, outputs):
+            if not out.flags["C_CONTIGUOUS"] or not out.flags["WRITEABLE"]:
+                out = np.ascontiguousarray(out).copy()
+            buffers[name] = out
+        self._buffers[key] = buffers
+        while len(self._buffers) > self.max_shapes:
+            evicted, _ = self._buffers.popitem(last=False)
+            logger.debug(f"Released IOBinding output buffers for input shapes {evicted}")
+        logger.info(f"Allocated IOBinding output buffers for input shapes {key}: "
+                    f"{ {n: b.shape for n, b in buffers.items()} }")
+        return buffers
+
+    def run(self, input_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        key = self._shape_key(input_data)
+        with self._lock:
+            buffers = self._buffers.get(key)
+            if buffers is None:
+                # First call for these shapes already produced the outputs
+                return self._allocate(key, input_data)
+            self._buffers.move_to_end(key)
+
+            binding = self._binding
+            binding.clear_binding_inputs()
+            # Keep any contiguous copies alive until the run finishes, the binding only holds their pointers
+            bound_inputs = []
+            for name in self.input_names:
+                arr = input_data[name]
+                if not arr.flags["C_CONTIGUOUS"]:
+                    arr = np.ascontiguousarray(arr)
+                bound_inputs.append(arr)
+                binding.bind_cpu_input(name, arr)
+            binding.clear_binding_outputs()
+            for name, buf in buffers.items():
+                binding.bind_output(name, 'cpu', 0, buf.dtype.type, list(buf.shape), buf.ctypes.data)
+            self.session.run_with_iobinding(binding)
+            del bound_inputs
+            return buffers
+
+    def release(self):
+        with self._lock:
+            self._buffers.clear()
+            self._binding.clear_binding_inputs()
+            self._binding.clear_binding_outputs()
@@ -2,12 +2,19 @@
 Support for ONNX models running on CPU
 """
 import logging
+import os
+import tempfile
+import threading
+import time
 from typing import Optional, Any
 
 from common.model import RawItem, InferenceRequest, payloads_to_tensorfeed
 from common.util import load_adapter
 from worker.inference.inference_engine import InferenceModelEngine
-import onnxruntime as ort
+from worker.inference.engines.onnx_session import create_session, create_profiling_session, resolve_engine_config
+from worker.inference.engines.onnx_graph import model_for_input_dtype
+from worker.inference.engines.io_binding import BoundSessionRunner
+from worker.inference.metrics import InferenceMetrics, inference_metrics
 import numpy as np
 import importlib.util
 
@@ -16,8 +23,19 @@ logger = logging.getLogger(__name__)
 class OnnxEngine(InferenceModelEngine):
     """To load and run ONNX models."""
 
-    def __init__(self, model_path, adapter_path: Optional[str] = None):
-        self.session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+    def __init__(self, model_path, adapter_path: Optional[str] = None, engine_config: Optional[dict[str, Any]] = None,
+                 metrics: Optional[InferenceMetrics] = None):
+        # engine_config: the [engine] section of config.toml, None keeps onnxruntime defaults without caching
+        self.model_path = model_path
+        self.engine_config = engine_config
+        self.adapter = load_adapter(adapter_path) if adapter_path else None
+        # Run the graph variant matching the dtype the adapter feeds, e.g. uint8 with in-graph normalization
+        self.input_dtype = getattr(self.adapter, "input_dtype", None)
+        self.session_model_path = model_for_input_dtype(model_path, self.input_dtype,
+                                                        resolve_engine_config(engine_config)["cache_dir"])
+        self.session, self.load_report = create_session(self.session_model_path, engine_config)
+        self.load_report["input_dtype"] = self.input_dtype or "float32"
+        self.metrics = metrics if metrics is not None else inference_metrics
 
         self.inputs = self.session.get_inputs()
         self.outputs = self.session.get_outputs()
@@ -26,7 +44,18 @@ class OnnxEngine(InferenceModelEngine):
         self.output_names = [o.name for o in self.outputs]
 
         self._validated_signature: Optional[dict[str, tuple[str, int]]] = None # name -> (dtype_str, ndim)
-        self.adapter = load_adapter(adapter_path) if adapter_path else None
+        # IOBinding path: outputs are engine-owned buffers, see worker/inference/engines/io_binding.py for the lifetime contract
+        self.io_binding = bool((engine_config or {}).get("io_binding", False))
+        self._bound_runner = BoundSessionRunner(self.session, self.input_names, self.output_names) if self.io_binding else None
+        # Held by the one request using the bound buffers, from inference until its postprocess is done with them
+        self._bound_lock = threading.Lock()
+
+        # ORT profiler window, see start_profiling
+        self._profile_lock = threading.Lock()
+        self._profiling_session = None
+        self._profile_requests_left = 0
+        self._profile_deadline = 0.0
+        self.last_profile_path: Optional[str] = None
 
         logger.info(f"Loaded ONNX model. inputs={self.input_names} outputs={self.output_names}")
         if self.adapter:
@@ -34,11 +63,71 @@ class OnnxEngine(InferenceModelEngine):
 
 
     # Core inference
-    def infer_tensors(self, input_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    def infer_tensors(self, input_data: dict[str, np.ndarray], *, bind_outputs: Optional[bool] = None) -> dict[str, np.ndarray]:
+        # bind_outputs=False forces freshly allocated outputs, e.g. when slices are handed to other threads
         self._validate_or_lock_signature(input_data)
+        if self._profiling_session is not None:
+            return self._infer_profiled(input_data)
+        if self._bound_runner is not None and bind_outputs is not False:
+            return self._bound_runner.run(input_data)
         output = self.session.run(self.output_names, input_data)
         return dict(zip(self.output_names, output))
 
+    # --- ORT profiler window
+    def start_profiling(self, max_requests: int = 20, max_seconds: float = 30.0, profile_dir: Optional[str] = None):
+        """Route the next `max_requests` inferences (or `max_seconds`) through a profiling session."""
+        profile_dir = profile_dir or os.path.join(tempfile.gettempdir(), "fyp_ort_profiles")
+        os.makedirs(profile_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(self.model_path))[0]
+        session = create_profiling_session(self.session_model_path, self.engine_config, os.path.join(profile_dir, stem))
+        with self._profile_lock:
+            if self._profiling_session is not None:
+                raise RuntimeError("A profiling window is already active")
+            self.last_profile_path = None
+            self._profile_requests_left = max_requests
+            self._profile_deadline = time.monotonic() + max_seconds
+            self._profiling_session = session
+        logger.info(f"ORT profiling started for {self.model_path} (max {max_requests} requests / {max_seconds}s)")
+
+    def profiling_active(self) -> bool:
+        self._maybe_end_profiling()
+        return self._profiling_session is not None
+
+    def stop_profiling(self) -> Optional[str]:
+        """End the window now, returns the trace file path."""
+        with self._profile_lock:
+            return self._end_profiling_locked()
+
+    def _infer_profiled(self, input_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        session = self._profiling_session
+        if session is None:
+            output = self.session.run(self.output_names, input_data)
+        else:
+            output = session.run(self.output_names, input_data)
+            with self._profile_lock:
+                self._profile_requests_left -= 1
+        self._maybe_end_profiling()
+        return dict(zip(self.output_names, output))
+
+    def _maybe_end_profiling(self):
+        with self._profile_lock:
+            if self._profiling_session is not None and (self._profile_requests_left <= 0 or time.monotonic() >= self._profile_deadline):
+                self._end_profiling_locked()
+
+    def _end_profiling_locked(self) -> Optional[str]:
+        if self._profiling_session is None:
+            return self.last_profile_path
+        session, self._profiling_session = self._profiling_session, None
+        self.last_profile_path = session.end_profiling()
+        logger.info(f"ORT profiling finished for {self.model_path}, trace written to {self.last_profile_path}")
+        return self.last_profile_path
+
+    def close(self):
+        # Lets the adapter finish background work (e.g. queued image writes) before the engine goes away
+        close = getattr(self.adapter, "close", None)
+        if callable(close):
+            close()
+
     # Tensor validation
     def _validate_or_lock_signature(self, input_data: dict[str, np.ndarray]) -> None:
         # 1) name check
@@ -84,14 +173,14 @@ class OnnxEngine(InferenceModelEngine):
 
 
     # --- Entrance
-    def handle_request(self, req: InferenceRequest):
-        outputs: Optional[dict[str, np.ndarray]] = None
-        meta = req.meta or {}
+    def prepare_feed(self, req: InferenceRequest) -> tuple[dict[str, np.ndarray], dict[str, Any]]:
+        """Turn a request into the tensor feed for `infer_tensors`, plus the meta later passed to postprocess."""
+        # Adapters time their own sub-stages with `with meta["stage_timer"]("nms"): ...`
+        meta = {**(req.meta or {}), "stage_timer": self.metrics.stage_timer(req.model, req.mode)}
         if req.mode == "tensor":
             if not req.inputs:
                 raise ValueError("Tensor mode requires `inputs` payload!")
             feed = payloads_to_tensorfeed(req.inputs)
-            outputs = self.infer_tensors(feed)
 
         elif req.mode == "raw":
             if not req.items:
@@ -99,18 +188,21 @@ class OnnxEngine(InferenceModelEngine):
             if self.adapter is None:
                 raise ValueError("Raw Item mode requires a custom ModelAdapter!")
             meta = {**meta, "items": req.items}
-            outputs = self.infer_raw_items(req.items, meta=meta)
+            feed = self.adapter.preprocess(req.items if isinstance(req.items, list) else [req.items], meta=meta)
 
         elif req.mode == "dummy":
             if self.adapter is None:
                 raise ValueError("Random mode requires a custom ModelAdapter!")
             dummy_batch_size = req.dummy_batch_size or 10
             dummy_seed = req.dummy_seed or 42
-            outputs = self.infer_dummy_inputs(batch_size=dummy_batch_size, seed=dummy_seed)
+            feed = self.adapter.generate_dummy_inputs(batch_size=dummy_batch_size, seed=dummy_seed)
 
         else:
             raise ValueError(f"Unsupported inference mode: {req.mode}")
+        return feed, meta
 
+    def finalize_outputs(self, req: InferenceRequest, outputs: Optional[dict[str, np.ndarray]], meta: dict[str, Any]):
+        """Run the adapter postprocess on raw model outputs if requested."""
         if outputs is None:
             raise RuntimeError("Inference failed!")
 
@@ -118,4 +210,25 @@ class OnnxEngine(InferenceModelEngine):
             if self.adapter is None:
                 return outputs
             return self.adapter.postprocess(outputs, meta=meta)
-        return outputs
\ No newline at end of file
+        return outputs
+
+    def handle_request(self, req: InferenceRequest):
+        timer = self.metrics.stage_timer(req.model, req.mode)
+        # Concurrent requests (data plane threads, capability benchmark) must not share the bound output buffers,
+        # whoever finds them in use runs with freshly allocated outputs instead of waiting
+        bound = self._bound_runner is not None and self._bound_lock.acquire(blocking=False)
+        try:
+            with timer("total"):
+                with timer("preprocess"):
+                    feed, meta = self.prepare_feed(req)
+                with timer("infer"):
+                    outputs = self.infer_tensors(feed, bind_outputs=bound)
+                with timer("postprocess"):
+                    result = self.finalize_outputs(req, outputs, meta)
+                    if bound and result is outputs:
+                        # Raw outputs outlive the request (e.g. response encoding), the next bound run overwrites them
+                        result = {name: arr.copy() for name, arr in outputs.items()}
+                    return result
+        finally:
+            if bound:
+                self._bound_lock.release()
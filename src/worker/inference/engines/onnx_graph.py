@@ -0,0 +1,81 @@
+"""
+Graph variants of a model for the input dtype its adapter feeds
+An adapter declaring `input_dtype = "uint8"` feeds raw 0-255 pixels, the engine then runs a copy of the
+model with Cast(uint8 -> float) + Div(255) prepended to every float input. The feed is 4x smaller and the
+normalization runs inside onnxruntime instead of numpy. Values are identical to `x.astype(float32) / 255`.
+Variants are built once and kept next to the optimized model cache.
+Building needs the `onnx` package, loading a variant that already exists does not.
+"""
+import logging
+import os
+from typing import Optional
+
+from worker.inference.engines.onnx_session import _model_digest
+
+logger = logging.getLogger(__name__)
+
+INPUT_DTYPES = ("float32", "uint8")
+
+
+def uint8_input_variant(model_path: str, cache_dir: str, scale: float = 255.0) -> str:
+    """Path of `model_path` with uint8 inputs normalized in-graph, built on first use."""
+    os.makedirs(cache_dir, exist_ok=True)
+    digest = _model_digest(model_path, cache_dir)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    variant_path = os.path.join(cache_dir, f"{stem}-uint8-{digest[:16]}.onnx")
+    if os.path.exists(variant_path):
+        return variant_path
+
+    try:
+        import onnx
+        from onnx import helper, numpy_helper, TensorProto
+    except ImportError as e:
+        raise ImportError("Building the uint8 input variant needs the `onnx` package (pip install onnx)") from e
+    import numpy as np
+
+    model = onnx.load(model_path)
+    graph = model.graph
+    initializers = {init.name for init in graph.initializer}
+    prepended = []
+    for graph_input in graph.input:
+        tensor_type = graph_input.type.tensor_type
+        if graph_input.name in initializers or tensor_type.elem_type != TensorProto.FLOAT:
+            continue
+        name = graph_input.name
+        normalized = f"{name}/normalized"
+        # Every consumer of the float input now reads the normalized tensor instead
+        for node in graph.node:
+            for i, node_input in enumerate(node.input):
+                if node_input == name:
+                    node.input[i] = normalized
+        scale_name = f"{name}/scale"
+        graph.initializer.append(numpy_helper.from_array(np.array(scale, dtype=np.float32), scale_name))
+        prepended += [
+            helper.make_node("Cast", [name], [f"{name}/float"], to=TensorProto.FLOAT, name=f"{name}/cast"),
+            helper.make_node("Div", [f"{name}/float", scale_name], [normalized], name=f"{name}/div"),
+        ]
+        tensor_type.elem_type = TensorProto.UINT8
+    if not prepended:
+        logger.info(f"{model_path} has no float inputs, using it as is for uint8 feeds")
+        return model_path
+
+    # Nodes must stay topologically sorted, the new ones only depend on graph inputs
+    nodes = prepended + list(graph.node)
+    del graph.node[:]
+    graph.node.extend(nodes)
+    onnx.checker.check_model(model)
+
+    tmp_path = f"{variant_path}.{os.getpid()}.tmp"
+    onnx.save(model, tmp_path)
+    os.replace(tmp_path, variant_path)
+    logger.info(f"Built uint8 input variant of {model_path} at {variant_path}")
+    return variant_path
+
+
+def model_for_input_dtype(model_path: str, input_dtype: Optional[str], cache_dir: str) -> str:
+    """The graph variant of `model_path` matching the dtype an adapter feeds, None/float32 is the model itself."""
+    if input_dtype in (None, "float32"):
+        return model_path
+    if input_dtype == "uint8":
+        return uint8_input_variant(model_path, cache_dir)
+    raise ValueError(f"Unsupported adapter input_dtype: {input_dtype}, expected one of {INPUT_DTYPES}")
@@ -0,0 +1,172 @@
+"""
+onnxruntime session construction for OnnxEngine
+Maps the validated [engine] config section onto SessionOptions, and keeps an on-disk cache of
+optimized models so only the first startup of a model pays for graph optimization.
+Cache entries are keyed by model hash + onnxruntime version + the options that change the optimized graph.
+"""
+import hashlib
+import json
+import logging
+import os
+import platform
+import time
+from typing import Any, Optional
+
+import onnxruntime as ort
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENGINE_CONFIG: dict[str, Any] = {
+    "intra_op_num_threads": 0,
+    "inter_op_num_threads": 0,
+    "execution_mode": "sequential",
+    "graph_optimization_level": "all",
+    "enable_mem_pattern": True,
+    "enable_cpu_mem_arena": True,
+    "io_binding": False,
+    "optimized_model_cache": False,
+    "cache_dir": ".cache/onnx",
+}
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+PROVIDERS = ['CPUExecutionProvider']
+
+
+def resolve_engine_config(engine_config: Optional[dict[str, Any]]) -> dict[str, Any]:
+    return {**DEFAULT_ENGINE_CONFIG, **(engine_config or {})}
+
+
+def build_session_options(engine_config: dict[str, Any]) -> ort.SessionOptions:
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = int(engine_config["intra_op_num_threads"])
+    opts.inter_op_num_threads = int(engine_config["inter_op_num_threads"])
+    opts.execution_mode = EXECUTION_MODES[engine_config["execution_mode"]]
+    opts.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[engine_config["graph_optimization_level"]]
+    opts.enable_mem_pattern = bool(engine_config["enable_mem_pattern"])
+    opts.enable_cpu_mem_arena = bool(engine_config["enable_cpu_mem_arena"])
+    return opts
+
+
+def _model_digest(model_path: str, cache_dir: str) -> str:
+    # Hashing a few hundred MB on a Pi is not free, remember the digest per (path, size, mtime)
+    st = os.stat(model_path)
+    index_path = os.path.join(cache_dir, "digests.json")
+    stamp = f"{os.path.abspath(model_path)}:{st.st_size}:{st.st_mtime_ns}"
+    index: dict[str, str] = {}
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if stamp in index:
+        return index[stamp]
+
+    with open(model_path, 'rb') as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    index[stamp] = digest
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return digest
+
+
+def cache_key(model_digest: str, engine_config: dict[str, Any]) -> str:
+    # Thread counts & memory settings do not change the optimized graph, so they share a cache entry
+    key_fields = {
+        "model": model_digest,
+        "ort": ort.__version__,
+        "machine": platform.machine(),
+        "providers": PROVIDERS,
+        "graph_optimization_level": engine_config["graph_optimization_level"],
+    }
+    return hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode()).hexdigest()[:24]
+
+
+def create_session(model_path: str, engine_config: Optional[dict[str, Any]] = None) -> tuple[ort.InferenceSession, dict[str, Any]]:
+    """
+    Create an InferenceSession for `model_path`.
+    Returns the session and a startup report (cache hit/miss, load time, cold load time of the cached entry).
+    """
+    engine_config = resolve_engine_config(engine_config)
+    opts = build_session_options(engine_config)
+    report: dict[str, Any] = {"model_path": model_path, "cache": "disabled"}
+
+    use_cache = engine_config["optimized_model_cache"] and engine_config["graph_optimization_level"] != "disable"
+    if not use_cache:
+        t0 = time.perf_counter()
+        session = ort.InferenceSession(model_path, sess_options=opts, providers=PROVIDERS)
+        report["load_s"] = time.perf_counter() - t0
+        logger.info(f"Loaded ONNX session for {model_path} in {report['load_s']:.3f}s (optimized model cache disabled)")
+        return session, report
+
+    cache_dir = engine_config["cache_dir"]
+    os.makedirs(cache_dir, exist_ok=True)
+    key = cache_key(_model_digest(model_path, cache_dir), engine_config)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    cached_path = os.path.join(cache_dir, f"{stem}-{key}.onnx")
+    report_path = os.path.join(cache_dir, f"{stem}-{key}.json")
+    report["cache_key"] = key
+    report["cached_model_path"] = cached_path
+
+    if os.path.exists(cached_path):
+        # Already optimized offline, skip the optimizer entirely
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        t0 = time.perf_counter()
+        try:
+            session = ort.InferenceSession(cached_path, sess_options=opts, providers=PROVIDERS)
+        except Exception as e:
+            logger.warning(f"Cached optimized model {cached_path} failed to load ({e}), rebuilding it")
+            os.remove(cached_path)
+            return create_session(model_path, engine_config)
+        report["cache"] = "hit"
+        report["load_s"] = time.perf_counter() - t0
+        try:
+            with open(report_path, 'r') as f:
+                report["cold_load_s"] = json.load(f)["cold_load_s"]
+        except (OSError, ValueError, KeyError):
+            report["cold_load_s"] = None
+        if report["cold_load_s"]:
+            report["speedup"] = report["cold_load_s"] / max(report["load_s"], 1e-9)
+            logger.info(f"Loaded cached optimized model for {model_path} in {report['load_s']:.3f}s "
+                        f"(cold load {report['cold_load_s']:.3f}s, {report['speedup']:.1f}x faster)")
+        else:
+            logger.info(f"Loaded cached optimized model for {model_path} in {report['load_s']:.3f}s")
+        return session, report
+
+    # Cold load: let onnxruntime write the optimized graph, then publish it atomically
+    tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+    opts.optimized_model_filepath = tmp_path
+    t0 = time.perf_counter()
+    session = ort.InferenceSession(model_path, sess_options=opts, providers=PROVIDERS)
+    report["cache"] = "miss"
+    report["load_s"] = report["cold_load_s"] = time.perf_counter() - t0
+    if os.path.exists(tmp_path):
+        os.replace(tmp_path, cached_path)
+        with open(report_path, 'w') as f:
+            json.dump({"model_path": os.path.abspath(model_path), "ort": ort.__version__,
+                       "cold_load_s": report["cold_load_s"], "created": int(time.time())}, f)
+        logger.info(f"Cold loaded {model_path} in {report['load_s']:.3f}s, optimized model cached to {cached_path}")
+    else:
+        logger.warning(f"onnxruntime did not write an optimized model for {model_path}, cache not populated")
+    return session, report
+
+
+def create_profiling_session(model_path: str, engine_config: Optional[dict[str, Any]], profile_prefix: str) -> ort.InferenceSession:
+    """A separate session with onnxruntime's profiler on, profiling can't be toggled on a live session."""
+    engine_config = resolve_engine_config(engine_config)
+    opts = build_session_options(engine_config)
+    opts.enable_profiling = True
+    opts.profile_file_prefix = profile_prefix
+    return ort.InferenceSession(model_path, sess_options=opts, providers=PROVIDERS)
@@ -0,0 +1,155 @@
+"""
+Three-stage pipelined execution on top of OnnxEngine
+preprocess -> infer -> postprocess each run on their own thread with bounded queues in between,
+so request N+1 is preprocessed while request N is inferring and request N-1 is postprocessing.
+cv2 decode/resize and onnxruntime release the GIL, which is where the overlap comes from.
+Every stage is a single FIFO thread, so results complete in submission order.
+A job whose future was cancelled before the first stage picked it up (e.g. the awaiting task of
+handle_request_async was cancelled) is skipped, later jobs are unaffected.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass, field
+from typing import Optional, Any
+
+import numpy as np
+
+from common.model import InferenceRequest
+from worker.inference.inference_engine import InferenceModelEngine
+from worker.inference.engines.onnx_engine import OnnxEngine
+
+logger = logging.getLogger(__name__)
+
+
+def _settle(future: Future, result: Any = None, exception: Optional[BaseException] = None):
+    # Never let a future resolved elsewhere take a stage thread down
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        logger.warning("Pipelined job was already resolved, dropping its result")
+
+
+@dataclass
+class _Job:
+    req: InferenceRequest
+    future: Future = field(default_factory=Future)
+    feed: Optional[dict[str, np.ndarray]] = None
+    meta: Optional[dict[str, Any]] = None
+    outputs: Optional[dict[str, np.ndarray]] = None
+    submitted_at: float = field(default_factory=time.perf_counter)
+
+
+class PipelinedEngine(InferenceModelEngine):
+    """Thread-safe, `submit` from any thread or `await handle_request_async(req)` from asyncio."""
+
+    def __init__(self, model_path, adapter_path: Optional[str] = None, *, queue_size: int = 2,
+                 engine: Optional[OnnxEngine] = None, engine_config: Optional[dict[str, Any]] = None):
+        if queue_size < 1:
+            raise ValueError("queue_size must be >= 1")
+        self.engine = engine if engine is not None else OnnxEngine(model_path, adapter_path, engine_config)
+        self._owns_engine = engine is None
+        self.adapter = self.engine.adapter
+
+        # Bounded queues give backpressure: submit blocks once every stage has `queue_size` jobs waiting
+        self._pre_queue: queue.Queue[Optional[_Job]] = queue.Queue(maxsize=queue_size)
+        self._infer_queue: queue.Queue[Optional[_Job]] = queue.Queue(maxsize=queue_size)
+        self._post_queue: queue.Queue[Optional[_Job]] = queue.Queue(maxsize=queue_size)
+        self._submit_lock = threading.Lock()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._stage_loop, args=(self._pre_queue, self._infer_queue, self._preprocess),
+                             name="pipeline-preprocess", daemon=True),
+            threading.Thread(target=self._stage_loop, args=(self._infer_queue, self._post_queue, self._infer),
+                             name="pipeline-infer", daemon=True),
+            threading.Thread(target=self._stage_loop, args=(self._post_queue, None, self._postprocess),
+                             name="pipeline-postprocess", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        logger.info(f"Pipelined engine started (queue_size={queue_size})")
+
+    # --- Stages
+    def _timer(self, job: _Job, stage: str):
+        return self.engine.metrics.timer(job.req.model, job.req.mode, stage)
+
+    def _preprocess(self, job: _Job):
+        with self._timer(job, "preprocess"):
+            job.feed, job.meta = self.engine.prepare_feed(job.req)
+
+    def _infer(self, job: _Job):
+        with self._timer(job, "infer"):
+            # Outputs are still being postprocessed while the next job infers, so no reused IOBinding buffers
+            job.outputs = self.engine.infer_tensors(job.feed, bind_outputs=False)
+        job.feed = None
+
+    def _postprocess(self, job: _Job):
+        with self._timer(job, "postprocess"):
+            result = self.engine.finalize_outputs(job.req, job.outputs, job.meta)
+        job.outputs = None
+        job.meta = None
+        # Total includes the time spent queued between stages
+        self.engine.metrics.record(job.req.model, job.req.mode, "total", time.perf_counter() - job.submitted_at)
+        _settle(job.future, result=result)
+
+    @staticmethod
+    def _stage_loop(inbox: queue.Queue, outbox: Optional[queue.Queue], stage):
+        while True:
+            job = inbox.get()
+            if job is None:
+                if outbox is not None:
+                    outbox.put(None)
+                return
+            # A running future can no longer be cancelled, so only the first stage may find it cancelled
+            if job.future.done() or (not job.future.running() and not job.future.set_running_or_notify_cancel()):
+                # Failed in an earlier stage or cancelled, keep it flowing only to preserve completion order
+                if outbox is not None:
+                    outbox.put(job)
+                continue
+            try:
+                stage(job)
+            except Exception as e:
+                logger.error(f"Pipelined inference failed in {threading.current_thread().name}: {e}")
+                _settle(job.future, exception=e)
+            if outbox is not None:
+                outbox.put(job)
+
+    # --- Entrance
+    def submit(self, req: InferenceRequest) -> Future:
+        """Queue a request, blocks while the pipeline is full. The future resolves to the postprocessed result."""
+        job = _Job(req=req)
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("PipelinedEngine is closed")
+            self._pre_queue.put(job)
+        return job.future
+
+    async def handle_request_async(self, req: InferenceRequest):
+        loop = asyncio.get_running_loop()
+        # submit may block on backpressure, keep that off the event loop
+        future = await loop.run_in_executor(None, self.submit, req)
+        return await asyncio.wrap_future(future)
+
+    def handle_request(self, req: InferenceRequest):
+        return self.submit(req).result()
+
+    def infer_tensors(self, input_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        return self.engine.infer_tensors(input_data, bind_outputs=False)
+
+    def close(self, timeout: Optional[float] = None):
+        # Drains jobs already submitted before stopping the stage threads
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._pre_queue.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        if self._owns_engine:
+            self.engine.close()
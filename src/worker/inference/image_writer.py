@@ -0,0 +1,149 @@
+"""
+worker/inference/image_writer.py
+Background writer for annotated images (e.g. YOLOv4 save_images), so drawing + JPEG encoding + disk writes
+happen on writer threads instead of inside the inference call.
+The queue is bounded, when the disk can't keep up the policy decides what happens to new jobs:
+    block        submit waits for a free slot (backpressure onto the inference path)
+    drop_newest  the new job is dropped
+    drop_oldest  the oldest queued job is dropped to make room
+`flush` waits for everything queued so far, `close` drains (or discards) the queue and stops the threads.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+WRITER_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+# (frame, boxes) -> annotated frame, may draw in place
+DrawFn = Callable[[np.ndarray, Any], np.ndarray]
+
+
+@dataclass
+class _WriteJob:
+    frame: np.ndarray
+    boxes: Any
+    path: str
+
+
+class AsyncImageWriter:
+    """Thread-safe, jobs own their frame (the writer draws on it in place)."""
+
+    def __init__(self, draw: Optional[DrawFn] = None, *, max_pending: int = 16, num_threads: int = 1,
+                 policy: str = "block"):
+        if policy not in WRITER_POLICIES:
+            raise ValueError(f"Unsupported writer policy: {policy}, expected one of {WRITER_POLICIES}")
+        if max_pending < 1 or num_threads < 1:
+            raise ValueError("max_pending and num_threads must be >= 1")
+        self.draw = draw
+        self.policy = policy
+        self._queue: queue.Queue[Optional[_WriteJob]] = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        # Held from the closed check until the job is queued, and by close around the stop sentinels, so no job can
+        # land behind the sentinels. Writer threads never take it, a blocked submit still gets drained
+        self._submit_lock = threading.Lock()
+        self._closed = False
+        self._stats = {"submitted": 0, "written": 0, "dropped": 0, "failed": 0}
+        self._threads = [threading.Thread(target=self._loop, name=f"image-writer-{i}", daemon=True)
+                         for i in range(num_threads)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, frame: np.ndarray, boxes: Any, path: str) -> bool:
+        """Queue one image, returns False if it was dropped by the policy."""
+        job = _WriteJob(frame=frame, boxes=boxes, path=path)
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("AsyncImageWriter is closed")
+            self._count("submitted")
+            return self._enqueue(job)
+
+    def _enqueue(self, job: _WriteJob) -> bool:
+        if self.policy == "block":
+            self._queue.put(job)
+            return True
+        while True:
+            try:
+                self._queue.put_nowait(job)
+                return True
+            except queue.Full:
+                if self.policy == "drop_newest":
+                    self._count("dropped")
+                    logger.warning(f"Image writer queue full, dropped {job.path}")
+                    return False
+            # drop_oldest: make room, a writer thread may have taken a job meanwhile so just retry
+            try:
+                oldest = self._queue.get_nowait()
+            except queue.Empty:
+                continue
+            self._queue.task_done()
+            self._count("dropped")
+            logger.warning(f"Image writer queue full, dropped {oldest.path}")
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                frame = self.draw(job.frame, job.boxes) if self.draw is not None else job.frame
+                directory = os.path.dirname(job.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                Image.fromarray(frame).save(job.path)
+                self._count("written")
+            except Exception as e:
+                self._count("failed")
+                logger.error(f"Failed to write annotated image {job.path if job else ''}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every job queued so far is written, False on timeout."""
+        if timeout is None:
+            self._queue.join()
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def pending(self) -> int:
+        return self._queue.unfinished_tasks
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "pending": self.pending(), "policy": self.policy}
+
+    def close(self, drain: bool = True, timeout: Optional[float] = None):
+        """Stop the writer threads, writing the queued jobs first unless `drain` is False."""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            if not drain:
+                while True:
+                    try:
+                        self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    self._queue.task_done()
+                    self._count("dropped")
+            for _ in self._threads:
+                self._queue.put(None)
+        for t in self._threads:
+            t.join(timeout)
@@ -0,0 +1,98 @@
+"""
+worker/inference/metrics.py
+Always-on per-stage latency instrumentation for the inference path.
+Durations are kept in rolling windows keyed by (model, mode, stage) and summarized on demand,
+so recording stays a perf_counter() call plus a deque append.
+
+Engine stages: preprocess, infer, postprocess, total
+Adapter stages: whatever names the adapter passes to `meta["stage_timer"]` (e.g. decode, letterbox, nms, save_image)
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Iterator
+
+import numpy as np
+
+# Adapters receive one of these in meta["stage_timer"], usage: `with stage_timer("nms"): ...`
+StageTimer = Callable[[str], ContextManager[None]]
+
+MetricKey = tuple[str, str, str]  # (model, mode, stage)
+
+
+def null_stage_timer(stage: str) -> ContextManager[None]:
+    return nullcontext()
+
+
+class StageHistogram:
+    """Rolling window of one stage's durations."""
+
+    def __init__(self, window: int):
+        self.samples: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.total_s = 0.0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total_s += seconds
+
+    def summary(self) -> dict[str, Any]:
+        arr = np.fromiter(self.samples, dtype=np.float64, count=len(self.samples)) * 1000.0
+        return {
+            "count": self.count,
+            "total_s": self.total_s,
+            "window": int(arr.size),
+            "mean_ms": float(arr.mean()),
+            "p50_ms": float(np.percentile(arr, 50)),
+            "p90_ms": float(np.percentile(arr, 90)),
+            "p99_ms": float(np.percentile(arr, 99)),
+            "max_ms": float(arr.max()),
+        }
+
+
+class InferenceMetrics:
+    """Thread-safe collection of StageHistograms."""
+
+    def __init__(self, window: int = 512):
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms: dict[MetricKey, StageHistogram] = {}
+
+    def record(self, model: str, mode: str, stage: str, seconds: float):
+        key = (model, mode, stage)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = StageHistogram(self.window)
+            hist.add(seconds)
+
+    @contextmanager
+    def timer(self, model: str, mode: str, stage: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(model, mode, stage, time.perf_counter() - t0)
+
+    def stage_timer(self, model: str, mode: str) -> StageTimer:
+        """Bind model & mode, the result is what adapters get as meta["stage_timer"]."""
+        return lambda stage: self.timer(model, mode, stage)
+
+    def snapshot(self) -> dict[str, dict[str, dict[str, dict[str, Any]]]]:
+        """{model: {mode: {stage: summary}}}"""
+        with self._lock:
+            summaries = [(key, hist.summary()) for key, hist in self._histograms.items() if hist.samples]
+        out: dict[str, dict[str, dict[str, dict[str, Any]]]] = {}
+        for (model, mode, stage), summary in summaries:
+            out.setdefault(model, {}).setdefault(mode, {})[stage] = summary
+        return out
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+# Process-wide default, engines record here unless given their own instance
+inference_metrics = InferenceMetrics()
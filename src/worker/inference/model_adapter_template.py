@@ -24,9 +24,15 @@ class ModelAdapter:
         generate_dummy_inputs: for compute-only benchmarking
     - Required if any postprocess is needed (e.g. draw boxes and save for object detection models)
         postprocess: tensor outputs -> result
+    Optional instrumentation: the engine passes meta["stage_timer"], wrap expensive sub-steps with
+        `with meta["stage_timer"]("decode"): ...` to get them in the worker's per-stage latency metrics.
+    Per-request state: in raw mode preprocess and postprocess receive the same meta dict, so preprocess may store
+        e.g. original image shapes in meta["context"] for postprocess instead of decoding the items again.
     """
     def __init__(self):
-        pass
+        # Optional: "uint8" if preprocess feeds raw 0-255 pixels, the engine then runs a model variant that
+        # casts and divides by 255 in-graph (see worker/inference/engines/onnx_graph.py). Default float32.
+        self.input_dtype = "float32"
 
     def preprocess(self, items: list[RawItem], meta: Optional[dict[str, Any]] = None) -> dict[str, np.ndarray]:
         raise NotImplementedError
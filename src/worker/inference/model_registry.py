@@ -0,0 +1,280 @@
+"""
+worker/inference/model_registry.py
+Worker-side registry of servable models, so one worker process can serve several models.
+Engines are loaded lazily on the first request for a model and kept warm, least recently used
+engines are evicted once the configured memory budget ([registry] in config.toml) is exceeded.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional
+
+from common.model import InferenceRequest
+from common.util import get_rss_bytes
+from worker.inference.inference_engine import InferenceModelEngine
+from worker.inference.engines.onnx_engine import OnnxEngine
+
+logger = logging.getLogger(__name__)
+
+# (model_path, adapter_path, engine_config) -> engine
+EngineFactory = Callable[[str, Optional[str], Optional[dict[str, Any]]], InferenceModelEngine]
+
+
+@dataclass
+class ModelSpec:
+    name: str
+    model_path: str
+    adapter_path: Optional[str] = None
+
+
+@dataclass
+class ModelStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    load_count: int = 0
+    load_time_total_s: float = 0.0
+    last_load_s: Optional[float] = None
+
+
+@dataclass
+class _Resident:
+    engine: InferenceModelEngine
+    size_bytes: int
+    # Requests running on the engine, an evicted engine is closed once the last one finishes
+    leases: int = 0
+    evicted: bool = False
+
+
+class ModelRegistry:
+    """Maps model names to lazily loaded engines, thread-safe."""
+
+    def __init__(self, models: dict[str, ModelSpec], *, engine_config: Optional[dict[str, Any]] = None,
+                 memory_budget_mb: float = 0, budget_mode: str = "rss", engine_factory: Optional[EngineFactory] = None):
+        if budget_mode not in ("rss", "model_size"):
+            raise ValueError(f"Unsupported budget_mode: {budget_mode}")
+        self.models = models
+        self.engine_config = engine_config
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024)
+        self.budget_mode = budget_mode
+        self.engine_factory: EngineFactory = engine_factory or OnnxEngine
+
+        self._resident: OrderedDict[str, _Resident] = OrderedDict()
+        self._stats: dict[str, ModelStats] = {name: ModelStats() for name in models}
+        self._lock = threading.Lock()
+        self._load_locks: dict[str, threading.Lock] = {name: threading.Lock() for name in models}
+        # model_size mode: bytes of models being loaded, counted against the budget before they are resident
+        self._reserved_bytes = 0
+        # Signalled when a reservation turns into a resident (evictable) model or is given back
+        self._reservations_changed = threading.Condition(self._lock)
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any], engine_factory: Optional[EngineFactory] = None) -> "ModelRegistry":
+        models = {name: ModelSpec(name=name, model_path=m['model_path'], adapter_path=m['adapter_path'])
+                  for name, m in config['models'].items()}
+        return cls(models, engine_config=config.get('engine'), memory_budget_mb=config['registry']['memory_budget_mb'],
+                   budget_mode=config['registry']['budget_mode'], engine_factory=engine_factory)
+
+    # --- Residency
+    def get_engine(self, name: str) -> InferenceModelEngine:
+        """
+        Engine of a model, loaded if needed. Not leased: it may be evicted and closed at any time, requests should
+        go through `lease` / `handle_request`.
+        """
+        return self._get_resident(name, lease=False).engine
+
+    def resident_engine(self, name: str) -> Optional[InferenceModelEngine]:
+        """Engine of a model if it is loaded (never loads it), not leased either."""
+        if name not in self.models:
+            raise ValueError(f"Unknown model '{name}'. Registered models: {list(self.models.keys())}")
+        with self._lock:
+            resident = self._resident.get(name)
+            return resident.engine if resident is not None else None
+
+    def fits_without_eviction(self, name: str) -> bool:
+        """Whether a model is resident or could be loaded without evicting another one (always without a budget)."""
+        if name not in self.models:
+            raise ValueError(f"Unknown model '{name}'. Registered models: {list(self.models.keys())}")
+        with self._lock:
+            if name in self._resident or self.memory_budget_bytes <= 0:
+                return True
+            used = self._resident_model_bytes_locked() + self._reserved_bytes if self.budget_mode == "model_size" \
+                else get_rss_bytes()
+        # In rss mode the model file size is only a lower bound of what loading it adds
+        return used + os.path.getsize(self.models[name].model_path) <= self.memory_budget_bytes
+
+    @contextmanager
+    def lease(self, name: str) -> Iterator[InferenceModelEngine]:
+        """Engine of a model that is not closed before the with block ends, even if evicted meanwhile."""
+        resident = self._get_resident(name, lease=True)
+        try:
+            yield resident.engine
+        finally:
+            with self._lock:
+                resident.leases -= 1
+                close_now = resident.evicted and resident.leases == 0
+            if close_now:
+                self._close_engine(name, resident)
+
+    def _get_resident(self, name: str, lease: bool) -> _Resident:
+        if name not in self.models:
+            raise ValueError(f"Unknown model '{name}'. Registered models: {list(self.models.keys())}")
+        with self._lock:
+            resident = self._hit_locked(name, lease)
+            if resident is not None:
+                return resident
+
+        # Only one thread loads a given model, others wait and then hit
+        with self._load_locks[name]:
+            with self._lock:
+                resident = self._hit_locked(name, lease)
+                if resident is not None:
+                    return resident
+                self._stats[name].misses += 1
+            return self._load(name, lease)
+
+    def _hit_locked(self, name: str, lease: bool) -> Optional[_Resident]:
+        resident = self._resident.get(name)
+        if resident is not None:
+            self._resident.move_to_end(name)
+            self._stats[name].hits += 1
+            if lease:
+                resident.leases += 1
+        return resident
+
+    def _load(self, name: str, lease: bool) -> _Resident:
+        spec = self.models[name]
+        size_bytes = os.path.getsize(spec.model_path)
+        reserved = self.budget_mode == "model_size" and self.memory_budget_bytes > 0
+        if reserved:
+            # Make room before loading (the model size is known up front), checking and reserving in one step so
+            # concurrent loads of different models cannot both fit into the same room
+            def fits() -> bool:
+                return self._resident_model_bytes_locked() + self._reserved_bytes + size_bytes <= self.memory_budget_bytes
+
+            with self._lock:
+                victims = self._pop_lru_locked(fits, warn=False)
+                # Models still loading cannot be evicted yet, wait for them to become resident
+                while not fits() and self._reserved_bytes > 0:
+                    self._reservations_changed.wait()
+                    victims += self._pop_lru_locked(fits, warn=False)
+                if not fits():
+                    logger.warning(f"Model '{name}' does not fit into the model_size budget of "
+                                   f"{self.memory_budget_bytes} bytes, loading it anyway")
+                self._reserved_bytes += size_bytes
+            self._retire(victims)
+
+        logger.info(f"Loading model '{name}' from {spec.model_path}...")
+        t0 = time.perf_counter()
+        try:
+            engine = self.engine_factory(spec.model_path, spec.adapter_path, self.engine_config)
+        except BaseException:
+            if reserved:
+                with self._lock:
+                    self._reserved_bytes -= size_bytes
+                    self._reservations_changed.notify_all()
+            raise
+        load_s = time.perf_counter() - t0
+        with self._lock:
+            if reserved:
+                self._reserved_bytes -= size_bytes
+                self._reservations_changed.notify_all()
+            resident = self._resident[name] = _Resident(engine=engine, size_bytes=size_bytes, leases=int(lease))
+            stats = self._stats[name]
+            stats.load_count += 1
+            stats.load_time_total_s += load_s
+            stats.last_load_s = load_s
+        logger.info(f"Model '{name}' loaded in {load_s:.3f}s ({len(self._resident)} resident)")
+
+        if self.budget_mode == "rss" and self.memory_budget_bytes > 0 and get_rss_bytes() > self.memory_budget_bytes:
+            # RSS is only known after loading, never evict the model that was just requested. It rarely drops right
+            # after an engine is closed either, so evict at most one model per load instead of draining the registry
+            with self._lock:
+                victims = self._pop_lru_locked(lambda: False, keep=name, limit=1)
+            self._retire(victims)
+        return resident
+
+    def _resident_model_bytes_locked(self) -> int:
+        return sum(r.size_bytes for r in self._resident.values())
+
+    def _resident_model_bytes(self) -> int:
+        with self._lock:
+            return self._resident_model_bytes_locked()
+
+    def _pop_lru_locked(self, within_budget: Callable[[], bool], keep: Optional[str] = None,
+                        limit: Optional[int] = None, warn: bool = True) -> list[tuple[str, _Resident]]:
+        """Take least recently used models out of the registry until within budget (caller holds the lock)."""
+        victims: list[tuple[str, _Resident]] = []
+        while not within_budget() and (limit is None or len(victims) < limit):
+            candidates = [n for n in self._resident if n != keep]
+            if not candidates:
+                if warn:
+                    logger.warning(f"Model registry over its {self.budget_mode} budget of {self.memory_budget_bytes} bytes "
+                                   f"with nothing left to evict")
+                break
+            victim = candidates[0]
+            victims.append((victim, self._resident.pop(victim)))
+            self._stats[victim].evictions += 1
+            logger.info(f"Evicting least recently used model '{victim}' ({self.budget_mode} budget exceeded)")
+        return victims
+
+    def _retire(self, residents: list[tuple[str, _Resident]]):
+        """Close engines taken out of the registry, or leave that to their last running request."""
+        for name, resident in residents:
+            with self._lock:
+                resident.evicted = True
+                close_now = resident.leases == 0
+            if close_now:
+                self._close_engine(name, resident)
+            else:
+                logger.info(f"Model '{name}' still has {resident.leases} request(s) running, closing it afterwards")
+
+    def _close_engine(self, name: str, resident: _Resident):
+        close = getattr(resident.engine, "close", None)
+        if callable(close):
+            close()
+        logger.info(f"Closed engine of model '{name}'")
+
+    def unload(self, name: str):
+        with self._lock:
+            resident = self._resident.pop(name, None)
+        if resident is not None:
+            logger.info(f"Unloaded model '{name}'")
+            self._retire([(name, resident)])
+
+    def close(self):
+        """Unload every resident model, e.g. on worker shutdown."""
+        for name in self.resident_models():
+            self.unload(name)
+
+    # --- Entrance
+    def handle_request(self, req: InferenceRequest):
+        with self.lease(req.model) as engine:
+            return engine.handle_request(req)
+
+    def resident_models(self) -> list[str]:
+        with self._lock:
+            return list(self._resident.keys())
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            per_model = {name: dict(s.__dict__) for name, s in self._stats.items()}
+            resident = list(self._resident.keys())
+            model_bytes = sum(r.size_bytes for r in self._resident.values())
+        hits = sum(s["hits"] for s in per_model.values())
+        misses = sum(s["misses"] for s in per_model.values())
+        return {
+            "resident": resident,
+            "resident_model_bytes": model_bytes,
+            "rss_bytes": get_rss_bytes(),
+            "budget_mode": self.budget_mode,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else None,
+            "models": per_model,
+        }
@@ -8,6 +8,11 @@ Each dimension represents the following variables: (batch_size, height, width, c
 Output shape: (1, 52, 52, 3, 85)
 There are 3 output layers. For each layer, there are 255 outputs: 85 values per anchor, times 3 anchors.
 By default the postprocessing won't save the image, you may want to manually set `save_images=True` in the meta data.
+Images are written in the background, set `wait_for_images=True` as well to return only once they are on disk.
+`index_offset` shifts the {i} of `output_path_template` and the per-image "index", for requests that are one part
+of a larger job (controller/shard_scheduler.py).
+postprocess returns {"detections": DetectionBatch, "output_paths": [...]}, one record array for the whole batch
+(common/detections.py), `result_format="per_image"` gives the older list of per-image dicts.
 """
 
 import numpy as np
@@ -16,11 +21,18 @@ from dataclasses import dataclass
 from scipy import special
 import colorsys
 import random
+import io
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from PIL import Image
 
 import cv2
 
+from common.detections import DetectionBatch
+from worker.inference.image_writer import AsyncImageWriter
+
 
 # Raw Item mode schema, only need to implement the types needed for your model
 RawItemType = Literal["image_bytes", "image_path", "text"]
@@ -31,6 +43,20 @@ class RawItem:
     data: Any
     mime: Optional[str] = None
 
+# Used when the engine does not pass meta["stage_timer"]
+def _null_stage_timer(stage: str):
+    return nullcontext()
+
+@dataclass
+class PreprocessContext:
+    """
+    Handed from preprocess to postprocess through meta["context"], so postprocess never re-reads the images.
+    letterbox rows are [resize_ratio, dw, dh] as used to map boxes back, rgbs is only kept when saving images.
+    """
+    org_shapes: np.ndarray  # (B, 2) original (h, w)
+    letterbox: np.ndarray  # (B, 3) float32
+    rgbs: Optional[list[np.ndarray]] = None
+
 class ModelAdapter:
     """
         Implement these methods to fit a custom model.
@@ -43,6 +69,9 @@ class ModelAdapter:
         """
     def __init__(self):
         self.input_size = 416
+        # Dtype of the fed tensor, "uint8" feeds 0-255 pixels and the engine runs the model variant
+        # that casts and scales in-graph (needs the `onnx` package the first time it is built)
+        self.input_dtype = "float32"
         self.default_output_path = "src/worker/inference/models/yolov4/output.jpg"
 
         self.anchors_path = "src/worker/inference/models/yolov4/yolov4_anchors.txt"
@@ -53,120 +82,297 @@ class ModelAdapter:
         self.score_threshold = 0.25
         self.iou_threshold = 0.213
         self.nms_method = "nms"
+        # Skip decoding anchors whose objectness alone is below score_threshold (same detections, less math)
+        self.objectness_prefilter = True
+        # Cap on candidates entering NMS per image (0 = no cap). A cap is faster on dense scenes but may drop
+        # detections the uncapped NMS keeps, so it is opt-in (meta "nms_top_k")
+        self.nms_top_k = 0
+        # Threads decoding/letterboxing a batch in parallel (cv2 releases the GIL), 1 = sequential
+        self.preprocess_workers = min(8, os.cpu_count() or 1)
+        self._preprocess_pool: Optional[ThreadPoolExecutor] = None
+        self._preprocess_pool_lock = threading.Lock()
+        # Decode large JPEGs at a reduced scale that still covers the input size
+        self.reduced_decode = True
 
         with open(self.anchors_path, 'r') as f:
             self.anchors = f.readline()
         self.anchors = np.array(self.anchors.split(','), dtype=np.float32)
         self.anchors = self.anchors.reshape(3, 3, 2)
+        # Decode grids / anchors per output-size tuple, built once for the default input size
+        self._decode_table_cache: dict[tuple[int, ...], dict[str, np.ndarray]] = {}
+        self._decode_tables(tuple(int(self.input_size // s) for s in self.strides))
         self.names: dict[int, str] = {}
         with open(self.class_names_path, 'r') as f:
             for ID, name in enumerate(f):
                 self.names[ID] = name.strip('\n')
+        self.palette = self._class_palette(len(self.names))
+
+        # save_images: annotated frames are drawn, encoded & written on background threads
+        self.image_writer_max_pending = 16
+        self.image_writer_threads = 1
+        self.image_writer_policy = "block"  # block / drop_newest / drop_oldest, see worker/inference/image_writer.py
+        self._image_writer: Optional[AsyncImageWriter] = None
+        self._image_writer_lock = threading.Lock()
+        # Set by close, the writer / preprocess pool are not lazily recreated for a closed engine
+        self._closed = False
 
         pass
 
-    def _image_preprocess(self, image_rgb: np.ndarray) -> np.ndarray:
+    def _image_preprocess(self, image_rgb: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Letterbox into `out` ((input_size, input_size, 3) float32, e.g. a slice of the batch tensor)."""
         ih = iw = self.input_size
         h, w, _ = image_rgb.shape
         scale = min(iw / w, ih / h)
         nw, nh = int(scale * w), int(scale * h)
         image_resized = cv2.resize(image_rgb, (nw, nh))
 
-        image_padded = np.full((ih, iw, 3), 128.0, dtype=np.float32)
+        if out is None:
+            out = np.empty((ih, iw, 3), dtype=np.float32)
         dw, dh = (iw - nw) // 2, (ih - nh) // 2
-        image_padded[dh:dh + nh, dw:dw + nw, :] = image_resized.astype(np.float32)
-        image_padded = image_padded / 255.0
-        return image_padded
+        # Only the padding is filled, the resized image is scaled straight into place without temporaries
+        pad = np.float32(128.0) / np.float32(255.0)
+        out[:dh] = pad
+        out[dh + nh:] = pad
+        out[dh:dh + nh, :dw] = pad
+        out[dh:dh + nh, dw + nw:] = pad
+        np.divide(image_resized, np.float32(255.0), out=out[dh:dh + nh, dw:dw + nw], dtype=np.float32)
+        return out
+
+    def _image_preprocess_uint8(self, image_rgb: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Letterbox kept in uint8 (resize + constant border), the /255 happens in the model."""
+        ih = iw = self.input_size
+        h, w, _ = image_rgb.shape
+        scale = min(iw / w, ih / h)
+        nw, nh = int(scale * w), int(scale * h)
+        image_resized = cv2.resize(image_rgb, (nw, nh))
 
-    def preprocess(self, items: list[RawItem], meta: Optional[dict[str, Any]] = None) -> dict[str, np.ndarray]:
-        imgs = []
-        for i in items:
-            bgr = None
-            if i.type == "image_path":
-                bgr = cv2.imread(i.data)
-                if bgr is None:
-                    raise ValueError(f"Failed to read image path: {i.data}")
-            elif i.type == "image_bytes":
-                bgr = np.frombuffer(i.data, dtype=np.uint8)
-                bgr = cv2.imdecode(bgr, cv2.IMREAD_COLOR)
-                if bgr is None:
-                    raise ValueError(f"Failed to decode image bytes: {i.data}")
-            else:
-                raise ValueError(f"Unsupported raw item type for yolov4: {i.type}")
-            assert bgr is not None
-            rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-            imgs.append(self._image_preprocess(rgb))
-        batch = np.stack(imgs, axis=0).astype(np.float32)
-        return {"input_1:0": batch}
+        if out is None:
+            out = np.empty((ih, iw, 3), dtype=np.uint8)
+        dw, dh = (iw - nw) // 2, (ih - nh) // 2
+        cv2.copyMakeBorder(image_resized, dh, ih - nh - dh, dw, iw - nw - dw, cv2.BORDER_CONSTANT,
+                           dst=out, value=(128, 128, 128))
+        return out
 
     @staticmethod
-    def _postprocess_bbbox(pred_bbox: list[np.ndarray], ANCHORS, STRIDES, XYSCALE):
-        for i, pred in enumerate(pred_bbox):
-            conv_shape = pred.shape
-            output_size = conv_shape[1]
-            conv_raw_dxdy = pred[:, :, :, :, 0:2]
-            conv_raw_dwdh = pred[:, :, :, :, 2:4]
-            xy_grid = np.meshgrid(np.arange(output_size), np.arange(output_size))
-            xy_grid = np.expand_dims(np.stack(xy_grid, axis=-1), axis=2)
-
-            xy_grid = np.tile(np.expand_dims(xy_grid, axis=0), [1, 1, 1, 3, 1])
-            xy_grid = xy_grid.astype(np.float64)
-
-            pred_xy = ((special.expit(conv_raw_dxdy) * XYSCALE[i]) - 0.5 * (XYSCALE[i] - 1) + xy_grid) * STRIDES[i]
-            pred_wh = (np.exp(conv_raw_dwdh) * ANCHORS[i])
-            pred[:, :, :, :, 0:4] = np.concatenate([pred_xy, pred_wh], axis=-1)
-
-        pred_bbox = [np.reshape(x, (-1, np.shape(x)[-1])) for x in pred_bbox]
-        pred_bbox = np.concatenate(pred_bbox, axis=0)
-        return pred_bbox
+    def _load_rgb(item: RawItem, flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+        if item.type == "image_path":
+            bgr = cv2.imread(item.data, flags)
+            if bgr is None:
+                raise ValueError(f"Failed to read image path: {item.data}")
+        elif item.type == "image_bytes":
+            bgr = cv2.imdecode(np.frombuffer(item.data, dtype=np.uint8), flags)
+            if bgr is None:
+                raise ValueError("Failed to decode image bytes")
+        else:
+            raise ValueError(f"Unsupported raw item type for yolov4: {item.type}")
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
 
     @staticmethod
-    def _postprocess_boxes(pred_bbox, org_img_shape, input_size, score_threshold):
-        valid_scale = [0, np.inf]
-        pred_bbox = np.array(pred_bbox)
-
-        pred_xywh = pred_bbox[:, 0:4]
-        pred_conf = pred_bbox[:, 4]
-        pred_prob = pred_bbox[:, 5:]
-
-        # (x, y, w, h) -> (xmin, ymin, xmax, ymax)
-        pred_coor = np.concatenate(
-            [
-                pred_xywh[:, :2] - pred_xywh[:, 2:] * 0.5,
-                pred_xywh[:, :2] + pred_xywh[:, 2:] * 0.5,
-            ],
-            axis=-1,
-        )
-
-        org_h, org_w = org_img_shape
-        resize_ratio = min(input_size / org_w, input_size / org_h)
+    def _jpeg_size(item: RawItem) -> Optional[tuple[int, int]]:
+        """(h, w) of a JPEG as cv2 would decode it (EXIF orientation applied) from the header only, None otherwise."""
+        try:
+            with Image.open(item.data if item.type == "image_path" else io.BytesIO(item.data)) as im:
+                if im.format != "JPEG":
+                    return None
+                w, h = im.size
+                # Orientations 5-8 rotate by 90 degrees, cv2 applies them on decode
+                if im.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                    w, h = h, w
+                return h, w
+        except (OSError, ValueError, Image.DecompressionBombError, Image.DecompressionBombWarning):
+            # PIL refuses (or, with warnings as errors, warns about) very large images even for a header read,
+            # those fall back to the full decode
+            return None
+
+    def _decode_reduced(self, item: RawItem) -> tuple[np.ndarray, tuple[int, int]]:
+        """
+        Decode a JPEG at the smallest 1/2, 1/4 or 1/8 scale whose long side still covers the input size
+        (libjpeg scales during IDCT, so far less work and memory than a full decode + resize).
+        Returns the frame and the original (h, w) that boxes are mapped back to.
+        """
+        size = self._jpeg_size(item) if item.type in ("image_path", "image_bytes") else None
+        if size is not None:
+            long_side = max(size)
+            for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                 (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                if long_side // factor >= self.input_size:
+                    return self._load_rgb(item, flag), size
+        rgb = self._load_rgb(item)
+        return rgb, rgb.shape[:2]
+
+    def _letterbox_params(self, org_shapes: np.ndarray) -> np.ndarray:
+        """(B, 2) original (h, w) -> (B, 3) float32 [resize_ratio, dw, dh] for mapping boxes back."""
+        org = org_shapes.astype(np.float32)
+        org_h, org_w = org[:, 0], org[:, 1]
+        input_size = np.float32(self.input_size)
+        resize_ratio = np.minimum(input_size / org_w, input_size / org_h)
         dw = (input_size - resize_ratio * org_w) / 2
         dh = (input_size - resize_ratio * org_h) / 2
+        return np.stack([resize_ratio, dw, dh], axis=-1)
+
+    def _get_preprocess_pool(self) -> ThreadPoolExecutor:
+        # Created on first use and reused by every request, the adapter is shared between engine threads
+        with self._preprocess_pool_lock:
+            if self._closed:
+                raise RuntimeError("YOLOv4Adapter is closed")
+            if self._preprocess_pool is None:
+                self._preprocess_pool = ThreadPoolExecutor(max_workers=self.preprocess_workers,
+                                                           thread_name_prefix="yolov4-preprocess")
+            return self._preprocess_pool
+
+    def _preprocess_one(self, item: RawItem, out: np.ndarray, stage_timer, keep_rgb: bool, reduced: bool):
+        """Decode + letterbox one item into `out`, returns (original (h, w), frame if `keep_rgb` else None)."""
+        with stage_timer("decode"):
+            # Frames kept for drawing must be full size, boxes are in original image coordinates
+            if reduced and not keep_rgb:
+                rgb, org_shape = self._decode_reduced(item)
+            else:
+                rgb = self._load_rgb(item)
+                org_shape = rgb.shape[:2]
+        with stage_timer("letterbox"):
+            if out.dtype == np.uint8:
+                self._image_preprocess_uint8(rgb, out=out)
+            else:
+                self._image_preprocess(rgb, out=out)
+        return org_shape, (rgb if keep_rgb else None)
 
-        pred_coor[:, 0::2] = 1.0 * (pred_coor[:, 0::2] - dw) / resize_ratio
-        pred_coor[:, 1::2] = 1.0 * (pred_coor[:, 1::2] - dh) / resize_ratio
-
-        pred_coor = np.concatenate(
-            [
-                np.maximum(pred_coor[:, :2], [0, 0]),
-                np.minimum(pred_coor[:, 2:], [org_w - 1, org_h - 1]),
-            ],
-            axis=-1,
-        )
-
-        invalid_mask = np.logical_or((pred_coor[:, 0] > pred_coor[:, 2]), (pred_coor[:, 1] > pred_coor[:, 3]))
-        pred_coor[invalid_mask] = 0
+    def preprocess(self, items: list[RawItem], meta: Optional[dict[str, Any]] = None) -> dict[str, np.ndarray]:
+        stage_timer = (meta or {}).get("stage_timer", _null_stage_timer)
+        keep_rgbs = bool((meta or {}).get("save_images", False))
+        reduced = bool((meta or {}).get("reduced_decode", self.reduced_decode))
+        # meta["preprocess_workers"] <= 1 forces the sequential path for this request
+        parallel = int((meta or {}).get("preprocess_workers", self.preprocess_workers)) > 1 and len(items) > 1
+
+        # Every image is letterboxed straight into its slice of the batch tensor
+        batch = np.empty((len(items), self.input_size, self.input_size, 3), dtype=self.input_dtype)
+        if parallel:
+            pool = self._get_preprocess_pool()
+            done = list(pool.map(lambda i: self._preprocess_one(items[i], batch[i], stage_timer, keep_rgbs, reduced),
+                                 range(len(items))))
+        else:
+            done = [self._preprocess_one(item, batch[i], stage_timer, keep_rgbs, reduced) for i, item in enumerate(items)]
+
+        if meta is not None:
+            org_shapes = np.array([shape for shape, _ in done], dtype=np.int64).reshape(-1, 2)
+            rgbs = [rgb for _, rgb in done]
+            meta["context"] = PreprocessContext(org_shapes=org_shapes, letterbox=self._letterbox_params(org_shapes),
+                                                rgbs=rgbs if keep_rgbs else None)
+        return {"input_1:0": batch}
 
-        bboxes_scale = np.sqrt(np.multiply.reduce(pred_coor[:, 2:4] - pred_coor[:, 0:2], axis=-1))
-        scale_mask = np.logical_and((valid_scale[0] < bboxes_scale), (bboxes_scale < valid_scale[1]))
+    def _build_decode_tables(self, output_sizes: tuple[int, ...]) -> dict[str, np.ndarray]:
+        """
+        Per-anchor constants for all scales, in the order of the outputs reshaped to (B, -1, 85).
+        pred_xy = (sigmoid(raw) * xyscale - 0.5 * (xyscale - 1) + grid) * stride is folded into
+        sigmoid(raw) * xy_mult + xy_offset, pred_wh = exp(raw) * anchors.
+        """
+        xy_mult, xy_offset, anchors = [], [], []
+        for i, n in enumerate(output_sizes):
+            stride = float(self.strides[i])
+            xyscale = float(self.xyscale[i])
+            ys, xs = np.meshgrid(np.arange(n, dtype=np.float32), np.arange(n, dtype=np.float32), indexing="ij")
+            grid = np.broadcast_to(np.stack([xs, ys], axis=-1)[:, :, np.newaxis, :], (n, n, 3, 2)).reshape(-1, 2)
+            xy_offset.append((grid - np.float32(0.5 * (xyscale - 1))) * np.float32(stride))
+            xy_mult.append(np.full((n * n * 3, 1), xyscale * stride, dtype=np.float32))
+            anchors.append(np.broadcast_to(self.anchors[i][np.newaxis, np.newaxis], (n, n, 3, 2)).reshape(-1, 2))
+        return {
+            "xy_mult": np.concatenate(xy_mult, axis=0),
+            "xy_offset": np.concatenate(xy_offset, axis=0),
+            "anchors": np.concatenate(anchors, axis=0).astype(np.float32),
+        }
+
+    def _decode_tables(self, output_sizes: tuple[int, ...]) -> dict[str, np.ndarray]:
+        tables = self._decode_table_cache.get(output_sizes)
+        if tables is None:
+            tables = self._decode_table_cache[output_sizes] = self._build_decode_tables(output_sizes)
+        return tables
 
+    @staticmethod
+    def _decode_rows(pred: np.ndarray, xy_mult: np.ndarray, xy_offset: np.ndarray, anchors: np.ndarray,
+                     org_hw: np.ndarray, letterbox: np.ndarray, score_threshold: float):
+        """
+        Decode anchors `pred` (..., 85), every other argument broadcasts against pred[..., 0]
+        (tables (..., k), org_hw (..., 2) float32, letterbox (..., 3)).
+        Returns (coor, scores, classes, mask) with mask marking valid boxes above score_threshold.
+        """
+        # (x, y, w, h) -> (xmin, ymin, xmax, ymax) in network input space
+        xy = special.expit(pred[..., 0:2]) * xy_mult + xy_offset
+        half_wh = np.exp(pred[..., 2:4]) * anchors * np.float32(0.5)
+        coor = np.concatenate([xy - half_wh, xy + half_wh], axis=-1)
+
+        # Undo the letterbox per image
+        org_h, org_w = org_hw[..., 0], org_hw[..., 1]
+        resize_ratio, dw, dh = letterbox[..., 0], letterbox[..., 1], letterbox[..., 2]
+        coor[..., 0::2] -= dw[..., np.newaxis]
+        coor[..., 1::2] -= dh[..., np.newaxis]
+        coor /= resize_ratio[..., np.newaxis]
+
+        # Clip to the original image, zero out inverted boxes
+        np.maximum(coor[..., 0:2], 0, out=coor[..., 0:2])
+        np.minimum(coor[..., 2], org_w - 1, out=coor[..., 2])
+        np.minimum(coor[..., 3], org_h - 1, out=coor[..., 3])
+        invalid_mask = (coor[..., 0] > coor[..., 2]) | (coor[..., 1] > coor[..., 3])
+        coor[invalid_mask] = 0
+
+        bboxes_scale = np.sqrt(np.multiply.reduce(coor[..., 2:4] - coor[..., 0:2], axis=-1))
+        scale_mask = np.logical_and(0 < bboxes_scale, bboxes_scale < np.inf)
+
+        pred_prob = pred[..., 5:]
         classes = np.argmax(pred_prob, axis=-1)
-        scores = pred_conf * pred_prob[np.arange(len(pred_coor)), classes]
-        score_mask = scores > score_threshold
-        mask = np.logical_and(scale_mask, score_mask)
+        scores = pred[..., 4] * np.take_along_axis(pred_prob, classes[..., np.newaxis], axis=-1)[..., 0]
+        mask = np.logical_and(scale_mask, scores > score_threshold)
+        return coor, scores, classes, mask
 
-        coors, scores, classes = pred_coor[mask], scores[mask], classes[mask]
-        return np.concatenate([coors, scores[:, np.newaxis], classes[:, np.newaxis]], axis=-1)
+    def _decode_batch(self, detections: list[np.ndarray], org_shapes: np.ndarray, letterbox: np.ndarray,
+                      score_threshold: float, prefilter: bool = True) -> list[np.ndarray]:
+        """
+        Decode every image and every scale in one vectorized pass (float32 throughout).
+        detections: the 3 output layers (B, n, n, 3, 85), org_shapes: (B, 2) original (h, w),
+        letterbox: (B, 3) [resize_ratio, dw, dh] from `_letterbox_params`
+        prefilter: only decode anchors whose objectness alone passes score_threshold. The model emits
+        sigmoid objectness & class probabilities, so score = objectness * prob <= objectness and the
+        detections are identical to decoding every anchor.
+        Returns per-image candidate arrays of [xmin, ymin, xmax, ymax, score, cls] above score_threshold.
+        """
+        B = int(detections[0].shape[0])
+        tables = self._decode_tables(tuple(int(d.shape[1]) for d in detections))
+        org = org_shapes.astype(np.float32)
+
+        if prefilter:
+            # Only the objectness column is read for every anchor, survivors are gathered per scale
+            img_parts, anchor_parts, row_parts = [], [], []
+            offset = 0
+            for d in detections:
+                flat = d.reshape(B, -1, d.shape[-1])
+                img_i, anchor_i = np.nonzero(flat[..., 4] > score_threshold)
+                img_parts.append(img_i)
+                anchor_parts.append(anchor_i + offset)
+                row_parts.append(flat[img_i, anchor_i])
+                offset += flat.shape[1]
+            # Back to (image, anchor) order, like np.nonzero over the whole batch
+            img_idx, anchor_idx = np.concatenate(img_parts), np.concatenate(anchor_parts)
+            order = np.lexsort((anchor_idx, img_idx))
+            img_idx, anchor_idx = img_idx[order], anchor_idx[order]
+            rows = np.concatenate(row_parts, axis=0)[order]
+
+            coor, scores, classes, mask = self._decode_rows(
+                rows, tables["xy_mult"][anchor_idx], tables["xy_offset"][anchor_idx], tables["anchors"][anchor_idx],
+                org[img_idx], letterbox[img_idx], score_threshold)
+            img_idx = img_idx[mask]
+            coor, scores, classes = coor[mask], scores[mask], classes[mask]
+        else:
+            # The model outputs are left untouched, only this concatenated copy is written
+            pred = np.concatenate([d.reshape(B, -1, d.shape[-1]) for d in detections], axis=1)
+            coor, scores, classes, mask = self._decode_rows(
+                pred, tables["xy_mult"], tables["xy_offset"], tables["anchors"],
+                org[:, np.newaxis, :], letterbox[:, np.newaxis, :], score_threshold)
+            # Gather survivors of all images at once
+            img_idx, anchor_idx = np.nonzero(mask)
+            coor, scores, classes = coor[img_idx, anchor_idx], scores[img_idx, anchor_idx], classes[img_idx, anchor_idx]
+
+        # Split by image
+        candidates = np.concatenate([coor, scores[:, np.newaxis], classes[:, np.newaxis].astype(np.float32)], axis=-1)
+        counts = np.bincount(img_idx, minlength=B)
+        return np.split(candidates, np.cumsum(counts)[:-1])
 
     @staticmethod
     def _bboxes_iou(boxes1, boxes2):
@@ -185,47 +391,83 @@ class ModelAdapter:
         ious = np.maximum(1.0 * inter_area / union_area, np.finfo(np.float32).eps)
         return ious
 
-    def _nms(self, bboxes, iou_threshold, sigma=0.3, method="nms"):
-        classes_in_img = list(set(bboxes[:, 5]))
-        best_bboxes = []
-
-        for cls in classes_in_img:
-            cls_mask = (bboxes[:, 5] == cls)
-            cls_bboxes = bboxes[cls_mask]
-
-            while len(cls_bboxes) > 0:
-                max_ind = np.argmax(cls_bboxes[:, 4])
-                best_bbox = cls_bboxes[max_ind]
-                best_bboxes.append(best_bbox)
-                cls_bboxes = np.concatenate([cls_bboxes[:max_ind], cls_bboxes[max_ind + 1:]])
-                iou = self._bboxes_iou(best_bbox[np.newaxis, :4], cls_bboxes[:, :4])
-                weight = np.ones((len(iou),), dtype=np.float32)
-
-                if method == "nms":
-                    iou_mask = iou > iou_threshold
-                    weight[iou_mask] = 0.0
-                elif method == "soft-nms":
-                    weight = np.exp(-(1.0 * iou ** 2 / sigma))
-                else:
-                    raise ValueError("method must be 'nms' or 'soft-nms'")
-
-                cls_bboxes[:, 4] = cls_bboxes[:, 4] * weight
-                score_mask = cls_bboxes[:, 4] > 0.0
-                cls_bboxes = cls_bboxes[score_mask]
+    @staticmethod
+    def _iou_one_to_many(box: np.ndarray, box_area, boxes: np.ndarray, areas: np.ndarray) -> np.ndarray:
+        # Same arithmetic as _bboxes_iou, with the areas computed once per image instead of once per pick
+        left_up = np.maximum(box[:2], boxes[:, :2])
+        right_down = np.minimum(box[2:], boxes[:, 2:])
+        inter_section = np.maximum(right_down - left_up, 0.0)
+        inter_area = inter_section[:, 0] * inter_section[:, 1]
+        union_area = box_area + areas - inter_area
+        return np.maximum(1.0 * inter_area / union_area, np.finfo(np.float32).eps)
 
-        return best_bboxes
+    def _nms(self, bboxes, iou_threshold, sigma=0.3, method="nms", top_k: Optional[int] = None) -> np.ndarray:
+        """
+        Per-class NMS on one image's candidates [xmin, ymin, xmax, ymax, score, cls].
+        Candidates are sorted once, capped to the `top_k` best (0/None keeps all) and grouped by class,
+        every pick only compares against the same-class candidates still alive.
+        Returns the kept rows by descending (final) score across classes, ties in ascending class id then pick order.
+        Same rows as the original per-class loop without a cap, whose class order followed set() iteration.
+        """
+        if method not in ("nms", "soft-nms"):
+            raise ValueError("method must be 'nms' or 'soft-nms'")
+        bboxes = np.asarray(bboxes)
+        if len(bboxes) == 0:
+            return bboxes.reshape(0, 6)
+
+        # Stable sorts keep the earliest candidate first among equal scores, like argmax did
+        order = np.argsort(-bboxes[:, 4], kind="stable")
+        if top_k:
+            order = order[:top_k]
+        order = order[np.argsort(bboxes[order, 5], kind="stable")]
+        bboxes = bboxes[order]
+        boxes = bboxes[:, :4]
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        scores = bboxes[:, 4].copy()
+        splits = np.flatnonzero(np.diff(bboxes[:, 5])) + 1
+
+        picked = []
+        for start, end in zip(np.r_[0, splits], np.r_[splits, len(bboxes)]):
+            if method == "nms":
+                # Sorted by score within the class, so the best remaining candidate is always the first
+                remaining = np.arange(start, end)
+                while remaining.size > 0:
+                    best, rest = remaining[0], remaining[1:]
+                    picked.append(best)
+                    iou = self._iou_one_to_many(boxes[best], areas[best], boxes[rest], areas[rest])
+                    remaining = rest[~(iou > iou_threshold)]
+            else:
+                # soft-nms decays scores after every pick, argmax over candidates in their original order
+                alive = start + np.argsort(order[start:end], kind="stable")
+                alive = alive[scores[alive] > 0.0]
+                while alive.size > 0:
+                    pos = int(np.argmax(scores[alive]))
+                    best = alive[pos]
+                    picked.append(best)
+                    alive = np.delete(alive, pos)
+                    iou = self._iou_one_to_many(boxes[best], areas[best], boxes[alive], areas[alive])
+                    scores[alive] = scores[alive] * np.exp(-(1.0 * iou ** 2 / sigma))
+                    alive = alive[scores[alive] > 0.0]
+
+        kept = bboxes[picked]
+        kept[:, 4] = scores[picked]
+        return kept[np.argsort(-kept[:, 4], kind="stable")]
 
     @staticmethod
-    def _draw_bbox(image_rgb: np.ndarray, bboxes, classes: dict[int, str], show_label=True):
-        num_classes = len(classes)
-        image_h, image_w, _ = image_rgb.shape
+    def _class_palette(num_classes: int) -> list[tuple[int, int, int]]:
         hsv_tuples = [(1.0 * x / num_classes, 1.0, 1.0) for x in range(num_classes)]
         colors = list(map(lambda x: colorsys.hsv_to_rgb(*x), hsv_tuples))
         colors = list(map(lambda x: (int(x[0] * 255), int(x[1] * 255), int(x[2] * 255)), colors))
+        # Fixed shuffle without touching the global `random` state
+        random.Random(0).shuffle(colors)
+        return colors
 
-        random.seed(0)
-        random.shuffle(colors)
-        random.seed(None)
+    @staticmethod
+    def _draw_bbox(image_rgb: np.ndarray, bboxes, classes: dict[int, str], show_label=True,
+                   colors: Optional[list[tuple[int, int, int]]] = None):
+        image_h, image_w, _ = image_rgb.shape
+        if colors is None:
+            colors = ModelAdapter._class_palette(len(classes))
 
         for bbox in bboxes:
             coor = np.array(bbox[:4], dtype=np.int32)
@@ -260,16 +502,52 @@ class ModelAdapter:
 
         return image_rgb
 
+    def _draw_job(self, frame: np.ndarray, bboxes) -> np.ndarray:
+        # The frame belongs to the writer job, draw in place
+        return self._draw_bbox(frame, bboxes, self.names, colors=self.palette)
+
+    def _get_image_writer(self) -> AsyncImageWriter:
+        with self._image_writer_lock:
+            if self._closed:
+                raise RuntimeError("YOLOv4Adapter is closed")
+            if self._image_writer is None:
+                self._image_writer = AsyncImageWriter(self._draw_job, max_pending=self.image_writer_max_pending,
+                                                      num_threads=self.image_writer_threads,
+                                                      policy=self.image_writer_policy)
+            return self._image_writer
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait for queued annotated images to be written."""
+        writer = self._image_writer
+        return writer.flush(timeout) if writer is not None else True
+
+    def close(self):
+        """Drain the image writer and stop the preprocess threads, called when the engine is unloaded."""
+        with self._image_writer_lock:
+            self._closed = True
+            writer, self._image_writer = self._image_writer, None
+        if writer is not None:
+            writer.close(drain=True)
+        with self._preprocess_pool_lock:
+            pool, self._preprocess_pool = self._preprocess_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
     # Draw boxes on detected objects & save to tests/worker/model/yolov4/index_output.jpg
     def postprocess(self, outputs: dict[str, np.ndarray], meta: Optional[dict[str, Any]] = None) -> Any:
         # Meta override
         meta = meta or {}
         output_dir = meta.get("output_dir", "tests/worker/model/yolov4")
         output_path_tpl = meta.get("output_path_template", os.path.join(output_dir, "output_{i}.jpg"))
+        index_offset = int(meta.get("index_offset", 0))
         score_th = float(meta.get("score_threshold", self.score_threshold))
         iou_th = float(meta.get("iou_threshold", self.iou_threshold))
         nms_method = str(meta.get("nms_method", self.nms_method))
+        nms_top_k = int(meta.get("nms_top_k", self.nms_top_k))
+        prefilter = bool(meta.get("objectness_prefilter", self.objectness_prefilter))
+        result_format = str(meta.get("result_format", "records"))
         save_images = bool(meta.get("save_images", False))
+        stage_timer = meta.get("stage_timer", _null_stage_timer)
 
         # 1. outputs dict -> detections list (3 scales) in correct order
         output_names = ['Identity:0', 'Identity_1:0', 'Identity_2:0']
@@ -279,59 +557,62 @@ class ModelAdapter:
             if int(d.shape[0]) != B:
                 raise ValueError("YOLO outputs have inconsistent batch dimension.")
 
-        # 2. Check raw items to draw boxes on original inputs image
-        items = meta.get("items")
-        if items is None:
-            raise ValueError("Raw items are required for YOLOv4 model postprocessing! (only raw item mode supported)")
-        if len(items) != B:
-            raise ValueError(f"YOLO outputs have inconsistent batch dimension with raw items: inputs-{len(items)} vs output-{B}")
-
-        # 3. Draw boxes for each image
-        results = []
-        os.makedirs(output_dir, exist_ok=True)
+        # 2. Original shapes / letterbox / frames from preprocess, popped so they are freed with the request
+        ctx = meta.pop("context", None)
+        if ctx is None:
+            # postprocess called without preprocess (e.g. directly on outputs), fall back to reading the items
+            items = meta.get("items")
+            if items is None:
+                raise ValueError("Raw items are required for YOLOv4 model postprocessing! (only raw item mode supported)")
+            with stage_timer("reload_image"):
+                rgbs = [self._load_rgb(it) for it in items]
+            org_shapes = np.array([rgb.shape[:2] for rgb in rgbs], dtype=np.int64).reshape(-1, 2)
+            ctx = PreprocessContext(org_shapes=org_shapes, letterbox=self._letterbox_params(org_shapes), rgbs=rgbs)
+        if len(ctx.org_shapes) != B:
+            raise ValueError(f"YOLO outputs have inconsistent batch dimension with raw items: inputs-{len(ctx.org_shapes)} vs output-{B}")
+        if save_images and ctx.rgbs is None:
+            raise ValueError("save_images must be set in the request meta before preprocess to keep the decoded images")
+
+        # 3. Decode + score filter for the whole batch
+        with stage_timer("decode_boxes"):
+            candidates = self._decode_batch(detections_all, ctx.org_shapes, ctx.letterbox, score_th, prefilter)
+
+        # 4. NMS & draw boxes for each image
+        kept, output_paths = [], []
         for i in range(B):
-            # 3.1 load original image for item i
-            it = items[i]
-            if it.type == "image_path":
-                bgr = cv2.imread(it.data)
-                if bgr is None:
-                    raise ValueError(f"Failed to read image path: {it.data}")
-            elif it.type == "image_bytes":
-                buf = np.frombuffer(it.data, dtype=np.uint8)
-                bgr = cv2.imdecode(buf, cv2.IMREAD_COLOR)
-                if bgr is None:
-                    raise ValueError("Failed to decode image bytes")
-            else:
-                raise ValueError(f"Unsupported raw item type for yolov4 postprocess: {it.type}")
-
-            rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-            original_shape = rgb.shape[:2]  # (h, w)
-
-            # 3.2 slice each output layer to this image (keep batch dim = 1)
-            detections_i = [d[i:i + 1, ...] for d in detections_all]
-
-            # 3.3 decode + filter + nms (same logic as B=1)
-            pred_bbox = self._postprocess_bbbox(detections_i, self.anchors, self.strides, self.xyscale)
-            bboxes = self._postprocess_boxes(pred_bbox, original_shape, self.input_size, score_th)
-            bboxes = self._nms(bboxes, iou_th, method=nms_method)
+            with stage_timer("nms"):
+                bboxes = self._nms(candidates[i], iou_th, method=nms_method, top_k=nms_top_k)
+            kept.append(bboxes)
 
             out_path = None
             if save_images:
-                drawn = self._draw_bbox(rgb.copy(), bboxes, self.names)
-                out_path = output_path_tpl.format(i=i)
-                Image.fromarray(drawn).save(out_path)
-
-            results.append({
-                "index": i,
-                "num_boxes": len(bboxes),
-                "bboxes": bboxes,  # list of [xmin, ymin, xmax, ymax, score, cls]
-                "output_path": out_path,  # None if save_images=False
-            })
-
-        return results
+                # Only the enqueue is on the inference path (it blocks under the "block" policy when the disk lags)
+                with stage_timer("save_image"):
+                    path = output_path_tpl.format(i=index_offset + i)
+                    if self._get_image_writer().submit(ctx.rgbs[i], bboxes, path):
+                        out_path = path
+                ctx.rgbs[i] = None
+            output_paths.append(out_path)  # None if save_images=False or the writer dropped the image
+
+        if save_images and meta.get("wait_for_images", False):
+            self.flush()
+
+        # One record array for the whole batch, see common/detections.py
+        detections = DetectionBatch.from_per_image(kept)
+        if result_format == "per_image":
+            return [{
+                "index": index_offset + i,
+                "num_boxes": int(detections.offsets[i + 1] - detections.offsets[i]),
+                "bboxes": detections.boxes(i),  # (num_boxes, 6) [xmin, ymin, xmax, ymax, score, cls]
+                "output_path": output_paths[i],
+            } for i in range(B)]
+        return {"detections": detections, "output_paths": output_paths}
 
     # Generate random input data for the custom model
     def generate_dummy_inputs(self, batch_size: int = 1, seed: int = 42) -> dict[str, np.ndarray]:
         rng = np.random.default_rng(seed)
+        if self.input_dtype == "uint8":
+            x = rng.integers(0, 256, (batch_size, self.input_size, self.input_size, 3), dtype=np.uint8)
+            return {"input_1:0": x}
         x = rng.random((batch_size, self.input_size, self.input_size, 3), dtype=np.float32)
         return {"input_1:0": x}
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, Optional
 
 from common.network import NetworkManager
 from common.model import WorkerHeartbeat, ConnectionType, InterfaceStatus, ConnectivityTestResponse
@@ -192,7 +192,7 @@ class WorkerNetworkController(NetworkManager):
             logger.error(f"Failed to verify control plane connectivity to controller: {e}")
             return False
 
-    def _send_control_heartbeat(self, serial: str, hardware_identifier: str) -> bool:
+    def _send_control_heartbeat(self, serial: str, hardware_identifier: str, capability_fingerprint: Optional[str] = None) -> bool:
         try:
             logger.info("Sending heartbeat to controller...")
             heartbeat = WorkerHeartbeat(
@@ -203,7 +203,8 @@ class WorkerNetworkController(NetworkManager):
                 data_connectivity=self._verify_data_connectivity(),
                 data_ip_address=self.wifi_ipv4 if self.current_mode == ConnectionType.WIFI else self.eth_ipv4,
                 data_plane=self.current_mode,
-                timestamp=int(time())
+                timestamp=int(time()),
+                capability_fingerprint=capability_fingerprint
             )
             r = requests.post(f"http://{self.eth_controller_ipv4}:{self.control_port}/api/heartbeat", json=heartbeat.__dict__, timeout=5)
             if r.status_code == 200:
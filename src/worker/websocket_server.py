@@ -1,5 +1,6 @@
 import asyncio
 import logging
+from typing import Any
 from fastapi import WebSocket, WebSocketDisconnect
 import json
 
@@ -10,10 +11,34 @@ class WorkerWebSocketServer:
         self.config = config
         self.current_websocket: WebSocket | None = None
         self.command_handlers: dict[str, callable] = {}
+        # Commands carrying an "id" are RPC calls, they run concurrently and get a reply with the handler's result
+        self._send_lock = asyncio.Lock()
+        self._call_tasks: set[asyncio.Task] = set()
 
     def register_handler(self, command: str, handler: callable):
+        """`handler(data)` is awaited, its (JSON-able) return value is the result of RPC calls."""
         self.command_handlers[command] = handler
 
+    async def _send_text(self, websocket: WebSocket, message: str):
+        async with self._send_lock:
+            await websocket.send_text(message)
+
+    async def _handle_call(self, websocket: WebSocket, call_id: Any, command: str, data: dict[str, any]):
+        handler = self.command_handlers.get(command)
+        if handler is None:
+            logger.warning(f"Received unknown command '{command}' via WebSocket")
+            reply = {"id": call_id, "error": f"Unknown command '{command}'"}
+        else:
+            try:
+                reply = {"id": call_id, "result": await handler(data)}
+            except Exception as e:
+                logger.error(f"Command '{command}' (call {call_id}) failed: {e}")
+                reply = {"id": call_id, "error": str(e) or type(e).__name__}
+        try:
+            await self._send_text(websocket, json.dumps(reply, default=str))
+        except Exception as e:
+            logger.error(f"Failed to send reply to call {call_id}: {e}")
+
     async def handle_connection(self, websocket: WebSocket):
         await websocket.accept()
         self.current_websocket = websocket
@@ -21,7 +46,14 @@ class WorkerWebSocketServer:
         print("New WebSocket connection established with controller")
         try:
             while True:
-                message = await websocket.receive_text()
+                received = await websocket.receive()
+                if received["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(received.get("code", 1000))
+                if received.get("bytes") is not None:
+                    # Wire frames (common/wire.py) go to the data plane server, not the control connection
+                    logger.warning("Ignoring binary message on the control WebSocket")
+                    continue
+                message = received.get("text") or ""
                 logger.debug(f"Received WebSocket message: {message}")
                 try:
                     payload: dict[str, any] = json.loads(message)
@@ -30,6 +62,11 @@ class WorkerWebSocketServer:
                     if not command:
                         logger.warning("Received WebSocket message without 'command' field")
                         continue
+                    if payload.get("id") is not None:
+                        task = asyncio.create_task(self._handle_call(websocket, payload["id"], command, data))
+                        self._call_tasks.add(task)
+                        task.add_done_callback(self._call_tasks.discard)
+                        continue
                     if command in self.command_handlers:
                         print(f"Handling command: {command} with data: {data}")
                         await self.command_handlers[command](data)
@@ -44,6 +81,8 @@ class WorkerWebSocketServer:
             logger.error(f"WebSocket connection error: {e}")
             print(f"WebSocket connection error: {e}")
         finally:
+            for task in self._call_tasks:
+                task.cancel()
             self.current_websocket = None
             await websocket.close()
             logger.info("WebSocket connection closed")
@@ -5,8 +5,14 @@ from common.util import get_cpu_serial, generate_identifier
 from worker.network_manager import WorkerNetworkController
 from common.model import WorkerIdAssignmentRequest, WorkerNetworkModeRequest, ConnectionType
 from worker.websocket_server import WorkerWebSocketServer
+from worker.data_server import WorkerDataServer
+from worker.capability import capability_fingerprint, run_capability_benchmark
+from worker.inference.model_registry import ModelRegistry
+from worker.inference.metrics import inference_metrics
+import asyncio
 import time
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, WebSocket, HTTPException
+from fastapi.responses import FileResponse, JSONResponse
 import uvicorn
 import requests
 import threading
@@ -31,26 +37,102 @@ class Worker:
         self.stop_heartbeat = threading.Event()
         self.initialized = False
 
+        # Engines are loaded lazily on the first request for each model
+        self.model_registry = ModelRegistry.from_config(config)
+
         self.app = FastAPI()
+        self.app.add_event_handler("shutdown", self.close)
         self.ws_server = WorkerWebSocketServer(config)
         self._setup_fastapi_routes()
 
+        # Data plane: inference requests on data_port, over whichever interface is the current data plane
+        self.data_server = WorkerDataServer(self.model_registry, num_threads=config['worker']['data_threads'],
+                                            max_inflight=config['worker']['data_max_inflight'],
+                                            connection=self._current_data_plane)
+
+    def close(self):
+        """Stop the data plane executor first so no inference is still running, then unload the engines (which
+        flush background work, e.g. annotated image writes)."""
+        self.data_server.close()
+        self.model_registry.close()
+
+    def _current_data_plane(self) -> ConnectionType:
+        return self.network_controller.current_mode if self.network_controller else ConnectionType.INVALID
+
     def _setup_fastapi_routes(self):
         # WebSocket endpoint for real-time controller -> worker communication
         @self.app.websocket("/worker_ws")
         async def worker_handle_websocket(websocket: WebSocket):
             await self.ws_server.handle_connection(websocket)
         
+        # Handlers run blocking network changes off the event loop so other commands / calls keep flowing
+        # The return value is the reply to RPC calls (WorkersWebSocketManager.call)
         async def handle_switch_to_ethernet(data: dict[str, any]):
             logger.info("Received command to switch to Ethernet connection")
-            self.network_controller.switch_to_ethernet()
+            await asyncio.to_thread(self.network_controller.switch_to_ethernet)
+            return {"data_plane": self.network_controller.current_mode.value}
         
         async def handle_switch_to_wifi(data: dict[str, any]):
             logger.info("Received command to switch to WiFi connection")
-            self.network_controller.switch_to_wifi(ssid=data.get('ssid'), password=data.get('password'))
+            await asyncio.to_thread(self.network_controller.switch_to_wifi, ssid=data.get('ssid'), password=data.get('password'))
+            return {"data_plane": self.network_controller.current_mode.value}
+
+        async def handle_ping(data: dict[str, any]):
+            return {"time": time.time(), "data_plane": self._current_data_plane().value}
+
+        # Onboarding benchmark requested by the controller (controller/capability_manager.py)
+        async def handle_benchmark(data: dict[str, any]):
+            logger.info(f"Running capability benchmark: {data}")
+            # Not alongside data plane requests, they would skew each other
+            return await asyncio.to_thread(run_capability_benchmark, self.model_registry,
+                                           data.get('batch_sizes', [1]), models=data.get('models'),
+                                           warmup=data.get('warmup', 1), iterations=data.get('iterations', 3),
+                                           serialize=self.data_server.exclusive)
         
         self.ws_server.register_handler('switch_to_ethernet', handle_switch_to_ethernet)
         self.ws_server.register_handler('switch_to_wifi', handle_switch_to_wifi)
+        self.ws_server.register_handler('ping', handle_ping)
+        self.ws_server.register_handler('benchmark', handle_benchmark)
+
+        # Per-stage latency histograms {model: {mode: {stage: summary}}} and model registry stats
+        @self.app.get("/api/metrics")
+        async def get_metrics():
+            return {"stages": inference_metrics.snapshot(), "registry": self.model_registry.stats(),
+                    "data_plane": self.data_server.stats()}
+
+        # Route the next requests of a model through onnxruntime's profiler for a bounded window
+        # Plain def handlers run on the threadpool: loading a model / building the profiling session would
+        # otherwise block the event loop serving the controller WebSocket
+        @self.app.post("/api/profile/{model}")
+        def start_profiling(model: str, max_requests: int = 20, max_seconds: float = 30.0):
+            engine = self._get_profilable_engine(model)
+            try:
+                engine.start_profiling(max_requests=max_requests, max_seconds=max_seconds)
+            except RuntimeError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            return {"model": model, "status": "profiling", "max_requests": max_requests, "max_seconds": max_seconds}
+
+        # Returns the trace file once the window is over, 202 while it is still open
+        @self.app.get("/api/profile/{model}")
+        def get_profile(model: str):
+            engine = self._get_profilable_engine(model, load=False)
+            if engine.profiling_active():
+                return JSONResponse(status_code=202, content={"model": model, "status": "profiling"})
+            if not engine.last_profile_path or not os.path.exists(engine.last_profile_path):
+                raise HTTPException(status_code=404, detail=f"No profile trace available for model '{model}'")
+            return FileResponse(engine.last_profile_path, media_type="application/json",
+                                filename=os.path.basename(engine.last_profile_path))
+
+    def _get_profilable_engine(self, model: str, load: bool = True):
+        try:
+            engine = self.model_registry.get_engine(model) if load else self.model_registry.resident_engine(model)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        if engine is None:
+            raise HTTPException(status_code=404, detail=f"Model '{model}' is not loaded")
+        if not hasattr(engine, "start_profiling"):
+            raise HTTPException(status_code=400, detail=f"Engine for model '{model}' does not support ORT profiling")
+        return engine
 
     def start_api_server(self):
         def run():
@@ -58,6 +140,12 @@ class Worker:
         api_thread = threading.Thread(target=run, daemon=True)
         logger.info("Starting FastAPI server for worker control API...")
         api_thread.start()
+
+        def run_data():
+            uvicorn.run(self.data_server.app, host="0.0.0.0", port=self.config['worker']['data_port'], log_level="info")
+        data_thread = threading.Thread(target=run_data, daemon=True)
+        logger.info("Starting data plane inference server...")
+        data_thread.start()
     
     def intitialize(self):
         if self.initialized:
@@ -100,7 +188,8 @@ class Worker:
             while not self.stop_heartbeat.is_set():
                 try:
                     logger.info(f"Sending heartbeat to controller {time.time()}")
-                    success = self.network_controller._send_control_heartbeat(self.hardware_serial, self.hardware_identifier)
+                    success = self.network_controller._send_control_heartbeat(self.hardware_serial, self.hardware_identifier,
+                                                                              capability_fingerprint(self.model_registry))
                     if not success:
                         logger.warning("Controller did not acknowledge heartbeat")
                         count += 1
@@ -121,7 +210,8 @@ class Worker:
         logger.info(f"Control heartbeat loop started with interval {interval} seconds.")
 
     def _send_control_heartbeat(self):
-        self.network_controller._send_control_heartbeat(self.hardware_serial, self.hardware_identifier)
+        self.network_controller._send_control_heartbeat(self.hardware_serial, self.hardware_identifier,
+                                                        capability_fingerprint(self.model_registry))
 
     def _is_ip_conflict(self, ip_address: str) -> bool:
         import subprocess
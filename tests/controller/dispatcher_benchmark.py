@@ -0,0 +1,96 @@
+"""
+Dispatcher scaling benchmark (controller/inference_dispatcher.py) on local workers.
+Starts worker data servers (worker/data_server.py) on localhost ports, backed by a synthetic engine that
+takes 1 / speed seconds per item without using the CPU, so a single machine can stand in for a cluster of
+uneven workers. Reports cluster throughput as workers are added and how the jobs were spread.
+    python tests/controller/dispatcher_benchmark.py --speeds 10,10,10,10 --jobs 200 --batch-size 2
+    python tests/controller/dispatcher_benchmark.py --speeds 20,10,5 --jobs 150
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+import numpy as np
+import uvicorn
+
+from common.model import InferenceRequest
+from controller.inference_dispatcher import InferenceDispatcher
+from worker.data_server import WorkerDataServer
+from worker.inference.inference_engine import InferenceModelEngine
+from worker.inference.model_registry import ModelRegistry, ModelSpec
+
+BASE_PORT = 18100
+
+
+class SleepEngine(InferenceModelEngine):
+    def __init__(self, model_path, adapter_path=None, engine_config=None, speed: float = 10.0):
+        self.speed = speed
+
+    def infer_tensors(self, input_data):
+        return {"out": np.zeros(1, dtype=np.float32)}
+
+    def handle_request(self, req: InferenceRequest):
+        if req.mode == "raw":
+            if any(item.data == "fail" for item in req.items):
+                raise ValueError("Synthetic item failure")
+            # Echo the items so callers can check the order results come back in
+            time.sleep(len(req.items) / self.speed)
+            offset = int((req.meta or {}).get("index_offset", 0))
+            return {"items": [item.data if item.type == "text" else len(item.data) for item in req.items],
+                    "index": [offset + i for i in range(len(req.items))]}
+        time.sleep((req.dummy_batch_size or 1) / self.speed)
+        return {"out": np.zeros(1, dtype=np.float32)}
+
+
+def start_worker(port: int, speed: float) -> uvicorn.Server:
+    registry = ModelRegistry({"sleep": ModelSpec(name="sleep", model_path=__file__)},
+                             engine_factory=lambda m, a, c: SleepEngine(m, a, c, speed=speed))
+    server = uvicorn.Server(uvicorn.Config(WorkerDataServer(registry).app, host="127.0.0.1", port=port,
+                                           log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run_jobs(dispatcher: InferenceDispatcher, jobs: int, batch_size: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            resp = await dispatcher.submit(InferenceRequest(model="sleep", mode="dummy", dummy_batch_size=batch_size,
+                                                            run_postprocess=False))
+            if resp["error"]:
+                raise RuntimeError(resp["error"])
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(jobs)))
+    return time.perf_counter() - t0
+
+
+async def main(speeds: list[float], jobs: int, batch_size: int):
+    servers = [start_worker(BASE_PORT + i, speed) for i, speed in enumerate(speeds)]
+    for n in range(1, len(speeds) + 1):
+        dispatcher = InferenceDispatcher(BASE_PORT, max_inflight=2)
+        for i in range(n):
+            await dispatcher.add_worker(i, "127.0.0.1", BASE_PORT + i)
+        elapsed = await run_jobs(dispatcher, jobs, batch_size, concurrency=4 * n)
+        items_per_s = jobs * batch_size / elapsed
+        ideal = sum(speeds[:n])
+        stats = dispatcher.stats()["workers"]
+        spread = " ".join(f"w{i}:{stats[i]['completed']}" for i in range(n))
+        print(f"workers={n} {items_per_s:7.2f} items/s (ideal {ideal:7.2f}, efficiency {items_per_s / ideal:5.1%}) "
+              f"jobs {spread}")
+        await dispatcher.close()
+    for server in servers:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure dispatcher throughput scaling over local synthetic workers")
+    parser.add_argument("--speeds", default="10,10,10,10", help="Items/s of each synthetic worker")
+    parser.add_argument("--jobs", type=int, default=120)
+    parser.add_argument("--batch-size", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main([float(s) for s in args.speeds.split(",")], args.jobs, args.batch_size))
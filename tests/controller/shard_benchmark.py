@@ -0,0 +1,88 @@
+"""
+Sharded job benchmark (controller/shard_scheduler.py) on local synthetic workers of uneven speed.
+One raw request with many items runs as a naive equal split, a proportional split and a proportional split
+with work stealing. Also runs with deliberately wrong planning rates, where stealing has to make up for it.
+Results must come back in the original item order every time, with item indexes (meta index_offset, used
+e.g. for saved image paths) continuing across chunks. The equal split is measured, not estimated, the
+estimates from the planning rates are printed next to it. Finally checks that a chunk timing out on the slowest
+worker is handed over and that a failing item is retried once elsewhere, then reported in chunk_errors.
+    python tests/controller/shard_benchmark.py --speeds 20,10,5 --items 210
+"""
+import argparse
+import asyncio
+
+from common.model import InferenceRequest, RawItem
+from controller.inference_dispatcher import InferenceDispatcher
+from controller.shard_scheduler import ShardedJobRunner
+from dispatcher_benchmark import BASE_PORT, start_worker
+
+
+async def main(speeds: list[float], num_items: int):
+    servers = [start_worker(BASE_PORT + i, speed) for i, speed in enumerate(speeds)]
+    dispatcher = InferenceDispatcher(BASE_PORT, max_inflight=2)
+    for i in range(len(speeds)):
+        await dispatcher.add_worker(i, "127.0.0.1", BASE_PORT + i)
+    runner = ShardedJobRunner(dispatcher)
+    labels = [f"img-{i}" for i in range(num_items)]
+    req = InferenceRequest(model="sleep", mode="raw", items=[RawItem(type="text", data=label) for label in labels])
+
+    # Warm up so the dispatcher has measured every worker's images/s
+    await runner.run(InferenceRequest(model="sleep", mode="raw", items=req.items[:len(speeds) * 8]), strategy="equal")
+    measured = dispatcher.available_workers()
+    print("measured images/s: " + ", ".join(f"w{w}={r:.1f}" for w, r in measured.items()))
+
+    wrong = {wid: 1.0 for wid in measured}
+    wrong[len(speeds) - 1] = 10.0
+    cases = [
+        ("equal split", dict(strategy="equal", steal=False)),
+        ("proportional", dict(strategy="proportional", steal=False)),
+        ("proportional+steal", dict(strategy="proportional", steal=True)),
+        ("wrong rates", dict(strategy="proportional", steal=False, rates=wrong)),
+        ("wrong rates+steal", dict(strategy="proportional", steal=True, rates=wrong)),
+    ]
+    baseline = None
+    for name, kwargs in cases:
+        merged, report = await runner.run(req, **kwargs)
+        if merged["result"]["items"] != labels:
+            raise AssertionError(f"{name}: results are not in the original item order")
+        if merged["result"]["index"] != list(range(num_items)):
+            raise AssertionError(f"{name}: chunks did not get their item index offset (meta index_offset)")
+        baseline = baseline or report["makespan_s"]
+        per_worker = " ".join(f"w{w}:{s['items']}({s['stolen']} stolen)" for w, s in report["workers"].items())
+        print(f"{name:<19} makespan={report['makespan_s']:6.2f}s vs measured equal split {baseline:6.2f}s "
+              f"({baseline / report['makespan_s']:4.2f}x) estimates: equal={report['equal_split_estimate_s']:5.2f}s "
+              f"proportional={report['proportional_estimate_s']:5.2f}s  {per_worker}")
+
+    # A chunk on the slowest worker takes longer than the timeout, it is handed over and the job still completes
+    # (one chunk in flight per worker, so the timeout is what one chunk takes, between the two slowest workers)
+    slowest, second = sorted(measured, key=measured.get)[:2]
+    timeout = report["chunk_size"] * (1 / speeds[slowest] + 1 / speeds[second]) / 2
+    timeout_runner = ShardedJobRunner(dispatcher, depth=1, timeout=timeout)
+    merged, report = await timeout_runner.run(req, strategy="equal", steal=False)
+    if merged["result"]["items"] != labels or report["workers"][slowest]["alive"]:
+        raise AssertionError("timeout: chunks of the timed out worker were not handed over")
+    print(f"{f'timeout on w{slowest}':<19} makespan={report['makespan_s']:6.2f}s, results complete")
+    dispatcher.workers[slowest].down_until = 0.0
+
+    # One bad item: its chunk is retried once on another worker, then reported, the other chunks still run
+    failing = InferenceRequest(model="sleep", mode="raw",
+                               items=[RawItem(type="text", data="fail" if i == num_items // 2 else label)
+                                      for i, label in enumerate(labels)])
+    merged, report = await runner.run(failing)
+    errors = report["chunk_errors"]
+    done = sum(w["items"] for w in report["workers"].values())
+    if len(errors) != 1 or merged["error"] is None or merged["result"] is not None:
+        raise AssertionError(f"failing item: expected one failed chunk, got {errors}")
+    print(f"{'failing item':<19} {merged['error']}; {done} of {num_items} items done")
+
+    await dispatcher.close()
+    for server in servers:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare equal, proportional and work-stealing shard splits")
+    parser.add_argument("--speeds", default="20,10,5", help="Images/s of each synthetic worker")
+    parser.add_argument("--items", type=int, default=210)
+    args = parser.parse_args()
+    asyncio.run(main([float(s) for s in args.speeds.split(",")], args.items))
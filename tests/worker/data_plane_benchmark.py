@@ -0,0 +1,82 @@
+"""
+Load generator for a worker's data plane (worker/data_server.py): keeps `--inflight` requests outstanding on
+one /data_ws connection and reports end-to-end latency, requests/s and wire throughput.
+Run against a worker started with worker.sh, over the Ethernet or WiFi data plane address:
+    python tests/worker/data_plane_benchmark.py --url ws://192.168.10.2:8002/data_ws --mode raw --batch-size 4
+    python tests/worker/data_plane_benchmark.py --url ws://192.168.20.2:8002/data_ws --mode dummy --output-encoding auto
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import websockets
+
+from common.model import InferenceRequest, RawItem
+from common.wire import decode_response, encode_request
+from worker.inference.benchmark import collect_raw_items
+
+INPUTS_DIR = "src/worker/inference/models/yolov4/inputs"
+
+
+def make_request(args) -> InferenceRequest:
+    meta = {"output_encoding": args.output_encoding} if args.output_encoding else None
+    if args.mode == "dummy":
+        return InferenceRequest(model=args.model, mode="dummy", dummy_batch_size=args.batch_size,
+                                run_postprocess=False, meta=meta)
+    raw_items = collect_raw_items(INPUTS_DIR)
+    # Send the image bytes rather than paths, the worker does not share our file system
+    items = []
+    for i in range(args.batch_size):
+        item = raw_items[i % len(raw_items)]
+        with open(item.data, "rb") as f:
+            items.append(RawItem(type="image_bytes", data=f.read(), mime="image/jpeg"))
+    return InferenceRequest(model=args.model, mode="raw", items=items, meta=meta)
+
+
+async def run(args):
+    req = make_request(args)
+    frames = [encode_request(req, f"bench-{i}") for i in range(args.requests)]
+    sent_at: dict[str, float] = {}
+    latencies = []
+    bytes_in = 0
+    async with websockets.connect(args.url, max_size=None) as ws:
+        t0 = time.perf_counter()
+        next_frame = 0
+        while next_frame < min(args.inflight, len(frames)):
+            sent_at[f"bench-{next_frame}"] = time.perf_counter()
+            await ws.send(frames[next_frame])
+            next_frame += 1
+        while len(latencies) < len(frames):
+            reply = await ws.recv()
+            bytes_in += len(reply)
+            resp = decode_response(reply)
+            if resp["error"]:
+                raise RuntimeError(f"Request {resp['request_id']} failed: {resp['error']}")
+            latencies.append(time.perf_counter() - sent_at.pop(resp["request_id"]))
+            if next_frame < len(frames):
+                sent_at[f"bench-{next_frame}"] = time.perf_counter()
+                await ws.send(frames[next_frame])
+                next_frame += 1
+        elapsed = time.perf_counter() - t0
+
+    lat_ms = np.asarray(latencies) * 1000
+    bytes_out = sum(len(f) for f in frames)
+    print(f"{args.requests} requests x batch {args.batch_size} ({args.mode}), inflight={args.inflight}: "
+          f"{args.requests / elapsed:.2f} req/s, {args.requests * args.batch_size / elapsed:.2f} images/s")
+    print(f"latency mean={lat_ms.mean():.1f}ms p50={np.percentile(lat_ms, 50):.1f}ms p90={np.percentile(lat_ms, 90):.1f}ms "
+          f"max={lat_ms.max():.1f}ms")
+    print(f"sent {bytes_out / 1e6:.2f}MB ({bytes_out / elapsed / 1e6:.2f}MB/s), "
+          f"received {bytes_in / 1e6:.2f}MB ({bytes_in / elapsed / 1e6:.2f}MB/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive a worker's data plane inference endpoint")
+    parser.add_argument("--url", default="ws://127.0.0.1:8002/data_ws")
+    parser.add_argument("--model", default="yolov4")
+    parser.add_argument("--mode", choices=("dummy", "raw"), default="dummy")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--inflight", type=int, default=2)
+    parser.add_argument("--output-encoding", default=None, help='e.g. "float16", "uint8+zlib" or "auto"')
+    asyncio.run(run(parser.parse_args()))
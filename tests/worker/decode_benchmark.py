@@ -0,0 +1,101 @@
+"""
+YOLOv4 decode benchmark, full-resolution decode vs the adapter's reduced JPEG decoding (IMREAD_REDUCED_*)
+on a mixed-resolution set of synthetic JPEGs (VGA up to 4K / 12MP).
+Reports decode time, peak traced memory and how far the letterboxed tensor and mapped-back boxes drift.
+    python tests/worker/decode_benchmark.py --repeat 5
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from common.model import RawItem
+from common.util import load_adapter
+
+ADAPTER_PATH = "src/worker/inference/models/yolov4/yolov4_adapter.py"
+RESOLUTIONS = [(480, 640), (720, 1280), (1080, 1920), (2160, 3840), (3000, 4000)]
+
+
+def make_images(out_dir: str, seed: int = 0) -> list[RawItem]:
+    """Smooth gradients + shapes, so JPEG sizes are realistic rather than noise-sized."""
+    rng = np.random.default_rng(seed)
+    items = []
+    for h, w in RESOLUTIONS:
+        ys, xs = np.mgrid[0:h, 0:w].astype(np.float32)
+        img = np.stack([xs / w * 255, ys / h * 255, (xs + ys) / (w + h) * 255], axis=-1).astype(np.uint8)
+        for _ in range(20):
+            x, y = int(rng.integers(0, w)), int(rng.integers(0, h))
+            r = int(rng.integers(h // 40 + 1, h // 6 + 2))
+            cv2.circle(img, (x, y), r, tuple(int(c) for c in rng.integers(0, 256, 3)), -1)
+        path = os.path.join(out_dir, f"{w}x{h}.jpg")
+        cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        items.append(RawItem(type="image_path", data=path))
+    return items
+
+
+def _measure(fn, repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run(repeat: int):
+    adapter = load_adapter(ADAPTER_PATH)
+    with tempfile.TemporaryDirectory() as tmp:
+        items = make_images(tmp)
+        for item in items:
+            t_full, mem_full = _measure(lambda: adapter._load_rgb(item), repeat)
+            t_red, mem_red = _measure(lambda: adapter._decode_reduced(item), repeat)
+            full = adapter._load_rgb(item)
+            reduced, org_shape = adapter._decode_reduced(item)
+            if tuple(org_shape) != full.shape[:2]:
+                raise AssertionError(f"Original shape {org_shape} differs from the full decode {full.shape[:2]}")
+
+            # Same letterbox on both frames, the network input should barely move
+            x_full = adapter._image_preprocess(full)
+            x_red = adapter._image_preprocess(reduced)
+            h, w = org_shape
+            print(f"{w}x{h:<5} decoded={reduced.shape[1]}x{reduced.shape[0]:<5} "
+                  f"full={t_full * 1000:7.2f}ms/{mem_full / 2 ** 20:6.1f}MiB "
+                  f"reduced={t_red * 1000:7.2f}ms/{mem_red / 2 ** 20:6.1f}MiB "
+                  f"speedup={t_full / t_red:5.2f}x input_mean_abs_diff={np.abs(x_full - x_red).mean():.4f}")
+
+        # Boxes are mapped back with the original shape either way, so the batch context must match the one
+        # of the full-resolution frames
+        expected = np.array([adapter._load_rgb(item).shape[:2] for item in items], dtype=np.int64)
+        for name, meta in (("full", {"reduced_decode": False}), ("reduced", {})):
+            adapter.preprocess(items, meta)
+            if not np.array_equal(meta["context"].org_shapes, expected) or \
+                    not np.array_equal(meta["context"].letterbox, adapter._letterbox_params(expected)):
+                raise AssertionError(f"{name} decoding changed the box mapping context")
+        print("box mapping context of full and reduced decoding identical to the full-resolution frames")
+
+        # Images PIL considers decompression bombs fall back to the full decode instead of failing preprocess
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 1000
+        try:
+            rgb, org_shape = adapter._decode_reduced(items[-1])
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+        if rgb.shape[:2] != tuple(expected[-1]) or tuple(org_shape) != tuple(expected[-1]):
+            raise AssertionError("Decompression bomb guard did not fall back to the full decode")
+        print("decompression bomb guard falls back to the full decode")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare full and reduced-resolution JPEG decoding for YOLOv4")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.repeat)
@@ -0,0 +1,139 @@
+"""
+YOLOv4 NMS micro-benchmark, compares the adapter's vectorized NMS with the original per-class loop
+on synthetic dense detections (many overlapping low-score candidates across a few classes).
+"nms" output with the adapter's default settings must hold the same rows (row order differs: by descending score),
+soft-nms is reported as matching or not (ties may pick in another order). An optional top-k cap (meta "nms_top_k")
+is timed separately, with the number of detections it changes.
+    python tests/worker/nms_benchmark.py --candidates 500,2000,5000 --classes 10 --repeat 5 --top-k 1000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from common.util import load_adapter
+
+ADAPTER_PATH = "src/worker/inference/models/yolov4/yolov4_adapter.py"
+
+
+# --- Reference implementation (pre-vectorization adapter code)
+def legacy_bboxes_iou(boxes1, boxes2):
+    boxes1 = np.array(boxes1)
+    boxes2 = np.array(boxes2)
+
+    boxes1_area = (boxes1[..., 2] - boxes1[..., 0]) * (boxes1[..., 3] - boxes1[..., 1])
+    boxes2_area = (boxes2[..., 2] - boxes2[..., 0]) * (boxes2[..., 3] - boxes2[..., 1])
+
+    left_up = np.maximum(boxes1[..., :2], boxes2[..., :2])
+    right_down = np.minimum(boxes1[..., 2:], boxes2[..., 2:])
+
+    inter_section = np.maximum(right_down - left_up, 0.0)
+    inter_area = inter_section[..., 0] * inter_section[..., 1]
+    union_area = boxes1_area + boxes2_area - inter_area
+    ious = np.maximum(1.0 * inter_area / union_area, np.finfo(np.float32).eps)
+    return ious
+
+
+def legacy_nms(bboxes, iou_threshold, sigma=0.3, method="nms"):
+    classes_in_img = list(set(bboxes[:, 5]))
+    best_bboxes = []
+
+    for cls in classes_in_img:
+        cls_mask = (bboxes[:, 5] == cls)
+        cls_bboxes = bboxes[cls_mask]
+
+        while len(cls_bboxes) > 0:
+            max_ind = np.argmax(cls_bboxes[:, 4])
+            best_bbox = cls_bboxes[max_ind]
+            best_bboxes.append(best_bbox)
+            cls_bboxes = np.concatenate([cls_bboxes[:max_ind], cls_bboxes[max_ind + 1:]])
+            iou = legacy_bboxes_iou(best_bbox[np.newaxis, :4], cls_bboxes[:, :4])
+            weight = np.ones((len(iou),), dtype=np.float32)
+
+            if method == "nms":
+                iou_mask = iou > iou_threshold
+                weight[iou_mask] = 0.0
+            elif method == "soft-nms":
+                weight = np.exp(-(1.0 * iou ** 2 / sigma))
+            else:
+                raise ValueError("method must be 'nms' or 'soft-nms'")
+
+            cls_bboxes[:, 4] = cls_bboxes[:, 4] * weight
+            score_mask = cls_bboxes[:, 4] > 0.0
+            cls_bboxes = cls_bboxes[score_mask]
+
+    return best_bboxes
+
+
+# --- Synthetic data
+def dense_detections(n: int, num_classes: int, image_size: int = 416, seed: int = 0) -> np.ndarray:
+    """Clusters of jittered boxes around a few objects, like a low score threshold produces."""
+    rng = np.random.default_rng(seed)
+    num_objects = max(1, n // 50)
+    centers = rng.uniform(0, image_size, size=(num_objects, 2))
+    sizes = rng.uniform(20, 150, size=(num_objects, 2))
+    obj = rng.integers(0, num_objects, size=n)
+    c = centers[obj] + rng.normal(0, 6, size=(n, 2))
+    wh = sizes[obj] * rng.uniform(0.8, 1.2, size=(n, 2))
+    boxes = np.concatenate([c - wh / 2, c + wh / 2], axis=-1).clip(0, image_size - 1)
+    scores = rng.uniform(0.25, 1.0, size=(n, 1))
+    classes = ((obj + rng.integers(0, 2, size=n)) % num_classes)[:, None]
+    dets = np.concatenate([boxes, scores, classes], axis=-1).astype(np.float32)
+    # Clipping can collapse boxes at the border, decode never emits zero-area boxes
+    return dets[(dets[:, 2] > dets[:, 0]) & (dets[:, 3] > dets[:, 1])]
+
+
+def _sorted_rows(bboxes) -> np.ndarray:
+    arr = np.asarray(bboxes, dtype=np.float32).reshape(-1, 6)
+    return arr[np.lexsort(arr.T[::-1])]
+
+
+def _best_time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _row_diff(ref, new) -> int:
+    """Rows in one output but not the other."""
+    a = {tuple(np.round(r, 4)) for r in _sorted_rows(ref)}
+    b = {tuple(np.round(r, 4)) for r in _sorted_rows(new)}
+    return len(a ^ b)
+
+
+def run(candidates: list[int], num_classes: int, iou_threshold: float, repeat: int, top_k: int):
+    adapter = load_adapter(ADAPTER_PATH)
+    for n in candidates:
+        dets = dense_detections(n, num_classes)
+        for method in ("nms", "soft-nms"):
+            ref = legacy_nms(dets.copy(), iou_threshold, method=method)
+            # Shipped default (no top_k argument in postprocess means adapter.nms_top_k)
+            new = adapter._nms(dets.copy(), iou_threshold, method=method, top_k=adapter.nms_top_k)
+            same = len(ref) == len(new) and np.allclose(_sorted_rows(ref), _sorted_rows(new), rtol=0, atol=1e-6)
+            if method == "nms" and not same:
+                raise AssertionError(f"Vectorized NMS differs from the reference for n={n}: {len(ref)} vs {len(new)} boxes")
+            if np.any(np.diff(new[:, 4]) > 0):
+                raise AssertionError(f"{method} output for n={n} is not in descending score order")
+
+            t_ref = _best_time(lambda: legacy_nms(dets.copy(), iou_threshold, method=method), repeat)
+            t_new = _best_time(lambda: adapter._nms(dets, iou_threshold, method=method, top_k=adapter.nms_top_k), repeat)
+            t_topk = _best_time(lambda: adapter._nms(dets, iou_threshold, method=method, top_k=top_k), repeat)
+            changed = _row_diff(ref, adapter._nms(dets.copy(), iou_threshold, method=method, top_k=top_k))
+            print(f"n={n:<6} {method:<8} kept={len(new):<5} match={same!s:<5} "
+                  f"legacy={t_ref * 1000:8.2f}ms vectorized={t_new * 1000:8.2f}ms speedup={t_ref / t_new:6.1f}x "
+                  f"top_k={top_k}:{t_topk * 1000:8.2f}ms ({changed} rows changed)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the vectorized YOLOv4 NMS with the original loop")
+    parser.add_argument("--candidates", default="200,1000,3000", help="Comma separated candidate counts")
+    parser.add_argument("--classes", type=int, default=10)
+    parser.add_argument("--iou-threshold", type=float, default=0.213)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top-k", type=int, default=1000, help="Candidate cap to time against the default")
+    args = parser.parse_args()
+    run([int(v) for v in args.candidates.split(",") if v.strip()], args.classes, args.iou_threshold, args.repeat,
+        args.top_k)
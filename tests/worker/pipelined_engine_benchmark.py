@@ -0,0 +1,97 @@
+"""
+Pipelined engine benchmark (worker/inference/engines/pipelined_engine.py), sequential OnnxEngine.handle_request
+vs the three-stage pipeline on the same dummy requests. Raw outputs must be identical and in submission order.
+Also cancels requests while they are queued and while they are postprocessed, the pipeline must keep serving.
+Make sure the model is under src/worker/inference/models/yolov4
+    python tests/worker/pipelined_engine_benchmark.py --requests 32 --batch-size 1
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from common.model import InferenceRequest
+from worker.inference.engines.onnx_engine import OnnxEngine
+from worker.inference.engines.pipelined_engine import PipelinedEngine
+
+MODEL_PATH = "src/worker/inference/models/yolov4/yolov4.onnx"
+ADAPTER_PATH = "src/worker/inference/models/yolov4/yolov4_adapter.py"
+
+
+def _request(seed: int, batch_size: int) -> InferenceRequest:
+    return InferenceRequest(model="yolov4", mode="dummy", dummy_batch_size=batch_size, dummy_seed=seed,
+                            run_postprocess=False)
+
+
+async def check_cancellation(pipelined: PipelinedEngine, batch_size: int):
+    # Cancelled while still queued behind busy requests: skipped
+    busy = [pipelined.submit(_request(i, batch_size * 4)) for i in range(2)]
+    queued = [pipelined.submit(_request(50 + i, batch_size)) for i in range(2)]
+    for future in queued:
+        future.cancel()
+    for future in busy:
+        future.result(timeout=60)
+
+    # Cancelled while it is being postprocessed (held there until the awaiting task is cancelled): its result must
+    # not take the stage thread down
+    engine = pipelined.engine
+    finalize = engine.finalize_outputs
+    entered, release = threading.Event(), threading.Event()
+
+    def held_finalize(*args):
+        entered.set()
+        release.wait()
+        return finalize(*args)
+
+    engine.finalize_outputs = held_finalize
+    task = asyncio.create_task(pipelined.handle_request_async(_request(100, batch_size)))
+    await asyncio.to_thread(entered.wait)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    del engine.finalize_outputs
+    release.set()
+
+    # Every stage thread must still be alive and serving
+    result = await asyncio.wait_for(pipelined.handle_request_async(_request(200, batch_size)), 60)
+    if not result or not all(t.is_alive() for t in pipelined._threads):
+        raise AssertionError("pipeline stopped serving after cancelled requests")
+    print(f"cancellation: {len(queued)} queued and 1 postprocessing request cancelled, pipeline still serving")
+
+
+def run(model_path: str, num_requests: int, batch_size: int, queue_size: int):
+    engine = OnnxEngine(model_path, ADAPTER_PATH)
+    pipelined = PipelinedEngine(model_path, queue_size=queue_size, engine=engine)
+    requests = [_request(i, batch_size) for i in range(num_requests)]
+    engine.handle_request(requests[0])  # warm up
+
+    t0 = time.perf_counter()
+    sequential = [engine.handle_request(req) for req in requests]
+    t_seq = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    futures = [pipelined.submit(req) for req in requests]
+    piped = [f.result() for f in futures]
+    t_pipe = time.perf_counter() - t0
+
+    for i, (a, b) in enumerate(zip(sequential, piped)):
+        if a.keys() != b.keys() or not all(np.array_equal(a[k], b[k]) for k in a):
+            raise AssertionError(f"request {i}: pipelined outputs differ from sequential ones")
+    images = num_requests * batch_size
+    print(f"requests={num_requests} batch={batch_size} sequential={images / t_seq:7.2f} images/s "
+          f"pipelined={images / t_pipe:7.2f} images/s speedup={t_seq / t_pipe:5.2f}x")
+
+    asyncio.run(check_cancellation(pipelined, batch_size))
+    pipelined.close()
+    engine.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare sequential and pipelined engine throughput")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=2)
+    args = parser.parse_args()
+    run(args.model, args.requests, args.batch_size, args.queue_size)
@@ -0,0 +1,75 @@
+"""
+YOLOv4 postprocess benchmark, box decoding of every anchor vs the objectness pre-filter
+(decode only anchors whose objectness passes the score threshold), on dummy and real inputs.
+Detections after NMS must be identical in both modes.
+Make sure the model is under src/worker/inference/models/yolov4
+    python tests/worker/postprocess_benchmark.py --batch-size 4 --repeat 10
+"""
+import argparse
+import time
+
+import numpy as np
+
+from worker.inference.benchmark import collect_raw_items
+from worker.inference.engines.onnx_engine import OnnxEngine
+
+MODEL_PATH = "src/worker/inference/models/yolov4/yolov4.onnx"
+ADAPTER_PATH = "src/worker/inference/models/yolov4/yolov4_adapter.py"
+INPUTS_DIR = "src/worker/inference/models/yolov4/inputs"
+OUTPUT_NAMES = ['Identity:0', 'Identity_1:0', 'Identity_2:0']
+
+
+def _best_time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def compare(engine: OnnxEngine, label: str, feed: dict[str, np.ndarray], org_shapes: np.ndarray, repeat: int):
+    adapter = engine.adapter
+    outputs = engine.infer_tensors(feed)
+    detections = [outputs[name] for name in OUTPUT_NAMES]
+    letterbox = adapter._letterbox_params(org_shapes)
+    th = adapter.score_threshold
+
+    full = adapter._decode_batch(detections, org_shapes, letterbox, th, prefilter=False)
+    filtered = adapter._decode_batch(detections, org_shapes, letterbox, th, prefilter=True)
+    for a, b in zip(full, filtered):
+        if not np.array_equal(a, b):
+            raise AssertionError(f"{label}: pre-filtered candidates differ ({len(a)} vs {len(b)})")
+        if not np.array_equal(adapter._nms(a, adapter.iou_threshold), adapter._nms(b, adapter.iou_threshold)):
+            raise AssertionError(f"{label}: detections after NMS differ")
+
+    anchors = sum(int(np.prod(d.shape[:-1])) for d in detections)
+    survivors = sum(int((d[..., 4] > th).sum()) for d in detections)
+    t_full = _best_time(lambda: adapter._decode_batch(detections, org_shapes, letterbox, th, prefilter=False), repeat)
+    t_pre = _best_time(lambda: adapter._decode_batch(detections, org_shapes, letterbox, th, prefilter=True), repeat)
+    print(f"{label:<6} anchors={anchors:<7} objectness>{th}: {survivors:<6} candidates={sum(len(c) for c in full):<6} "
+          f"full={t_full * 1000:7.2f}ms prefilter={t_pre * 1000:7.2f}ms speedup={t_full / t_pre:5.2f}x")
+
+
+def run(model_path: str, batch_size: int, repeat: int):
+    engine = OnnxEngine(model_path, ADAPTER_PATH)
+    adapter = engine.adapter
+    size = adapter.input_size
+
+    dummy = adapter.generate_dummy_inputs(batch_size=batch_size)
+    compare(engine, "dummy", dummy, np.full((batch_size, 2), size, dtype=np.int64), repeat)
+
+    raw_items = collect_raw_items(INPUTS_DIR)
+    items = [raw_items[i % len(raw_items)] for i in range(batch_size)]
+    meta: dict = {}
+    feed = adapter.preprocess(items, meta)
+    compare(engine, "raw", feed, meta["context"].org_shapes, repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare YOLOv4 box decoding with and without the objectness pre-filter")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    run(args.model, args.batch_size, args.repeat)
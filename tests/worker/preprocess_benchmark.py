@@ -0,0 +1,83 @@
+"""
+YOLOv4 preprocess benchmark, compares the original decode -> letterbox -> np.stack path with the adapter's
+preallocated batch tensor, sequential and on the thread pool. Outputs of all paths must be identical.
+    python tests/worker/preprocess_benchmark.py --batch-sizes 1,2,4,8,16,32 --workers 4
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from common.util import load_adapter
+from worker.inference.benchmark import collect_raw_items
+
+ADAPTER_PATH = "src/worker/inference/models/yolov4/yolov4_adapter.py"
+INPUTS_DIR = "src/worker/inference/models/yolov4/inputs"
+
+
+# --- Reference implementation (per-image arrays + final stack/astype)
+def legacy_image_preprocess(image_rgb: np.ndarray, input_size: int) -> np.ndarray:
+    ih = iw = input_size
+    h, w, _ = image_rgb.shape
+    scale = min(iw / w, ih / h)
+    nw, nh = int(scale * w), int(scale * h)
+    image_resized = cv2.resize(image_rgb, (nw, nh))
+
+    image_padded = np.full((ih, iw, 3), 128.0, dtype=np.float32)
+    dw, dh = (iw - nw) // 2, (ih - nh) // 2
+    image_padded[dh:dh + nh, dw:dw + nw, :] = image_resized.astype(np.float32)
+    image_padded = image_padded / 255.0
+    return image_padded
+
+
+def legacy_preprocess(items, input_size: int) -> np.ndarray:
+    imgs = []
+    for item in items:
+        bgr = cv2.imread(item.data)
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        imgs.append(legacy_image_preprocess(rgb, input_size))
+    return np.stack(imgs, axis=0).astype(np.float32)
+
+
+def _best_time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(batch_sizes: list[int], workers: int, repeat: int):
+    adapter = load_adapter(ADAPTER_PATH)
+    adapter.preprocess_workers = workers
+    # Full-size decode like the reference, reduced JPEG decoding is measured by decode_benchmark.py
+    adapter.reduced_decode = False
+    raw_items = collect_raw_items(INPUTS_DIR)
+    if not raw_items:
+        raise SystemExit(f"No images under {INPUTS_DIR}")
+
+    for batch_size in batch_sizes:
+        items = [raw_items[i % len(raw_items)] for i in range(batch_size)]
+        ref = legacy_preprocess(items, adapter.input_size)
+        seq = adapter.preprocess(items, {"preprocess_workers": 1})["input_1:0"]
+        par = adapter.preprocess(items, {})["input_1:0"]
+        if not (np.array_equal(ref, seq) and np.array_equal(ref, par)):
+            raise AssertionError(f"Preprocess output differs from the reference for batch_size={batch_size}")
+
+        t_ref = _best_time(lambda: legacy_preprocess(items, adapter.input_size), repeat)
+        t_seq = _best_time(lambda: adapter.preprocess(items, {"preprocess_workers": 1}), repeat)
+        t_par = _best_time(lambda: adapter.preprocess(items, {}), repeat)
+        print(f"batch={batch_size:<3} legacy={batch_size / t_ref:8.1f} img/s "
+              f"preallocated={batch_size / t_seq:8.1f} img/s "
+              f"parallel({workers})={batch_size / t_par:8.1f} img/s speedup={t_ref / t_par:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare YOLOv4 preprocess paths on the sample images")
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16,32", help="Comma separated batch sizes")
+    parser.add_argument("--workers", type=int, default=4, help="Preprocess thread pool size")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run([int(v) for v in args.batch_sizes.split(",") if v.strip()], args.workers, args.repeat)
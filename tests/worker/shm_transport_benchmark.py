@@ -0,0 +1,102 @@
+"""
+Same-host tensor transport benchmark, serialized payloads (ndarray_to_payload -> pipe -> payload_to_ndarray)
+vs the shared-memory ring (common/shm_transport.py, only slot descriptors cross the pipe).
+A consumer process plays the local engine: it checksums the feed, or runs OnnxEngine.handle_request when
+--model is given, releases the slot and replies. Checks that both paths deliver identical tensors and that
+stale descriptors are rejected after release.
+    python tests/worker/shm_transport_benchmark.py --batch-sizes 1,4,8 --repeat 20
+    python tests/worker/shm_transport_benchmark.py --model src/worker/inference/models/yolov4/yolov4.onnx
+"""
+import argparse
+import multiprocessing as mp
+import time
+from typing import Optional
+
+import numpy as np
+
+from common.model import InferenceRequest, payload_to_ndarray, tensorfeed_to_payloads
+from common.shm_transport import ShmRing, detach_all, release_request
+
+ADAPTER_PATH = "src/worker/inference/models/yolov4/yolov4_adapter.py"
+INPUT_NAME = "input_1:0"
+
+
+def consumer(conn, model_path: Optional[str]):
+    engine = None
+    if model_path:
+        from worker.inference.engines.onnx_engine import OnnxEngine
+        engine = OnnxEngine(model_path, ADAPTER_PATH)
+    while True:
+        req: Optional[InferenceRequest] = conn.recv()
+        if req is None:
+            break
+        try:
+            if engine is not None:
+                outputs = engine.handle_request(req)
+                reply = {name: float(out.sum()) for name, out in outputs.items()}
+            else:
+                feed = payload_to_ndarray(req.inputs[INPUT_NAME])
+                reply = float(feed.sum(dtype=np.float64))
+        finally:
+            release_request(req)
+        conn.send(reply)
+    detach_all()
+
+
+def _best_time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(batch_sizes: list[int], repeat: int, model_path: Optional[str]):
+    conn, child_conn = mp.Pipe()
+    proc = mp.Process(target=consumer, args=(child_conn, model_path), daemon=True)
+    proc.start()
+    rng = np.random.default_rng(0)
+    max_bytes = max(batch_sizes) * 416 * 416 * 3 * 4
+    with ShmRing(slot_size=max_bytes, num_slots=2) as ring:
+        for batch_size in batch_sizes:
+            feed = {INPUT_NAME: rng.random((batch_size, 416, 416, 3), dtype=np.float32)}
+
+            def serialized():
+                conn.send(InferenceRequest(model="yolov4", mode="tensor", inputs=tensorfeed_to_payloads(feed),
+                                           run_postprocess=False))
+                return conn.recv()
+
+            def shared():
+                conn.send(ring.request("yolov4", feed, timeout=10.0, run_postprocess=False))
+                return conn.recv()
+
+            if serialized() != shared():
+                raise AssertionError(f"batch {batch_size}: consumer saw different tensors over shared memory")
+            t_ser = _best_time(serialized, repeat)
+            t_shm = _best_time(shared, repeat)
+            mib = feed[INPUT_NAME].nbytes / 2 ** 20
+            print(f"batch={batch_size:<3} feed={mib:6.1f}MiB serialized={t_ser * 1000:8.2f}ms "
+                  f"shm={t_shm * 1000:8.2f}ms speedup={t_ser / t_shm:5.2f}x busy_slots={ring.busy_slots()}")
+
+        # A released descriptor must not map any more, the slot may already hold another request
+        stale = ring.put({INPUT_NAME: feed[INPUT_NAME][:1]})
+        ring.release(stale.values())
+        try:
+            payload_to_ndarray(stale[INPUT_NAME])
+        except ValueError:
+            print("stale descriptor rejected after release")
+        else:
+            raise AssertionError("Stale shared memory descriptor was mapped")
+        detach_all()
+        conn.send(None)
+        proc.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare serialized and shared-memory tensor transport between processes")
+    parser.add_argument("--batch-sizes", default="1,4,8")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--model", default=None, help="Run OnnxEngine in the consumer instead of a checksum")
+    args = parser.parse_args()
+    run([int(b) for b in args.batch_sizes.split(",")], args.repeat, args.model)
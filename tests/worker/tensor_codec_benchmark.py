@@ -0,0 +1,113 @@
+"""
+Tensor transport encoding benchmark (common/tensor_codec.py) on YOLOv4-shaped feeds and outputs.
+Checks the round-trip accuracy bounds of every encoding (including through the binary wire frame), then
+reports encode / decode time, wire size and the estimated transfer time on the Ethernet and WiFi data planes,
+plus what LinkPolicy picks for each link.
+    python tests/worker/tensor_codec_benchmark.py --repeat 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from common.model import ConnectionType, payload_to_ndarray
+from common.tensor_codec import DEFAULT_THROUGHPUT, LinkPolicy, available_encodings, decode_payload, \
+    encode_array, is_lossy, parse_encoding, payload_nbytes
+from common.wire import decode_request, decode_response, encode_request, encode_response, feed_to_request
+
+
+def make_tensors(seed: int = 0) -> dict[str, np.ndarray]:
+    """Letterboxed image feed (smooth content + 0.5 padding) and sigmoid-like YOLO head outputs."""
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:312, 0:416].astype(np.float32)
+    image = np.stack([xs / 416, ys / 312, (xs + ys) / 728], axis=-1)
+    image += rng.normal(0, 0.02, image.shape).astype(np.float32)
+    feed = np.full((1, 416, 416, 3), 0.5, dtype=np.float32)
+    feed[0, 52:364] = np.clip(image, 0, 1)
+    tensors = {"feed 1x416x416x3": feed}
+    for n in (52, 26, 13):
+        logits = rng.normal(-4, 2, (1, n, n, 3, 85)).astype(np.float32)
+        logits[..., :4] = rng.normal(0, 1, (1, n, n, 3, 4)) * n
+        tensors[f"output 1x{n}x{n}x3x85"] = 1 / (1 + np.exp(-np.clip(logits, -30, 30)))
+    tensors["output 1x52x52x3x85 raw"] = tensors["output 1x52x52x3x85"] * 416
+    return tensors
+
+
+def check_bounds(name: str, arr: np.ndarray, encoding, decoded: np.ndarray, params: dict):
+    if decoded.dtype != arr.dtype or decoded.shape != arr.shape:
+        raise AssertionError(f"{name} {encoding}: got {decoded.dtype}{decoded.shape}, expected {arr.dtype}{arr.shape}")
+    precision, _ = parse_encoding(encoding)
+    err = np.abs(decoded.astype(np.float64) - arr.astype(np.float64))
+    if precision is None:
+        bound = np.zeros_like(err)
+    elif precision == "float16":
+        bound = np.maximum(np.abs(arr) * 2.0 ** -11, 2.0 ** -25)
+    else:
+        # scale / 2 plus float32 rounding of the dequantized value
+        bound = np.full_like(err, params["scale"] / 2) + np.abs(arr) * 2.0 ** -22
+    if np.any(err > bound):
+        raise AssertionError(f"{name} {encoding}: max error {err.max():.3g} exceeds the bound")
+    return float(err.max())
+
+
+def _best_time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def check_wire(tensors: dict[str, np.ndarray]):
+    """Encoded tensors survive the request / response frames."""
+    feed = {"input_1:0": tensors["feed 1x416x416x3"]}
+    for encoding in available_encodings():
+        _, req = decode_request(encode_request(feed_to_request("yolov4", feed, encoding=encoding), "r1"))
+        got = payload_to_ndarray(req.inputs["input_1:0"])
+        check_bounds("wire request", feed["input_1:0"], encoding, got, req.inputs["input_1:0"].params or {})
+        outputs = {name: arr for name, arr in tensors.items() if name.startswith("output")}
+        resp = decode_response(encode_response("r1", outputs=outputs, output_encoding=encoding))
+        for name, arr in outputs.items():
+            if (encoding is None or not is_lossy(encoding)) and not np.array_equal(resp["outputs"][name], arr):
+                raise AssertionError(f"wire response {encoding}: {name} changed")
+            if not np.allclose(resp["outputs"][name], arr, rtol=2.0 ** -10, atol=arr.max() / 255):
+                raise AssertionError(f"wire response {encoding}: {name} out of bounds")
+    print("wire frames: every encoding round-trips within its bounds")
+
+
+def run(repeat: int):
+    tensors = make_tensors()
+    links = [ConnectionType.ETHERNET, ConnectionType.WIFI]
+    print(f"{'tensor':<26} {'encoding':<13} {'ratio':>6} {'encode':>9} {'decode':>9} {'max err':>9} "
+          + " ".join(f"{link.value + ' xfer':>14}" for link in links))
+    for name, arr in tensors.items():
+        for encoding in available_encodings():
+            payload = encode_array(arr, encoding)
+            decoded = decode_payload(payload) if encoding is not None else payload_to_ndarray(payload)
+            max_err = check_bounds(name, arr, encoding, decoded, payload.params or {})
+            t_enc = _best_time(lambda: encode_array(arr, encoding), repeat)
+            t_dec = _best_time(lambda: decode_payload(payload), repeat) if encoding is not None else 0.0
+            wire = payload_nbytes(payload)
+            xfer = [t_enc + wire / DEFAULT_THROUGHPUT[link] + t_dec for link in links]
+            print(f"{name:<26} {str(encoding):<13} {wire / arr.nbytes:6.3f} {t_enc * 1000:7.2f}ms {t_dec * 1000:7.2f}ms "
+                  f"{max_err:9.2e} " + " ".join(f"{t * 1000:12.2f}ms" for t in xfer))
+        print()
+
+    check_wire(tensors)
+
+    for link in links:
+        for lossy in (False, True):
+            policy = LinkPolicy(link, lossy=lossy)
+            picks = {}
+            for name, arr in tensors.items():
+                policy.calibrate(arr, repeat=repeat)
+                picks[name] = policy.choose(arr)
+            print(f"LinkPolicy {link.value:<8} lossy={lossy!s:<5} " + ", ".join(f"{n}: {e}" for n, e in picks.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark tensor transport encodings and check their accuracy")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.repeat)